@@ -1,11 +1,29 @@
 import sys
 import os
-import vtk
-from PyQt5.QtWidgets import QApplication, QMainWindow, QGridLayout, QWidget, QFileDialog, QAction, QToolBar, QSlider, QVBoxLayout, QLabel, QPushButton, QHBoxLayout  # Add QHBoxLayout here
-from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
-from PyQt5.QtCore import Qt
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtWidgets import QApplication, QMainWindow, QGridLayout, QWidget, QFileDialog, QAction, QToolBar, QSlider, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QProgressBar, QComboBox, QSpinBox, QActionGroup, QTabBar, QDoubleSpinBox  # Add QHBoxLayout here
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon, QFont
 
+from oblique import curved_reformation
+from perf_stats import PerfStats, RenderTimer
+from render_scheduler import RenderScheduler
+from study_manager import StudyManager, memory_budget, slice_at
+from surface import DEFAULT_TRIANGLE_BUDGET, export_surface
+from volume import AXES, window_level_of
+from volume_cache import VolumeCache, source_key
+from volume_lod import DEFAULT_FRAME_TIME, is_software_rendering
+from volume_loader import LoadCancelled, read_dicom_series, read_mha, study_source
+
+logger = logging.getLogger(__name__)
+
+# Degrees an oblique plane turns per arrow key press
+TILT_STEP = 2.0
+
 dark_stylesheet = """
 QMainWindow {
     background-color: #2E2E2E;
@@ -57,7 +75,78 @@ QLabel {
     color: #FFFFFF;
 }
 """
+
+
+class StudyLoader(QThread):
+    # Decodes a study off the GUI thread; the signals are delivered to the window on the GUI thread
+    volume_started = pyqtSignal(object)
+    slice_loaded = pyqtSignal(int)
+    progress = pyqtSignal(int)
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, file_path, perf, stage, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.perf = perf
+        self.stage = stage
+        self.started = time.perf_counter()
+        self.key = None  # Volume cache key of the study, set once its source files are known
+        self.cancel_event = threading.Event()
+        self.last_percent = -1
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            # A study opened before is mapped from the volume cache instead of being decoded
+            volume_cache = VolumeCache()
+            with self.perf.timed("read_volume_cache"):
+                file_names, source, series = study_source(self.file_path)
+                key = self.key = source_key(file_names)
+                volume = volume_cache.get(key)
+            if volume is not None:
+                self.loaded.emit(volume)
+                return
+
+            with self.perf.timed("decode", "mha" if self.file_path.endswith('.mha') else "dicom"):
+                if self.file_path.endswith('.mha'):
+                    volume = read_mha(self.file_path, self.report_progress, self.cancel_event)
+                else:
+                    volume = read_dicom_series(self.file_path, self.report_slice, self.report_progress,
+                                               self.cancel_event, series)
+                volume.default_window_level()  # Computed here rather than on the GUI thread
+            self.loaded.emit(volume)
+        except LoadCancelled:
+            return
+        except Exception as e:
+            logger.debug("Error loading %s", self.file_path, exc_info=True)
+            self.failed.emit(str(e))
+            return
+
+        try:
+            with self.perf.timed("write_volume_cache"):
+                volume_cache.put(key, volume, source)
+        except OSError as e:
+            logger.warning("Error caching %s: %s", self.file_path, e)
+
+    def report_slice(self, volume, index):
+        if index == 0:
+            self.volume_started.emit(volume)
+        self.slice_loaded.emit(index)
+
+    def report_progress(self, fraction):
+        percent = int(fraction * 100)
+        if percent != self.last_percent:
+            self.last_percent = percent
+            self.progress.emit(percent)
+
+
 class MPRWindow(QMainWindow):
+    # Isosurfaces are extracted on the prefetch pool and handed back to the GUI thread through this signal
+    surface_extracted = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
 
@@ -67,19 +156,44 @@ class MPRWindow(QMainWindow):
         self.layout = QGridLayout(self.main_widget)
         self.setWindowIcon(QIcon(r"C:\Users\monae\Downloads\icon.png"))
 
-        # Create VTK render windows and sliders for each panel except the 3D view
-        self.axial_view, self.axial_slider, self.axial_reset = self.create_vtk_panel_with_slider(0, 0, "Axial View")
-        self.coronal_view, self.coronal_slider, self.coronal_reset = self.create_vtk_panel_with_slider(0, 1, "Coronal View")
-        self.sagittal_view, self.sagittal_slider, self.sagittal_reset = self.create_vtk_panel_with_slider(1, 1, "Sagittal View")
-        self.three_d_view = self.create_vtk_panel(1, 0, "3D View")
-
-        # Placeholder for reslice objects to update slices
-        self.axial_reslice = None
-        self.coronal_reslice = None
-        self.sagittal_reslice = None
-
-        # DICOM reader placeholder
-        self.reader = None
+        # Create the panels and sliders; each panel holds a placeholder until create_views gives it a render window
+        self.view_placeholders = {}
+        self.axial_slider, self.axial_reset = self.create_vtk_panel_with_slider(0, 0, "Axial View")
+        self.coronal_slider, self.coronal_reset = self.create_vtk_panel_with_slider(0, 1, "Coronal View")
+        self.sagittal_slider, self.sagittal_reset = self.create_vtk_panel_with_slider(1, 1, "Sagittal View")
+        self.create_vtk_panel(1, 0, "3D View")
+        self.axial_view = self.coronal_view = self.sagittal_view = self.three_d_view = None
+
+        # Coalesces slice changes and renders into at most one render per view and frame
+        self.render_scheduler = RenderScheduler(self)
+
+        # Background worker shared by the slice caches for prefetching ahead of the sliders
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=2)
+
+        # Per-stage timings (loading, reslicing, window/level, picking, rendering) for each view
+        self.perf = PerfStats()
+
+        # Display pipelines of the four panels and their render timers, built by create_views with the panels
+        self.session = None
+        self.render_timers = []
+        self.frame_stats_visible = False
+
+        # Background loader for the study currently being decoded
+        self.loader = None
+
+        # Open studies, one tab each, sharing MPR_STUDY_BUDGET_MB of memory; only self.study is on display
+        self.studies = StudyManager(max_bytes=memory_budget())
+        self.study = None
+        self.link_slices = False
+        self.linked_positions = None
+
+        # 3D rendering: "auto" picks CPU level-of-detail rendering when OpenGL runs in software
+        self.volume_render_mode = "auto"
+        self.software_rendering = None
+        self.surface_mesh = None
+        self.surface_request = None  # (volume, threshold) of the isosurface being extracted, if any
+        self.surface_extracted.connect(self.on_surface_extracted)
+        self.frame_time_target = DEFAULT_FRAME_TIME
 
         # Create a toolbar with an upload action
         self.create_toolbar()
@@ -95,6 +209,73 @@ class MPRWindow(QMainWindow):
         # Set up the VTK interaction events
         self.setup_vtk_interaction()
 
+    def create_views(self):
+        # VTK, the four render windows and their pipelines are only loaded once there is a study to show,
+        # so the window itself opens without waiting for them
+        if self.session is not None:
+            return
+        with self.perf.timed("create_views"):
+            import vtkmodules.vtkInteractionStyle  # noqa: F401
+            import vtkmodules.vtkRenderingOpenGL2  # noqa: F401
+            from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+            from viewer_session import ViewerSession
+
+            views = {}
+            for position, (panel_layout, placeholder) in self.view_placeholders.items():
+                views[position] = QVTKRenderWindowInteractor(self.main_widget)
+                panel_layout.replaceWidget(placeholder, views[position])
+                placeholder.deleteLater()
+                views[position].show()
+            self.view_placeholders = {}
+            self.axial_view, self.coronal_view = views[(0, 0)], views[(0, 1)]
+            self.sagittal_view, self.three_d_view = views[(1, 1)], views[(1, 0)]
+
+            # Display pipelines of the four panels, built once and reused for every study loaded
+            self.session = ViewerSession({"axial": self.axial_view.GetRenderWindow(),
+                                          "coronal": self.coronal_view.GetRenderWindow(),
+                                          "sagittal": self.sagittal_view.GetRenderWindow()},
+                                         self.three_d_view.GetRenderWindow(), self.prefetch_pool, self.perf)
+            self.session.set_projection(self.projection_box.currentData(), self.slab_thickness_box.value())
+
+            # Every Render() of a panel is timed; the optional overlay shows its FPS and last frame cost
+            volume_pipeline = self.session.volume_pipeline
+            self.render_timers = [RenderTimer(self.perf, axis, view.render_window, view.renderer)
+                                  for axis, view in self.session.slice_pipelines.items()]
+            self.render_timers.append(RenderTimer(self.perf, "3d", volume_pipeline.render_window,
+                                                  volume_pipeline.renderer))
+            for render_timer in self.render_timers:
+                render_timer.set_visible(self.frame_stats_visible)
+
+            # Set up interactor for axial, coronal, and sagittal views to capture mouse clicks
+            self.setup_interactor(self.axial_view, self.on_click_axial, "axial")
+            self.setup_interactor(self.coronal_view, self.on_click_coronal, "coronal")
+            self.setup_interactor(self.sagittal_view, self.on_click_sagittal, "sagittal")
+            self.set_left_button_mode(self.left_button_mode)
+
+    @property
+    def engine(self):
+        # Slice engine of the study on display
+        return self.session.engine if self.session is not None else None
+
+    def slice_view(self, axis):
+        # Display pipeline of a 2D view, if it shows the current study
+        view = self.session.slice_pipelines.get(axis) if self.session is not None else None
+        return view if view is not None and view.active else None
+
+    def closeEvent(self, event):
+        # Stop decoding and let go of the study and the prefetch worker before the window goes away
+        if self.loader is not None:
+            self.loader.cancel()
+        if self.session is not None:
+            self.session.release()
+        self.prefetch_pool.shutdown(wait=False)
+
+        # MPR_PERF_DUMP=<file.json> keeps the timings of a session without going through the toolbar
+        dump_path = os.environ.get("MPR_PERF_DUMP")
+        if dump_path:
+            self.save_perf_stats(dump_path)
+        super().closeEvent(event)
+
     def create_toolbar(self):
         # Set up the toolbar
         toolbar = QToolBar("Main Toolbar")
@@ -116,6 +297,115 @@ class MPRWindow(QMainWindow):
         # Add the mouse controls action to the toolbar
         toolbar.addAction(mouse_controls_action)
 
+        # 3D rendering mode and the frame time to hold while the 3D camera moves
+        self.volume_render_mode_box = QComboBox()
+        for label, mode in (("3D: Auto", "auto"), ("3D: GPU", "gpu"), ("3D: CPU LOD", "cpu"),
+                            ("3D: Surface", "surface")):
+            self.volume_render_mode_box.addItem(label, mode)
+        self.volume_render_mode_box.currentIndexChanged.connect(self.set_volume_render_mode)
+        toolbar.addWidget(self.volume_render_mode_box)
+
+        # Isosurface threshold in stored voxel values; only applied when it is committed, not per keystroke
+        self.iso_threshold_box = QDoubleSpinBox()
+        self.iso_threshold_box.setPrefix("Iso ")
+        self.iso_threshold_box.setDecimals(1)
+        self.iso_threshold_box.setKeyboardTracking(False)
+        self.iso_threshold_box.setToolTip("Isosurface threshold of the 3D surface mode")
+        self.iso_threshold_box.valueChanged.connect(self.set_iso_threshold)
+        toolbar.addWidget(self.iso_threshold_box)
+
+        export_surface_action = QAction("Export Surface", self)
+        export_surface_action.setStatusTip("Save the 3D surface mesh as STL, PLY, OBJ or VTP")
+        export_surface_action.triggered.connect(lambda: self.export_surface_mesh())
+        toolbar.addAction(export_surface_action)
+
+        frame_time_box = QSpinBox()
+        frame_time_box.setRange(10, 1000)
+        frame_time_box.setSuffix(" ms/frame")
+        frame_time_box.setValue(int(self.frame_time_target * 1000))
+        frame_time_box.setToolTip("Frame time target while rotating the 3D view")
+        frame_time_box.valueChanged.connect(self.set_frame_time_target)
+        toolbar.addWidget(frame_time_box)
+
+        # Window/level presets of the loaded volume (percentile default, CT lung/bone/soft tissue, ...)
+        self.window_preset_box = QComboBox()
+        self.window_preset_box.setToolTip("Window/level preset")
+        self.window_preset_box.activated.connect(self.apply_window_preset)
+        toolbar.addWidget(self.window_preset_box)
+
+        # Thick-slab projection of the 2D views and the slab thickness in slices
+        self.projection_box = QComboBox()
+        for label, mode in (("Slab: Off", "slice"), ("Slab: MIP", "mip"), ("Slab: MinIP", "minip"),
+                            ("Slab: Average", "average")):
+            self.projection_box.addItem(label, mode)
+        self.projection_box.currentIndexChanged.connect(self.set_projection)
+        toolbar.addWidget(self.projection_box)
+
+        self.slab_thickness_box = QSpinBox()
+        self.slab_thickness_box.setRange(2, 500)
+        self.slab_thickness_box.setValue(20)
+        self.slab_thickness_box.setSuffix(" slices")
+        self.slab_thickness_box.setToolTip("Slab thickness")
+        self.slab_thickness_box.valueChanged.connect(self.set_projection)
+        toolbar.addWidget(self.slab_thickness_box)
+
+        # Left-button tools of the 2D views; at most one of them is on at a time
+        left_button_tools = QActionGroup(self)
+        left_button_tools.setExclusionPolicy(QActionGroup.ExclusionPolicy.ExclusiveOptional)
+
+        # Crosshair navigation: left-drag in a 2D view to move the other two views with the mouse
+        crosshair_action = QAction("Crosshair", self)
+        crosshair_action.setCheckable(True)
+        crosshair_action.setStatusTip("Drag with the left button to move the other views along")
+        crosshair_action.toggled.connect(self.set_crosshair_mode)
+        left_button_tools.addAction(crosshair_action)
+        toolbar.addAction(crosshair_action)
+
+        # Curved MPR: click points along a vessel or the spine in one 2D view, untoggle to straighten it
+        curve_action = QAction("Curved MPR", self)
+        curve_action.setCheckable(True)
+        curve_action.setStatusTip("Click points along a curve in a 2D view; untoggle to show the curved reformation")
+        curve_action.toggled.connect(self.set_curve_mode)
+        left_button_tools.addAction(curve_action)
+        toolbar.addAction(curve_action)
+
+        # Linked slices: a study switched to opens at the same world position as the one left
+        link_action = QAction("Link Slices", self)
+        link_action.setCheckable(True)
+        link_action.setStatusTip("Keep the slice positions when switching between studies")
+        link_action.toggled.connect(self.set_link_slices)
+        toolbar.addAction(link_action)
+
+        # Frame-time overlay in every panel and a JSON dump of the collected timings
+        frame_stats_action = QAction("Frame Stats", self)
+        frame_stats_action.setCheckable(True)
+        frame_stats_action.setStatusTip("Show FPS and last frame cost in each view")
+        frame_stats_action.toggled.connect(self.show_frame_stats)
+        toolbar.addAction(frame_stats_action)
+
+        save_stats_action = QAction("Save Stats", self)
+        save_stats_action.setStatusTip("Save per-stage timings as JSON")
+        save_stats_action.triggered.connect(lambda: self.save_perf_stats())
+        toolbar.addAction(save_stats_action)
+
+        # Progress of the study being loaded in the background
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress_action = toolbar.addWidget(self.load_progress)
+        self.load_progress_action.setVisible(False)
+
+        # One tab per open study, on a toolbar row of its own
+        self.addToolBarBreak()
+        study_toolbar = QToolBar("Studies")
+        self.addToolBar(study_toolbar)
+        self.study_tabs = QTabBar()
+        self.study_tabs.setTabsClosable(True)
+        self.study_tabs.setExpanding(False)
+        self.study_tabs.currentChanged.connect(self.on_study_tab_changed)
+        self.study_tabs.tabCloseRequested.connect(lambda index: self.close_study(self.study_tabs.tabData(index)))
+        study_toolbar.addWidget(self.study_tabs)
+
     def create_vtk_panel_with_slider(self, row, col, title):
         # Create a horizontal layout to combine the panel and the slider
         combined_layout = QHBoxLayout()
@@ -128,9 +418,10 @@ class MPRWindow(QMainWindow):
         title_label.setFont(QFont("Stylus", 9, QFont.Bold))
         panel_layout.addWidget(title_label)
 
-        # Create the VTK render window
-        vtk_widget = QVTKRenderWindowInteractor(self.main_widget)
-        panel_layout.addWidget(vtk_widget)
+        # Placeholder for the VTK render window, which create_views puts in its place
+        placeholder = QWidget(self.main_widget)
+        panel_layout.addWidget(placeholder)
+        self.view_placeholders[(row, col)] = (panel_layout, placeholder)
 
         # Add the VTK panel layout to the combined layout
         combined_layout.addLayout(panel_layout)
@@ -153,7 +444,7 @@ class MPRWindow(QMainWindow):
         # Add the combined layout to the main grid layout
         self.layout.addLayout(combined_layout, row, col)
 
-        return vtk_widget, slider, reset_button
+        return slider, reset_button
 
     def create_vtk_panel(self, row, col, title):
         # Set up a layout for the panel, title, and reset button
@@ -164,9 +455,10 @@ class MPRWindow(QMainWindow):
         title_label.setFont(QFont("Stylus", 9, QFont.Bold))
         panel_layout.addWidget(title_label)
 
-        # Create the VTK render window
-        vtk_widget = QVTKRenderWindowInteractor(self.main_widget)
-        panel_layout.addWidget(vtk_widget)
+        # Placeholder for the VTK render window, which create_views puts in its place
+        placeholder = QWidget(self.main_widget)
+        panel_layout.addWidget(placeholder)
+        self.view_placeholders[(row, col)] = (panel_layout, placeholder)
 
         # Create a reset button
         reset_button = QPushButton("Reset View")
@@ -177,10 +469,11 @@ class MPRWindow(QMainWindow):
         # Add the layout to the main grid layout
         self.layout.addLayout(panel_layout, row, col)
 
-        return vtk_widget
-
     def reset_view(self, row, col):
-        # Reset the view based on which panel's reset button is clicked
+        # Reset the view based on which panel's reset button is clicked; a tilted plane is levelled again
+        axis = self.view_axis(row, col)
+        if axis is not None:
+            self.set_tilt(axis, (0.0, 0.0))
         if row == 0 and col == 0:  # Axial
             self.axial_slider.setValue(0)
             self.update_slice(0, 0, 0)
@@ -203,283 +496,674 @@ class MPRWindow(QMainWindow):
                 self.load_mha_data(file_path)
 
     def load_dicom_data(self, dicom_file):
-        try:
-            # Load DICOM data using vtkDICOMImageReader
-            reader = vtk.vtkDICOMImageReader()
-            reader.SetDirectoryName(os.path.dirname(dicom_file))  # Set directory for DICOM files
-            reader.Update()
-
-            if reader.GetOutput() is None:
-                print("Error: Failed to load DICOM data")
-                return
-
-            self.reader = reader
-
-            # Get the number of slices for each orientation
-            dimensions = reader.GetOutput().GetDimensions()  # Get dimensions of the volume
-            self.axial_slices = dimensions[2]  # Depth
-            self.coronal_slices = dimensions[1]  # Height
-            self.sagittal_slices = dimensions[0]  # Width
-
-            # Set slider ranges according to the number of slices
-            self.axial_slider.setRange(0, self.axial_slices - 1)
-            self.coronal_slider.setRange(0, self.coronal_slices - 1)
-            self.sagittal_slider.setRange(0, self.sagittal_slices - 1)
-
-            # Initialize sliders to the first slice
-            self.axial_slider.setValue(0)
-            self.coronal_slider.setValue(0)
-            self.sagittal_slider.setValue(0)
-
-            # Setup renderers for each view (axial, coronal, sagittal)
-            self.axial_reslice = self.setup_slice_view(self.axial_view, reader, [1, 0, 0, 0, 1, 0, 0, 0, 1], 0)  # Axial
-            self.coronal_reslice = self.setup_slice_view(self.coronal_view, reader, [1, 0, 0, 0, 0, 1, 0, -1, 0],
-                                                         0)  # Coronal
-
-            # Update sagittal orientation to switch axes
-            self.sagittal_reslice = self.setup_slice_view(self.sagittal_view, reader, [0, 1, 0, 0, 0, 1, 1, 0, 0],
-                                                          0)  # Sagittal
-
-            # Create 3D volume rendering in the bottom-left panel
-            self.setup_3d_view(self.three_d_view, reader)
-
-        except Exception as e:
-            print(f"Error loading DICOM file: {e}")
+        # Slices are decoded one file at a time and appear in the axial view as they arrive
+        self.open_study(dicom_file, "load_dicom_data")
 
     def load_mha_data(self, mha_file):
-        try:
-            # Load MHA data using vtkMetaImageReader
-            reader = vtk.vtkMetaImageReader()
-            reader.SetFileName(mha_file)  # Set the MHA file
-            reader.Update()
-
-            if reader.GetOutput() is None:
-                print("Error: Failed to load MHA data")
-                return
-
-            self.reader = reader
-
-            # Get the number of slices for each orientation
-            dimensions = reader.GetOutput().GetDimensions()  # Get dimensions of the volume
-            self.axial_slices = dimensions[2]  # Depth
-            self.coronal_slices = dimensions[1]  # Height
-            self.sagittal_slices = dimensions[0]  # Width
-
-            # Set slider ranges according to the number of slices
-            self.axial_slider.setRange(0, self.axial_slices - 1)
-            self.coronal_slider.setRange(0, self.coronal_slices - 1)
-            self.sagittal_slider.setRange(0, self.sagittal_slices - 1)
-
-            # Initialize sliders to the first slice
+        # The MHA volume is shown once vtkMetaImageReader has decoded all of it
+        self.open_study(mha_file, "load_mha_data")
+
+    def open_study(self, file_path, stage):
+        # A study that is already open is switched to rather than read again
+        study = self.studies.find(file_path)
+        if study is None:
+            study = self.studies.open(file_path)
+            self.study_tabs.blockSignals(True)
+            index = self.study_tabs.addTab(study.name)
+            self.study_tabs.setTabData(index, study)
+            self.study_tabs.setTabToolTip(index, study.file_path)
+            self.study_tabs.blockSignals(False)
+        self.show_study(study, stage)
+
+    def study_tab(self, study):
+        for index in range(self.study_tabs.count()):
+            if self.study_tabs.tabData(index) is study:
+                return index
+        return -1
+
+    def on_study_tab_changed(self, index):
+        study = self.study_tabs.tabData(index) if index >= 0 else None
+        if study is not None:
+            self.show_study(study, "load_mha_data" if study.file_path.endswith(".mha") else "load_dicom_data")
+
+    def show_study(self, study, stage):
+        if study is self.study:
+            return
+        self.create_views()
+        # The study left keeps its slices, window/level and tilts; a study still loading is read again later
+        linked_positions = None
+        if self.study is not None:
+            self.study.save_state({axis: self.current_slice(axis) for axis in AXES}, self.engine)
+            if self.link_slices:
+                linked_positions = self.study.positions
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+            self.load_progress_action.setVisible(False)
+        self.study = study
+        self.linked_positions = linked_positions
+        self.study_tabs.blockSignals(True)
+        self.study_tabs.setCurrentIndex(self.study_tab(study))
+        self.study_tabs.blockSignals(False)
+
+        # A study seen before is still in memory or mapped back from the volume cache
+        with self.perf.timed("switch_study"):
+            volume = self.studies.activate(study)
+            if volume is not None:
+                self.display_volume(volume)
+                self.restore_study_state(study)
+        if volume is None:
+            self.start_loading(study.file_path, stage)
+
+    def restore_study_state(self, study):
+        if study.window_level is not None:
+            self.set_window_level(*study.window_level)
+        for axis, tilt in study.tilts.items():
+            self.set_tilt(axis, tilt)
+        # Linked slices follow the study just left, otherwise the study comes back where it was
+        positions = self.linked_positions or {}
+        for axis in AXES:
+            if axis in positions:
+                index = slice_at(study.volume, axis, positions[axis])
+            elif axis in study.slices:
+                index = study.slices[axis]
+            else:
+                continue
+            self.slider(axis).setValue(index)
+        self.linked_positions = None
+
+    def close_study(self, study):
+        if study is None:
+            return
+        if study is self.study:
+            if self.loader is not None:
+                self.loader.cancel()
+                self.loader = None
+                self.load_progress_action.setVisible(False)
+            self.study = None
+            self.session.release()
+            self.clear_views()
+            self.clear_curve()
+            self.curved_image = None
+            self.surface_mesh = None
+        self.studies.close(study)
+        # Removing the current tab selects a neighbour, which is then shown through on_study_tab_changed
+        self.study_tabs.removeTab(self.study_tab(study))
+
+    def set_link_slices(self, enabled):
+        self.link_slices = enabled
+
+    def start_loading(self, file_path, stage):
+        # Cancel the study still being decoded; its remaining signals are ignored
+        if self.loader is not None:
+            self.loader.cancel()
+
+        self.loader = StudyLoader(file_path, self.perf, stage, self)
+        self.loader.volume_started.connect(self.on_volume_started)
+        self.loader.slice_loaded.connect(self.on_slice_loaded)
+        self.loader.progress.connect(self.on_load_progress)
+        self.loader.loaded.connect(self.on_volume_loaded)
+        self.loader.failed.connect(self.on_load_failed)
+        self.loader.finished.connect(self.loader.deleteLater)
+
+        self.load_progress.setValue(0)
+        self.load_progress_action.setVisible(True)
+        self.loader.start()
+
+    def on_load_progress(self, percent):
+        if self.sender() is self.loader:
+            self.load_progress.setValue(percent)
+
+    def on_load_failed(self, message):
+        if self.sender() is self.loader:
+            self.load_progress_action.setVisible(False)
+            logger.error("Error loading %s: %s", self.loader.file_path, message)
+            self.loader = None
+            self.close_study(self.study)
+
+    def on_volume_started(self, volume):
+        if self.sender() is not self.loader:
+            return
+
+        # Time until the first slice can be shown
+        self.perf.record(self.loader.stage, time.perf_counter() - self.loader.started, "first_slice")
+
+        # Window/level from the first slice until the whole volume is available
+        self.session.load(volume, window_level_of(volume.array[0]), axes=("axial",))
+        self.clear_views()
+
+        self.axial_slices = 1
+        self.axial_slider.setRange(0, 0)
+        self.show_slice(self.slice_view("axial"), 0)
+
+    def on_slice_loaded(self, index):
+        view = self.slice_view("axial")
+        if self.sender() is not self.loader or view is None:
+            return
+
+        # Let the axial slider reach every slice decoded so far
+        self.axial_slices = index + 1
+        self.axial_slider.setMaximum(index)
+        view.cache.limit = index + 1
+        if self.axial_slider.value() == index:
+            self.show_slice(view, index)
+
+    def on_volume_loaded(self, volume):
+        if self.sender() is not self.loader:
+            return
+        self.load_progress_action.setVisible(False)
+        # The new study may push older ones out of memory
+        self.studies.loaded(self.study, self.loader.key, volume)
+        self.display_volume(volume)
+        self.restore_study_state(self.study)
+        # Selecting the file to all views being filled, decoding (or reading the volume cache) included
+        self.perf.record(self.loader.stage, time.perf_counter() - self.loader.started)
+
+    def clear_views(self):
+        # Drop slice updates still queued for the previous study and redraw the panels
+        for vtk_widget in (self.axial_view, self.coronal_view, self.sagittal_view, self.three_d_view):
+            render_window = vtk_widget.GetRenderWindow()
+            self.render_scheduler.cancel(render_window)
+            self.render_scheduler.request_render(render_window, render_window)
+
+    def display_volume(self, volume):
+        if self.engine is None or self.engine.volume is not volume:
+            # Hand the decoded voxels to the slice engine; the previous study is released first
+            self.session.load(volume)
+            self.clear_views()
+            self.clear_curve()
+            self.curved_image = None
+            self.surface_mesh = None
             self.axial_slider.setValue(0)
-            self.coronal_slider.setValue(0)
-            self.sagittal_slider.setValue(0)
-
-            # Setup renderers for each view (axial, coronal, sagittal)
-            self.axial_reslice = self.setup_slice_view(self.axial_view, reader, [1, 0, 0, 0, 1, 0, 0, 0, 1], 0)  # Axial
-            self.coronal_reslice = self.setup_slice_view(self.coronal_view, reader, [1, 0, 0, 0, 0, 1, 0, -1, 0],
-                                                         0)  # Coronal
+        else:
+            # Replace the provisional window/level taken from the first slice
+            self.set_window_level(*volume.default_window_level())
+            self.session.attach_remaining()
+
+        # Get the number of slices for each orientation
+        self.axial_slices = self.engine.slice_count("axial")  # Depth
+        self.coronal_slices = self.engine.slice_count("coronal")  # Height
+        self.sagittal_slices = self.engine.slice_count("sagittal")  # Width
+
+        # Set slider ranges according to the number of slices
+        self.axial_slider.setRange(0, self.axial_slices - 1)
+        self.coronal_slider.setRange(0, self.coronal_slices - 1)
+        self.sagittal_slider.setRange(0, self.sagittal_slices - 1)
+
+        # Initialize the coronal and sagittal sliders to the first slice
+        self.coronal_slider.setValue(0)
+        self.sagittal_slider.setValue(0)
+
+        # Fill each view (axial, coronal, sagittal); the first frame is drawn by the render scheduler
+        for axis, view in self.session.slice_pipelines.items():
+            view.cache.limit = self.engine.slice_count(axis)
+            view.render_window.GetInteractor().Initialize()
+            self.show_slice(view, self.current_slice(axis))
+
+        # The surface threshold starts at the centre of the default window
+        histogram = volume.histogram
+        self.iso_threshold_box.blockSignals(True)
+        if histogram is not None and histogram.minimum is not None:
+            self.iso_threshold_box.setRange(float(histogram.minimum), float(histogram.maximum))
+            self.iso_threshold_box.setSingleStep(max((float(histogram.maximum) - float(histogram.minimum)) / 100, 0.1))
+        self.iso_threshold_box.setValue(volume.default_window_level()[1])
+        self.iso_threshold_box.blockSignals(False)
+
+        # Create 3D volume rendering in the bottom-left panel once the 2D views have drawn their first frame,
+        # so volume or surface setup never holds back the first slice
+        self.render_scheduler.after_frame(lambda: self.setup_3d_view_of(volume))
+
+        # Presets only read the volume's histogram, so switching them costs no pass over the voxels
+        self.window_preset_box.blockSignals(True)
+        self.window_preset_box.clear()
+        for name, window_level in volume.window_presets.items():
+            self.window_preset_box.addItem(name, window_level)
+        self.window_preset_box.blockSignals(False)
+
+    def calculate_window_level(self, volume):
+        # Percentile window from the histogram built while loading; computed once per volume
+        default_window, default_level = volume.default_window_level()
+        return default_window, default_level
 
-            # Update sagittal orientation to switch axes
-            self.sagittal_reslice = self.setup_slice_view(self.sagittal_view, reader, [0, 1, 0, 0, 0, 1, 1, 0, 0],
-                                                          0)  # Sagittal
+    def show_slice(self, view, slice_index, render=True):
+        # Reslice, window/level and copy into the display buffer; the render itself is timed separately
+        with self.perf.timed("update_slice", view.axis):
+            view.show_slice(slice_index)
+        if render:
+            self.render_scheduler.request_render(view.render_window, view.render_window)
 
-            # Create 3D volume rendering in the bottom-left panel
-            self.setup_3d_view(self.three_d_view, reader)
+    def setup_3d_view(self, vtk_widget, volume_data):
+        # Calculate dynamic window/level
+        window_level = self.calculate_window_level(volume_data)
 
+        # Initialize the interactor for the 3D view
+        render_window = vtk_widget.GetRenderWindow()
+        interactor = render_window.GetInteractor()
+        interactor.Initialize()
+        interactor.SetDesiredUpdateRate(1.0 / self.frame_time_target)
+
+        if self.volume_render_mode == "surface":
+            self.show_surface(volume_data)
+            return
+
+        # GPU ray casting, unless CPU rendering was chosen or OpenGL is rasterized in software
+        if self.volume_render_mode == "auto" and self.software_rendering is None:
+            render_window.Render()  # The OpenGL context must exist before it can be queried
+            self.software_rendering = is_software_rendering(render_window)
+        use_gpu = self.volume_render_mode == "gpu" or (self.volume_render_mode == "auto" and not self.software_rendering)
+        with self.perf.timed("setup_3d_view", "gpu" if use_gpu else "cpu"):
+            # The full-resolution frame after an interaction is drawn by the render scheduler like any other
+            self.session.volume_pipeline.attach(
+                volume_data, window_level, use_gpu, self.frame_time_target, interactor,
+                lambda: self.render_scheduler.request_render(render_window, render_window))
+        self.render_scheduler.request_render(render_window, render_window)
+
+    def setup_3d_view_of(self, volume):
+        # The study may have been switched or closed while waiting for the frame
+        if self.engine is not None and self.engine.volume is volume:
+            self.setup_3d_view(self.three_d_view, volume)
+
+    def show_surface(self, volume_data):
+        # Meshes are cached per threshold, in memory and, for studies with a volume cache key, on disk. A mesh
+        # that is not cached yet is extracted on the prefetch pool; the current one stays up until it is ready
+        key = self.study.key if self.study is not None and self.study.volume is volume_data else None
+        threshold = self.iso_threshold_box.value()
+        request = self.surface_request = (volume_data, threshold)
+        started = time.perf_counter()
+        future = self.prefetch_pool.submit(self.extract_surface, request, key)
+        future.add_done_callback(lambda future: self.surface_extracted.emit((request, future, started)))
+
+    def extract_surface(self, request, key):
+        # Runs on the prefetch pool; a request superseded while it waited in the queue is not extracted
+        if request is not self.surface_request:
+            return None
+        volume_data, threshold = request
+        return self.session.surfaces.get(volume_data, threshold, DEFAULT_TRIANGLE_BUDGET, key)
+
+    def on_surface_extracted(self, result):
+        request, future, started = result
+        # A newer threshold, another study or another 3D mode supersedes this mesh
+        if request is not self.surface_request:
+            return
+        self.surface_request = None
+        volume_data, threshold = request
+        if self.volume_render_mode != "surface" or self.engine is None or self.engine.volume is not volume_data:
+            return
+        try:
+            mesh = future.result()
         except Exception as e:
-            print(f"Error loading MHA file: {e}")
-
-    def calculate_window_level(self, image_data):
-        scalar_range = image_data.GetScalarRange()
-        min_val, max_val = scalar_range[0], scalar_range[1]
-
-        # Compute window (contrast) and level (brightness)
-        default_window = max_val - min_val  # Window is the range of intensity values
-        default_level = (max_val + min_val) / 2  # Level is the midpoint
-
-        return default_window, default_level
+            logger.error("Error extracting the isosurface at %s: %s", threshold, e)
+            return
+        self.session.volume_pipeline.show_surface(mesh)
+        self.surface_mesh = mesh
+        self.perf.record("setup_3d_view", time.perf_counter() - started, "surface")
+        logger.debug("Isosurface at %s: %d triangles", threshold, mesh.GetNumberOfCells())
+        render_window = self.three_d_view.GetRenderWindow()
+        self.render_scheduler.request_render(render_window, render_window)
+
+    def set_iso_threshold(self, value):
+        if self.volume_render_mode == "surface" and self.engine is not None and \
+                all(view.active for view in self.session.slice_pipelines.values()):
+            self.show_surface(self.engine.volume)
+
+    def export_surface_mesh(self, file_path=None):
+        if self.surface_mesh is None or self.volume_render_mode != "surface":
+            logger.warning("Switch the 3D view to surface mode to export its mesh")
+            return
+        if file_path is None:
+            file_path, _ = QFileDialog.getSaveFileName(self, "Export Surface", "surface.stl",
+                                                       "Meshes (*.stl *.ply *.obj *.vtp)")
+            if not file_path:
+                return
+        try:
+            export_surface(self.surface_mesh, file_path)
+        except (OSError, ValueError) as e:
+            logger.error("Error exporting the surface to %s: %s", file_path, e)
+        else:
+            logger.info("Surface saved to %s", file_path)
 
-    def setup_slice_view(self, vtk_widget, reader, orientation, slice_index):
-        # Set up a slice renderer
-        reslice = vtk.vtkImageReslice()
-        reslice.SetInputConnection(reader.GetOutputPort())
-        reslice.SetOutputDimensionality(2)
-        reslice.SetResliceAxesDirectionCosines(orientation)
-        reslice.SetInterpolationModeToLinear()
-        reslice.SetResliceAxesOrigin(0, 0, slice_index)
-
-        # Get image data and calculate dynamic window/level
-        image_data = reader.GetOutput()
-        default_window, default_level = self.calculate_window_level(image_data)
-
-        # Create a window/level filter to adjust brightness and contrast
-        window_level = vtk.vtkImageMapToWindowLevelColors()
-        window_level.SetInputConnection(reslice.GetOutputPort())
-
-        # Set window (contrast) and level (brightness) dynamically
-        window_level.SetWindow(default_window)  # Adjusted contrast
-        window_level.SetLevel(default_level)  # Adjusted brightness
-        # Mapper and actor for displaying the slice
-        slice_mapper = vtk.vtkImageActor()
-        slice_mapper.GetMapper().SetInputConnection(window_level.GetOutputPort())
-
-        # Create a renderer for the specific view
-        renderer = vtk.vtkRenderer()
-        renderer.AddActor(slice_mapper)
-
-        # Set up the VTK render window and interactor for the specific panel
-        vtk_widget.GetRenderWindow().AddRenderer(renderer)
-
-        # Set interactor style to lock view for 2D slices (Axial, Coronal, Sagittal)
-        interactor = vtk_widget.GetRenderWindow().GetInteractor()
-        interactor.SetInteractorStyle(vtk.vtkInteractorStyleImage())
-
-        # Initialize and render the interactor
-        vtk_widget.GetRenderWindow().Render()
-        vtk_widget.GetRenderWindow().GetInteractor().Initialize()
-
-        return reslice
-
-    def setup_3d_view(self, vtk_widget, reader):
-        # Create a 3D volume rendering of the data
-        volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
-        volume_mapper.SetInputConnection(reader.GetOutputPort())
-
-        # Get image data and calculate dynamic window/level
-        image_data = reader.GetOutput()
-        default_window, default_level = self.calculate_window_level(image_data)
-
-        # Create a volume property
-        volume_property = vtk.vtkVolumeProperty()
-        volume_property.ShadeOn()
-        volume_property.SetInterpolationTypeToLinear()
-
-        # Set scalar opacity based on calculated window/level
-        opacity = vtk.vtkPiecewiseFunction()
-        opacity.AddPoint(default_level - default_window / 2, 0.0)
-        opacity.AddPoint(default_level + default_window / 2, 1.0)
-        volume_property.SetScalarOpacity(opacity)
-
-        # Set color transfer function for brightness/contrast control
-        color = vtk.vtkColorTransferFunction()
-        color.AddRGBPoint(default_level - default_window / 2, 0.0, 0.0, 0.0)
-        color.AddRGBPoint(default_level + default_window / 2, 1.0, 1.0, 1.0)
-        volume_property.SetColor(color)
-
-        # Create a volume actor
-        volume = vtk.vtkVolume()
-        volume.SetMapper(volume_mapper)
-        volume.SetProperty(volume_property)
-
-        # Create the renderer for the 3D view
-        renderer = vtk.vtkRenderer()
-        renderer.AddVolume(volume)
-        vtk_widget.GetRenderWindow().AddRenderer(renderer)
+    def set_volume_render_mode(self, index):
+        self.volume_render_mode = self.volume_render_mode_box.itemData(index)
+        if self.engine is not None and all(view.active for view in self.session.slice_pipelines.values()):
+            self.setup_3d_view(self.three_d_view, self.engine.volume)
 
-        # Initialize the interactor for the 3D view
-        interactor = vtk_widget.GetRenderWindow().GetInteractor()
-        interactor.Initialize()
-        vtk_widget.GetRenderWindow().Render()
+    def set_frame_time_target(self, milliseconds):
+        self.frame_time_target = milliseconds / 1000.0
+        if self.session is None:
+            return
+        self.three_d_view.GetRenderWindow().GetInteractor().SetDesiredUpdateRate(1.0 / self.frame_time_target)
+        self.session.volume_pipeline.set_frame_time(self.frame_time_target)
 
     def update_slice(self, value, row, col):
         # Update the slice based on which panel's slider is moved
-        if row == 0 and col == 0:  # Axial
-            if self.axial_reslice:
-                if value < self.axial_slices:  # Check within range
-                    self.axial_reslice.SetResliceAxesOrigin(0, 0, value)  # Axial slices move along Z-axis
-                    self.axial_view.GetRenderWindow().Render()
-        elif row == 0 and col == 1:  # Coronal
-            if self.coronal_reslice:
-                if value < self.coronal_slices:  # Check within range
-                    self.coronal_reslice.SetResliceAxesOrigin(0, value, 0)  # Coronal slices move along Y-axis
-                    self.coronal_view.GetRenderWindow().Render()
-        elif row == 1 and col == 1:  # Sagittal
-            if self.sagittal_reslice:
-                if value < self.sagittal_slices:  # Check within range
-                    self.sagittal_reslice.SetResliceAxesOrigin(value, 0, 0)  # Sagittal slices move along X-axis
-                    self.sagittal_view.GetRenderWindow().Render()
+        axis = self.view_axis(row, col)
+        view = self.slice_view(axis)
+        if view and value < self.engine.slice_count(axis):  # Check within range
+            # Extracted and rendered on the next frame, unless a newer position replaces it first
+            self.render_scheduler.request_slice(view.render_window, value,
+                                                lambda index: self.show_slice(view, index, render=False),
+                                                view.render_window)
+
+    def view_axis(self, row, col):
+        # Grid position of each 2D panel
+        return {(0, 0): "axial", (0, 1): "coronal", (1, 1): "sagittal"}.get((row, col))
 
     def setup_vtk_interaction(self):
-        # Set up interactor for axial, coronal, and sagittal views to capture mouse clicks
-        self.setup_interactor(self.axial_view, self.on_click_axial)
-        self.setup_interactor(self.coronal_view, self.on_click_coronal)
-        self.setup_interactor(self.sagittal_view, self.on_click_sagittal)
+        # Left-button tools: "crosshair" drags move the other two views, "curve" clicks add centreline points;
+        # either replaces window/levelling with the left button
+        self.left_button_mode = None
+        self.left_button_observers = {}
+        self.crosshair_drag = None
+        self.slice_styles = {}
+
+        # Curved MPR: centreline points in world (x, y, z) and as drawn in the view they were clicked in
+        self.curve_axis = None
+        self.curve_points = []
+        self.curve_plane_points = []
+        self.curved_view = None
+        self.curved_image = None
+
+    def setup_interactor(self, vtk_widget, click_callback, axis):
+        from vtkmodules.vtkInteractionStyle import vtkInteractorStyleImage
 
-    def setup_interactor(self, vtk_widget, click_callback):
         interactor = vtk_widget.GetRenderWindow().GetInteractor()
-        style = vtk.vtkInteractorStyleImage()
+        style = vtkInteractorStyleImage()
         interactor.SetInteractorStyle(style)
         interactor.AddObserver("LeftButtonPressEvent", click_callback)
+        interactor.AddObserver("KeyPressEvent", lambda obj, event: self.on_key_press(obj, axis))
+        style.AddObserver("EndWindowLevelEvent", self.on_end_window_level)
+        self.slice_styles[axis] = style
+
+    def set_left_button_mode(self, mode):
+        # Observers on the style replace its own left button and mouse move handling while they are attached
+        self.left_button_mode = mode
+        self.crosshair_drag = None
+        for axis, style in self.slice_styles.items():
+            for tag in self.left_button_observers.pop(axis, []):
+                style.RemoveObserver(tag)
+            if mode == "crosshair":
+                self.left_button_observers[axis] = [
+                    style.AddObserver("LeftButtonPressEvent", lambda obj, event, axis=axis: self.on_crosshair_press(axis)),
+                    style.AddObserver("MouseMoveEvent", lambda obj, event, axis=axis: self.on_crosshair_move(axis)),
+                    style.AddObserver("LeftButtonReleaseEvent", self.on_crosshair_release),
+                ]
+            elif mode == "curve":
+                self.left_button_observers[axis] = [
+                    style.AddObserver("LeftButtonPressEvent", lambda obj, event, axis=axis: self.add_curve_point(axis)),
+                ]
+
+    def set_crosshair_mode(self, enabled):
+        if enabled:
+            self.set_left_button_mode("crosshair")
+        elif self.left_button_mode == "crosshair":
+            self.set_left_button_mode(None)
+
+    def set_curve_mode(self, enabled):
+        # Switching the tool off straightens the curve drawn while it was on
+        if enabled:
+            self.set_left_button_mode("curve")
+            self.clear_curve()
+            return
+        if self.left_button_mode == "curve":
+            self.set_left_button_mode(None)
+        if len(self.curve_points) >= 2:
+            self.show_curved_reformation()
+        self.clear_curve()
+
+    def on_crosshair_press(self, axis):
+        self.crosshair_drag = axis
+        self.move_crosshair(axis)
+
+    def on_crosshair_move(self, axis):
+        if self.crosshair_drag == axis:
+            self.move_crosshair(axis)
+        else:
+            # Panning, zooming and rotating with the other buttons still go through the style
+            self.slice_styles[axis].OnMouseMove()
+
+    def on_crosshair_release(self, style, event):
+        self.crosshair_drag = None
+
+    def move_crosshair(self, axis):
+        # Every mouse move is mapped straight to a voxel; the render scheduler keeps it to one redraw per frame
+        vtk_widget = {"axial": self.axial_view, "coronal": self.coronal_view, "sagittal": self.sagittal_view}[axis]
+        click_pos = vtk_widget.GetRenderWindow().GetInteractor().GetEventPosition()
+        self.update_views_based_on_click(vtk_widget, click_pos, axis)
+
+    def add_curve_point(self, axis):
+        # Points are collected in one view; clicking in another view starts a new curve there
+        view = self.slice_view(axis)
+        if view is None:
+            return
+        if axis != self.curve_axis:
+            self.clear_curve()
+            self.curve_axis = axis
+        plane_position = view.display_to_plane(view.render_window.GetInteractor().GetEventPosition())
+        if plane_position is None:
+            return
+        voxel = view.plane_to_volume(plane_position, self.current_slice(axis))
+        volume = self.engine.volume
+        self.curve_points.append([o + p * s for o, p, s in zip(volume.origin, voxel, volume.spacing)])
+        self.curve_plane_points.append(plane_position)
+        view.set_path(self.curve_plane_points)
+        self.render_scheduler.request_render(view.render_window, view.render_window)
+
+    def clear_curve(self):
+        view = self.slice_view(self.curve_axis) if self.curve_axis is not None else None
+        if view is not None:
+            view.set_path([])
+            self.render_scheduler.request_render(view.render_window, view.render_window)
+        self.curve_axis = None
+        self.curve_points = []
+        self.curve_plane_points = []
+
+    def show_curved_reformation(self):
+        # Straightened along the curve and across it within the plane of the view it was drawn in
+        axis = self.curve_axis
+        plane = self.engine.plane(axis, self.current_slice(axis))
+        if plane is not None:
+            normal = plane.normal
+        else:
+            normal = [0.0, 0.0, 0.0]
+            normal[2 - AXES[axis]] = 1.0
+        try:
+            with self.perf.timed("curved_reformation", axis):
+                self.curved_image = curved_reformation(self.engine.volume, self.curve_points, normal)
+        except ValueError as e:
+            logger.warning("No curved reformation: %s", e)
+            return
+
+        if self.curved_view is None:
+            # A separate window, kept for later curves
+            from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+            from vtkmodules.vtkInteractionStyle import vtkInteractorStyleImage
+            from viewer_session import ReformationViewPipeline
+
+            self.curved_view = QVTKRenderWindowInteractor()
+            self.curved_view.setWindowTitle("Curved MPR")
+            self.curved_view.resize(400, 600)
+            self.curved_pipeline = ReformationViewPipeline(self.curved_view.GetRenderWindow())
+            self.curved_view.GetRenderWindow().GetInteractor().SetInteractorStyle(vtkInteractorStyleImage())
+            self.curved_view.GetRenderWindow().GetInteractor().Initialize()
+        self.show_curved_image()
+        self.curved_view.show()
+
+    def show_curved_image(self):
+        # Window/levelled like the 2D views
+        image, spacing = self.curved_image
+        self.curved_pipeline.show(self.engine.map(image), spacing)
+        render_window = self.curved_view.GetRenderWindow()
+        self.render_scheduler.request_render(render_window, render_window)
+
+    def on_key_press(self, interactor, axis):
+        # Arrow keys tilt the view's plane about its horizontal (Up/Down) or vertical (Left/Right) axis
+        steps = {"Up": (TILT_STEP, 0.0), "Down": (-TILT_STEP, 0.0),
+                 "Left": (0.0, -TILT_STEP), "Right": (0.0, TILT_STEP)}
+        key = interactor.GetKeySym()
+        if self.engine is None:
+            return
+        if key == "Home":
+            self.set_tilt(axis, (0.0, 0.0))
+        elif key in steps:
+            about_u, about_v = self.engine.tilts.get(axis, (0.0, 0.0))
+            self.set_tilt(axis, (about_u + steps[key][0], about_v + steps[key][1]))
+
+    def set_tilt(self, axis, tilt):
+        # The plane is resampled on the next frame; held-down keys only cost one resample per frame
+        view = self.slice_view(axis)
+        if view is None or tuple(tilt) == self.engine.tilts.get(axis, (0.0, 0.0)):
+            return
+        with self.perf.timed("set_tilt", axis):
+            self.session.set_tilt(axis, tilt)
+        self.render_scheduler.request_slice(view.render_window, self.current_slice(axis),
+                                            lambda index: self.show_slice(view, index, render=False),
+                                            view.render_window)
+
+    def on_end_window_level(self, style, event):
+        # The interactor style window/levels the 8-bit display image; fold that into the engine
+        image_property = style.GetCurrentImageProperty()
+        if image_property is None or self.engine is None:
+            return
+        scale = self.engine.window / 255.0
+        window = abs(image_property.GetColorWindow()) * scale
+        level = self.engine.level - self.engine.window / 2 + image_property.GetColorLevel() * scale
+        image_property.SetColorWindow(255.0)
+        image_property.SetColorLevel(127.5)
+        self.set_window_level(window, level)
+
+    def set_window_level(self, window, level):
+        # Cached slices were mapped with the old window/level
+        with self.perf.timed("window_level"):
+            self.session.set_window_level(window, level)
+            for view in self.session.slice_pipelines.values():
+                if view.active:
+                    self.show_slice(view, self.current_slice(view.axis))
+            if self.curved_image is not None:
+                self.show_curved_image()
+
+    def set_projection(self, *args):
+        # Moving the sliders afterwards updates the slabs incrementally instead of recomputing them
+        if self.session is None:
+            return
+        with self.perf.timed("set_projection"):
+            self.session.set_projection(self.projection_box.currentData(), self.slab_thickness_box.value())
+            for view in self.session.slice_pipelines.values():
+                if view.active:
+                    self.show_slice(view, self.current_slice(view.axis))
+
+    def apply_window_preset(self, index):
+        window_level = self.window_preset_box.itemData(index)
+        if window_level is not None and self.engine is not None:
+            self.set_window_level(*window_level)
+
+    def slice_cache_stats(self):
+        # Hit rates of the per-view slice caches
+        if self.session is None:
+            return []
+        return [view.cache.stats() for view in self.session.slice_pipelines.values() if view.active]
+
+    def show_frame_stats(self, visible):
+        self.frame_stats_visible = visible
+        for render_timer in self.render_timers:
+            render_timer.set_visible(visible)
+        if self.session is None:
+            return
+        for vtk_widget in (self.axial_view, self.coronal_view, self.sagittal_view, self.three_d_view):
+            self.render_scheduler.request_render(vtk_widget.GetRenderWindow(), vtk_widget.GetRenderWindow())
+
+    def save_perf_stats(self, file_path=None):
+        if file_path is None:
+            file_path, _ = QFileDialog.getSaveFileName(self, "Save Performance Stats", "mpr-perf.json",
+                                                       "JSON Files (*.json)")
+            if not file_path:
+                return
+        try:
+            self.perf.dump(file_path, slice_caches=self.slice_cache_stats(),
+                           render_scheduler=self.render_scheduler.stats(), studies=self.studies.stats(),
+                           surfaces=self.session.surfaces.stats() if self.session is not None else None)
+        except OSError as e:
+            logger.error("Error saving performance stats to %s: %s", file_path, e)
+        else:
+            logger.info("Performance stats saved to %s", file_path)
+
+    def slider(self, axis):
+        return {"axial": self.axial_slider, "coronal": self.coronal_slider, "sagittal": self.sagittal_slider}[axis]
+
+    def current_slice(self, axis):
+        return self.slider(axis).value()
 
     def on_click_axial(self, obj, event):
-        # Capture the point clicked in the axial view
+        # Capture the point clicked in the axial view; left-button tools are handled by the style observers
+        if self.left_button_mode is not None:
+            return
         click_pos = obj.GetEventPosition()
         self.update_views_based_on_click(self.axial_view, click_pos, "axial")
 
     def on_click_coronal(self, obj, event):
-        # Capture the point clicked in the coronal view
+        # Capture the point clicked in the coronal view; left-button tools are handled by the style observers
+        if self.left_button_mode is not None:
+            return
         click_pos = obj.GetEventPosition()
         self.update_views_based_on_click(self.coronal_view, click_pos, "coronal")
 
     def on_click_sagittal(self, obj, event):
-        # Capture the point clicked in the sagittal view
+        # Capture the point clicked in the sagittal view; left-button tools are handled by the style observers
+        if self.left_button_mode is not None:
+            return
         click_pos = obj.GetEventPosition()
         self.update_views_based_on_click(self.sagittal_view, click_pos, "sagittal")
 
     def update_views_based_on_click(self, vtk_widget, click_pos, view_type):
-        # Create a picker
-        picker = vtk.vtkCellPicker()  # Use vtkPointPicker if necessary
-        picker.SetTolerance(0.005)
-
-        # Pick based on the 2D click
-        picker.Pick(click_pos[0], click_pos[1], 0, vtk_widget.GetRenderWindow().GetRenderers().GetFirstRenderer())
-        picked_position = picker.GetPickPosition()  # Get 3D coordinates
-
-        if picker.GetCellId() != -1:
-            # Successfully picked a 3D point
-            x, y, z = picked_position
-            print(f"Clicked on {view_type} view at 3D position: ({x}, {y}, {z})")
-
-            # Depending on which view was clicked, update the other views
-            if view_type == "axial":
-                self.update_coronal_view(x, y)  # Update coronal view
-                self.update_sagittal_view(y, z)  # Update sagittal view
-            elif view_type == "coronal":
-                self.update_axial_view(x, y)  # Update axial view
-                self.update_sagittal_view(y, z)
-
-            elif view_type == "sagittal":
-                self.update_axial_view(x, y)  # Update axial view
-                self.update_coronal_view(x, y)  # Update coronal view
-        else:
-            print(f"No valid pick on {view_type} view")
-
-    def update_axial_view(self, x, z):
-        # Convert (x, z) to axial slice and update
-        slice_index = int(z)
-        if slice_index < self.axial_slices:
+        with self.perf.timed("update_views_based_on_click", view_type):
+            # Voxel under the click from the view's display-to-world transform; drags past the edge stay on it
+            view = self.slice_view(view_type)
+            voxel = None
+            if view is not None:
+                voxel = view.display_to_voxel(click_pos, self.current_slice(view_type),
+                                              clamp=self.crosshair_drag is not None)
+
+            if voxel is not None:
+                x, y, z = voxel
+                logger.debug("Clicked on %s view at voxel (%s, %s, %s)", view_type, x, y, z)
+
+                # Depending on which view was clicked, update the other views
+                if view_type == "axial":
+                    self.update_coronal_view(y)  # Update coronal view
+                    self.update_sagittal_view(x)  # Update sagittal view
+                elif view_type == "coronal":
+                    self.update_axial_view(z)  # Update axial view
+                    self.update_sagittal_view(x)
+
+                elif view_type == "sagittal":
+                    self.update_axial_view(z)  # Update axial view
+                    self.update_coronal_view(y)  # Update coronal view
+            else:
+                logger.debug("No valid pick on %s view", view_type)
+
+    def update_axial_view(self, slice_index):
+        # Moving the slider redraws the axial slice
+        if 0 <= slice_index < self.axial_slices:
             self.axial_slider.setValue(slice_index)
-            self.axial_reslice.SetResliceAxesOrigin(0, 0, slice_index)
-            self.axial_view.GetRenderWindow().Render()
 
-    def update_coronal_view(self, x, y):
-        # Convert (x, y) to coronal slice and update
-        slice_index = int(y)
-        if slice_index < self.coronal_slices:
+    def update_coronal_view(self, slice_index):
+        if 0 <= slice_index < self.coronal_slices:
             self.coronal_slider.setValue(slice_index)
-            self.coronal_reslice.SetResliceAxesOrigin(0, slice_index, 0)
-            self.coronal_view.GetRenderWindow().Render()
 
-    def update_sagittal_view(self, x, y):
-        # Convert (x, y) to sagittal slice and update
-        slice_index = int(x)
-        if slice_index < self.sagittal_slices:
+    def update_sagittal_view(self, slice_index):
+        if 0 <= slice_index < self.sagittal_slices:
             self.sagittal_slider.setValue(slice_index)
-            self.sagittal_reslice.SetResliceAxesOrigin(slice_index, 0, 0)
-            self.sagittal_view.GetRenderWindow().Render()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("MPR_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # python MPR.py export <studies...>: PNG export without opening a window
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        import mpr_cli
+        sys.exit(mpr_cli.main(sys.argv[2:], prog="MPR.py export"))
+    # python MPR.py serve <studies...>: slices over HTTP/WebSocket for thin clients
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import slice_server
+        sys.exit(slice_server.main(sys.argv[2:], prog="MPR.py serve"))
     app = QApplication(sys.argv)
     window = MPRWindow()
     window.setWindowTitle("MultiPlanar Reconstruction (MPR) Viewer")
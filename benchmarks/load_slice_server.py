@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from slice_server import OP_TEXT, read_websocket_frame  # noqa: E402
+from volume import AXES  # noqa: E402
+
+DEFAULT_STUDIES = [os.path.join(REPO_ROOT, "data_example", "MHA")]
+
+
+class HTTPConnection:
+    # One keep-alive connection, as a browser tab holds to the server
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode("latin-1"))
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            self.close()
+        return status, headers, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def open_websocket(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    writer.write((f"GET /ws HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+    if b" 101 " not in await reader.readline():
+        raise RuntimeError("WebSocket upgrade refused")
+    while await reader.readline() not in (b"\r\n", b""):
+        pass
+    return reader, writer
+
+
+async def send_json(writer, message):
+    # Client frames must be masked
+    payload = json.dumps(message).encode("utf-8")
+    mask = os.urandom(4)
+    masked = (np.frombuffer(payload, np.uint8) ^ np.resize(np.frombuffer(mask, np.uint8), len(payload))).tobytes()
+    length = len(payload)
+    header = struct.pack(">BB", 0x80 | OP_TEXT, 0x80 | length) if length < 126 else \
+        struct.pack(">BBH", 0x80 | OP_TEXT, 0x80 | 126, length)
+    writer.write(header + mask + masked)
+    await writer.drain()
+
+
+async def scroll_client(connection, studies, client, deadline, window_levels, latencies, failures):
+    # A user scrolling one view back and forth through a study, at one of a few window/levels
+    name, info = studies[client % len(studies)]
+    axes = list(AXES)
+    axis = axes[client // len(studies) % len(axes)]
+    count = info["slices"][axis]
+    index, step = (client * 7) % count, 1
+    window, level = info["window_level"]
+    variant = client % window_levels
+    query = f"window={window * (1 + 0.25 * variant):g}&level={level:g}"
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            status, _, _ = await connection.get(f"/studies/{name}/{axis}/{index}.png?{query}")
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            connection.close()
+            status = None
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            failures.append(status)
+        if not 0 <= index + step < count:
+            step = -step
+        index += step
+
+
+async def crosshair_latency(host, port, name, info, moves):
+    # One client drags the crosshair, another receives the pushed updates; seconds from send to receipt
+    sender_reader, sender = await open_websocket(host, port)
+    receiver, receiver_writer = await open_websocket(host, port)
+    await send_json(receiver_writer, {"subscribe": name})
+    await asyncio.sleep(0.1)
+    depth = info["slices"]["axial"]
+    samples = []
+    for move in range(moves):
+        voxel = [move % info["shape"]["axial"][1], move % info["shape"]["axial"][0], move % depth]
+        start = time.perf_counter()
+        await send_json(sender, {"study": name, "crosshair": voxel})
+        while True:
+            opcode, payload = await read_websocket_frame(receiver)
+            if opcode == OP_TEXT and json.loads(payload).get("voxel") == voxel:
+                break
+        samples.append(time.perf_counter() - start)
+    sender.close()
+    receiver_writer.close()
+    return samples
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_server(host, port, timeout):
+    end = time.perf_counter() + timeout
+    while True:
+        connection = HTTPConnection(host, port)
+        try:
+            status, _, body = await connection.get("/studies")
+            if status == 200:
+                return json.loads(body)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            if time.perf_counter() > end:
+                raise RuntimeError(f"No server on {host}:{port} after {timeout} s")
+            await asyncio.sleep(0.2)
+        finally:
+            connection.close()
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+async def run(host, port, options):
+    names = await wait_for_server(host, port, options.startup_timeout)
+    if options.limit:
+        names = names[:options.limit]
+
+    # Loading the studies is not part of the measurement
+    connection = HTTPConnection(host, port)
+    studies = []
+    for name in names:
+        status, _, body = await connection.get(f"/studies/{name}")
+        if status == 200:
+            studies.append((name, json.loads(body)))
+        else:
+            print(f"Skipping {name}: {json.loads(body).get('error')}")
+    if not studies:
+        raise RuntimeError("No study could be loaded")
+
+    latencies, failures = [], []
+    connections = [HTTPConnection(host, port) for _ in range(options.connections)]
+    start = time.perf_counter()
+    deadline = start + options.duration
+    await asyncio.gather(*(scroll_client(connections[client], studies, client, deadline, options.window_levels,
+                                         latencies, failures) for client in range(options.connections)))
+    elapsed = time.perf_counter() - start
+    for client in connections:
+        client.close()
+
+    crosshair = await crosshair_latency(host, port, *studies[0], options.crosshair_moves) \
+        if options.crosshair_moves else []
+    _, _, body = await connection.get("/stats")
+    connection.close()
+    return {
+        "studies": len(studies),
+        "connections": options.connections,
+        "seconds": elapsed,
+        "requests": len(latencies),
+        "errors": len(failures),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "max_ms": max(latencies, default=0.0) * 1000,
+        "crosshair_p50_ms": percentile_ms(crosshair, 50),
+        "crosshair_p99_ms": percentile_ms(crosshair, 99),
+        "server": json.loads(body),
+    }
+
+
+def main():
+    # python benchmarks/load_slice_server.py [studies...] [--url host:port] [--connections 32] [--duration 10]
+    parser = argparse.ArgumentParser(description="Scripted thin-client load against the slice server")
+    parser.add_argument("inputs", nargs="*", default=DEFAULT_STUDIES,
+                        help="studies to serve when the server is started here (default: data_example/MHA)")
+    parser.add_argument("--url", help="host:port of a running server instead of starting one")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--window-levels", type=int, default=2,
+                        help="distinct window/levels among the clients; more of them means fewer tile cache hits")
+    parser.add_argument("--limit", type=int, help="only load this many of the served studies")
+    parser.add_argument("--crosshair-moves", type=int, default=200)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--p99-ms", type=float, help="fail if the p99 tile latency is above this")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        host, _, port = args.url.rpartition(":")
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "slice_server.py"), *args.inputs,
+                                   "--port", str(port)], env=dict(os.environ, MPR_LOG_LEVEL="WARNING"))
+    try:
+        results = asyncio.run(run(host, port, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    tiles = results["server"]["tiles"]
+    print(f"{results['requests']} requests from {results['connections']} connections in {results['seconds']:.1f} s: "
+          f"{results['rps']:.0f} req/s, p50 {results['p50_ms']:.1f} ms, p99 {results['p99_ms']:.1f} ms, "
+          f"{results['errors']} errors, tile cache hit rate {tiles['hit_rate']:.0%}")
+    if args.crosshair_moves:
+        print(f"Crosshair push: p50 {results['crosshair_p50_ms']:.2f} ms, p99 {results['crosshair_p99_ms']:.2f} ms")
+    if results["errors"] or (args.p99_ms and results["p99_ms"] > args.p99_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
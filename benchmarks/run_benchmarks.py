@@ -0,0 +1,502 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkVersion
+from vtkmodules.vtkIOImage import vtkMetaImageWriter
+from vtkmodules.vtkRenderingCore import vtkRenderWindow
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_paths import cache_dir  # noqa: E402
+from dicom_index import DicomIndex  # noqa: E402
+from viewer_session import ViewerSession  # noqa: E402
+from volume import AXES, Volume  # noqa: E402
+from volume_cache import VolumeCache  # noqa: E402
+from volume_loader import read_dicom_series, read_mha  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_ROOT = os.path.join(REPO_ROOT, "data_example")
+
+SIZES = (128, 256, 512, 1024)
+
+# A thin-slice CT-sized study (x, y, z) that fast scrubbing has to keep up with
+SCRUB_SIZE = (512, 512, 1000)
+SCRUB_TARGET = 60.0  # Slices per second drawn, wall clock, while the user keeps asking for more
+SCRUB_STRIDE = 10  # Slices per step, as a fast mouse wheel or slider drag merges them
+SCRUB_RATE = 120.0  # Steps per second asked for, as fast as slider events arrive during a quick drag
+DTYPES = ("uint8", "int16", "float32")
+
+# Value range of the synthetic phantom per voxel type; int16 is laid out like CT in HU
+DTYPE_RANGES = {"uint8": (0, 255), "int16": (-1000, 2000), "uint16": (0, 4095), "float32": (0.0, 1.0)}
+
+# Relative change in a metric that counts as a regression against the baseline
+DEFAULT_TOLERANCE = 0.15
+
+# Timings below this many milliseconds in both runs are too noisy to compare
+NOISE_FLOOR_MS = 0.5
+
+# Peak RSS rises below this many MB in both runs are page-level noise, not allocations worth comparing
+NOISE_FLOOR_MB = 4.0
+
+# Degrees an oblique plane is turned per step in the oblique metrics, as per arrow key press in the viewer
+OBLIQUE_STEP = 2.0
+
+MB = 2 ** 20
+
+
+def current_rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def peak_rss():
+    # VmHWM can be reset between stages on Linux; elsewhere this is the peak of the whole process
+    try:
+        with open("/proc/self/status") as f:
+            return int(re.search(r"VmHWM:\s+(\d+)", f.read()).group(1)) * 1024
+    except (OSError, AttributeError):
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@contextmanager
+def measure(metrics, stage):
+    # Wall time of the stage and how far its peak RSS rose above the RSS it started with
+    try:
+        start_rss = current_rss()
+    except OSError:
+        start_rss = peak_rss()
+    reset_peak_rss()
+    start = time.perf_counter()
+    yield
+    metrics[f"{stage}.seconds"] = time.perf_counter() - start
+    metrics[f"{stage}.peak_mb"] = max(peak_rss() - start_rss, 0) / MB
+
+
+def timing_metrics(metrics, prefix, samples):
+    samples = np.asarray(samples) * 1000
+    metrics[f"{prefix}.p50_ms"] = float(np.percentile(samples, 50))
+    metrics[f"{prefix}.p99_ms"] = float(np.percentile(samples, 99))
+    metrics[f"{prefix}.mean_ms"] = float(samples.mean())
+
+
+def phantom(shape, dtype):
+    # Nested spheres of increasing intensity with mild noise, generated a slice at a time
+    depth, height, width = shape
+    low, high = DTYPE_RANGES[dtype]
+    array = np.empty(shape, dtype=dtype)
+    y, x = np.ogrid[-1:1:height * 1j, -1:1:width * 1j]
+    rng = np.random.default_rng(0)
+    for z in range(depth):
+        zz = 2.0 * z / max(depth - 1, 1) - 1.0
+        radius = np.sqrt(x * x + y * y + zz * zz)
+        values = 0.3 * (radius < 0.9) + 0.4 * (radius < 0.6) + 0.3 * (radius < 0.2)
+        values = np.clip(values + rng.normal(0.0, 0.02, values.shape), 0.0, 1.0)
+        array[z] = low + values * (high - low)
+    return array
+
+
+def synthetic_file(size, dtype):
+    # Written once as uncompressed MHA and reused by later runs, so synthetic cases go through read_mha too;
+    # size is (x, y, z)
+    file_path = os.path.join(cache_dir("benchmarks"), f"phantom_{'x'.join(map(str, size))}_{dtype}.mha")
+    if not os.path.exists(file_path):
+        volume = Volume(phantom(size[::-1], dtype), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0))
+        writer = vtkMetaImageWriter()
+        writer.SetFileName(file_path + ".tmp.mha")
+        writer.SetCompression(False)
+        writer.SetInputData(volume.to_vtk_image())
+        writer.Write()
+        os.replace(file_path + ".tmp.mha", file_path)
+    return file_path
+
+
+def real_cases():
+    # Every MHA file, and the largest series of every directory holding DICOM files
+    cases = []
+    for root, _, files in sorted(os.walk(DATA_ROOT)):
+        name = os.path.relpath(root, DATA_ROOT).replace(os.sep, "/").replace(" ", "_")
+        for file_name in sorted(files):
+            if file_name.endswith(".mha"):
+                cases.append({"name": f"mha/{os.path.splitext(file_name)[0]}", "kind": "mha",
+                              "path": os.path.join(root, file_name)})
+        if any(file_name.lower().endswith(".dcm") for file_name in files):
+            series = max(DicomIndex().scan(root), key=lambda s: len(s["files"]), default=None)
+            if series is not None and len(series["files"]) > 1:
+                cases.append({"name": f"dicom/{name}", "kind": "dicom", "path": series["files"][0]})
+    return cases
+
+
+def scrub_case_name(dtype):
+    return f"synthetic/{'x'.join(map(str, SCRUB_SIZE))}-{dtype}"
+
+
+def synthetic_cases(sizes, dtypes, max_bytes, scrub=True):
+    cases, skipped = [], []
+    shapes = [(f"{size}^3", (size, size, size)) for size in sizes]
+    if scrub:
+        shapes.append(("x".join(map(str, SCRUB_SIZE)), SCRUB_SIZE))
+    for label, size in shapes:
+        for dtype in dtypes:
+            name = f"synthetic/{label}-{dtype}"
+            # Volume, pyramid, VTK copies and caches together need a few times the raw size
+            if np.prod(size, dtype=np.int64) * np.dtype(dtype).itemsize * 3 > max_bytes:
+                skipped.append(name)
+                continue
+            cases.append({"name": name, "kind": "mha", "size": size, "dtype": dtype})
+    return cases, skipped
+
+
+def offscreen_window(size):
+    render_window = vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(size, size)
+    return render_window
+
+
+def load(case):
+    if case["kind"] == "dicom":
+        volume = read_dicom_series(case["path"])
+    else:
+        volume = read_mha(case["path"])
+    volume.default_window_level()
+    return volume
+
+
+def run_case(case, options):
+    metrics = {}
+    if "size" in case:
+        case = dict(case, path=synthetic_file(case["size"], case["dtype"]))
+
+    # Decoding: vtkMetaImageReader for MHA, one vtkDICOMImageReader per file for DICOM; histogram included
+    with measure(metrics, "load"):
+        volume = load(case)
+    metrics["voxels"] = int(volume.array.size)
+    metrics["dtype"] = volume.array.dtype.name
+
+    # Reopening through the volume cache maps the decoded voxels instead of decoding again
+    with tempfile.TemporaryDirectory() as cache_root:
+        volume_cache = VolumeCache(cache_root, max_bytes=volume.nbytes * 2)
+        with measure(metrics, "write_volume_cache"):
+            volume_cache.put("benchmark", volume)
+        with measure(metrics, "load_cached"):
+            cached = volume_cache.get("benchmark")
+            cached.array.sum(dtype=np.float64)  # Touch every page
+        del cached
+
+    slice_windows = {axis: offscreen_window(options.view_size) for axis in AXES}
+    volume_window = offscreen_window(options.view_size)
+    session = ViewerSession(slice_windows, volume_window)
+
+    # Building the three slice views and drawing their first frame
+    with measure(metrics, "setup_slice_view"):
+        session.load(volume, volume.default_window_level())
+        for pipeline in session.slice_pipelines.values():
+            pipeline.show_slice(0)
+            pipeline.render_window.Render()
+    for axis in AXES:
+        metrics[f"setup_slice_view.{axis}.ms"] = session.perf.get("setup_slice_view", axis).total * 1000
+
+    for axis, pipeline in session.slice_pipelines.items():
+        count = session.engine.slice_count(axis)
+        indices = range(0, count, max(1, count // options.sweep))
+
+        # Slider sweep through the slice cache (with its prefetching), without rendering
+        pipeline.cache.invalidate()
+        samples = []
+        with measure(metrics, f"update_slice.{axis}"):
+            for index in indices:
+                start = time.perf_counter()
+                pipeline.show_slice(index)
+                samples.append(time.perf_counter() - start)
+        metrics[f"update_slice.{axis}.slices_per_second"] = len(samples) / sum(samples)
+        timing_metrics(metrics, f"update_slice.{axis}", samples)
+
+        # The same sweep with a render per position, as when dragging the slider
+        samples = []
+        with measure(metrics, f"navigate.{axis}"):
+            for index in list(indices)[:options.frames * 4]:
+                start = time.perf_counter()
+                pipeline.show_slice(index)
+                pipeline.render_window.Render()
+                samples.append(time.perf_counter() - start)
+        metrics[f"navigate.{axis}.fps"] = len(samples) / sum(samples)
+
+        # Fast scrubbing: big steps asked for at SCRUB_RATE, each drawn before the next one is taken, so the
+        # prefetch only gets the idle time left between steps. Throughput is wall clock over the whole drag,
+        # reslicing, rendering and waiting included
+        pipeline.cache.invalidate()
+        before = pipeline.cache.stats()
+        samples = []
+        with measure(metrics, f"scrub.{axis}"):
+            scrub_start = next_step = time.perf_counter()
+            for index in range(0, count, options.scrub_stride):
+                time.sleep(max(next_step - time.perf_counter(), 0.0))
+                start = time.perf_counter()
+                pipeline.show_slice(index)
+                pipeline.render_window.Render()
+                samples.append(time.perf_counter() - start)
+                next_step = max(next_step + 1 / SCRUB_RATE, time.perf_counter())
+            scrub_seconds = time.perf_counter() - scrub_start
+        after = pipeline.cache.stats()
+        hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+        metrics[f"scrub.{axis}.slices_per_second"] = len(samples) / scrub_seconds
+        metrics[f"scrub.{axis}.hit_rate"] = hits / max(hits + misses, 1)
+        metrics[f"scrub.{axis}.prefetched"] = after["prefetched"] - before["prefetched"]
+        timing_metrics(metrics, f"scrub.{axis}", samples)
+
+        # Thick-slab scrolling, where each step updates the projection incrementally
+        for mode in ("mip", "average"):
+            session.set_projection(mode, options.slab)
+            samples = []
+            with measure(metrics, f"slab_{mode}.{axis}"):
+                for index in indices:
+                    start = time.perf_counter()
+                    pipeline.show_slice(index)
+                    samples.append(time.perf_counter() - start)
+            metrics[f"slab_{mode}.{axis}.slices_per_second"] = len(samples) / sum(samples)
+            timing_metrics(metrics, f"slab_{mode}.{axis}", samples)
+        session.set_projection("slice", 1)
+
+        # Oblique planes: turning the plane a step at a time (arrow keys), then scrolling the tilted plane
+        middle = session.engine.slice_count(axis) // 2
+        samples = []
+        with measure(metrics, f"oblique_tilt.{axis}"):
+            for step in range(1, options.frames * 2 + 1):
+                start = time.perf_counter()
+                session.set_tilt(axis, (OBLIQUE_STEP * step, OBLIQUE_STEP * step / 2))
+                pipeline.show_slice(middle)
+                samples.append(time.perf_counter() - start)
+        timing_metrics(metrics, f"oblique_tilt.{axis}", samples)
+
+        samples = []
+        with measure(metrics, f"oblique_scroll.{axis}"):
+            for index in list(indices)[:options.frames * 4]:
+                start = time.perf_counter()
+                pipeline.show_slice(index)
+                samples.append(time.perf_counter() - start)
+        metrics[f"oblique_scroll.{axis}.slices_per_second"] = len(samples) / sum(samples)
+        timing_metrics(metrics, f"oblique_scroll.{axis}", samples)
+        session.set_tilt(axis, (0.0, 0.0))
+
+    # Click in a view: map it to a voxel, then move and redraw the two other views
+    center = options.view_size // 2
+    for axis, pipeline in session.slice_pipelines.items():
+        pick_samples, click_samples = [], []
+        slice_index = session.engine.slice_count(axis) // 2
+        with measure(metrics, f"update_views_based_on_click.{axis}"):
+            for offset in range(-options.clicks // 2, options.clicks - options.clicks // 2):
+                start = time.perf_counter()
+                voxel = pipeline.display_to_voxel((center + offset * 3, center - offset * 2), slice_index)
+                picked = time.perf_counter()
+                if voxel is not None:
+                    for other_axis, other in session.slice_pipelines.items():
+                        if other_axis != axis:
+                            index = voxel[2 - AXES[other_axis]]
+                            other.show_slice(min(max(index, 0), session.engine.slice_count(other_axis) - 1))
+                            other.render_window.Render()
+                pick_samples.append(picked - start)
+                click_samples.append(time.perf_counter() - start)
+        timing_metrics(metrics, f"pick.{axis}", pick_samples)
+        timing_metrics(metrics, f"update_views_based_on_click.{axis}", click_samples)
+
+    # 3D panel: set-up plus first frame, then steady-state frames at full and at interactive resolution
+    with measure(metrics, "setup_3d_view"):
+        session.show_3d(options.gpu, options.frame_time)
+        volume_window.Render()
+    camera = session.volume_pipeline.renderer.GetActiveCamera()
+    samples = []
+    with measure(metrics, "render_3d.full"):
+        for frame in range(options.frames):
+            camera.Azimuth(360.0 / options.frames)
+            start = time.perf_counter()
+            volume_window.Render()
+            samples.append(time.perf_counter() - start)
+    timing_metrics(metrics, "render_3d.full", samples)
+
+    lod_renderer = session.volume_pipeline.lod_renderer
+    if lod_renderer is not None:
+        lod_renderer.set_level(lod_renderer.interactive_level())
+        metrics["render_3d.interactive.level"] = lod_renderer.level
+        samples = []
+        with measure(metrics, "render_3d.interactive"):
+            for frame in range(options.frames):
+                camera.Azimuth(360.0 / options.frames)
+                start = time.perf_counter()
+                volume_window.Render()
+                samples.append(time.perf_counter() - start)
+        timing_metrics(metrics, "render_3d.interactive", samples)
+
+    session.release()
+    session.prefetch_pool.shutdown(wait=True)
+    metrics["process_peak_mb"] = peak_rss() / MB
+    return metrics
+
+
+def run_in_subprocess(case, options):
+    # A fresh interpreter per case keeps peak memory and caches of one case out of the next
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case),
+               "--view-size", str(options.view_size), "--frames", str(options.frames),
+               "--sweep", str(options.sweep), "--scrub-stride", str(options.scrub_stride),
+               "--clicks", str(options.clicks), "--slab", str(options.slab),
+               "--frame-time", str(options.frame_time)]
+    if options.gpu:
+        command.append("--gpu")
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=options.timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {options.timeout} s"}
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    return {"error": (completed.stderr.strip().splitlines() or [f"exit code {completed.returncode}"])[-1]}
+
+
+def environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "vtk": vtkVersion.GetVTKVersion(),
+            "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count()}
+
+
+def lower_is_better(metric):
+    return metric.endswith(("_ms", ".seconds", "_mb"))
+
+
+def higher_is_better(metric):
+    return metric.endswith(("per_second", ".fps"))
+
+
+def compare(results, baseline, tolerance):
+    # Metrics that got worse by more than the tolerance, as (case, metric, baseline value, value)
+    regressions = []
+    for name, metrics in results["cases"].items():
+        previous = baseline.get("cases", {}).get(name, {})
+        for metric, value in metrics.items():
+            before = previous.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or before <= 0:
+                continue
+            if metric.endswith("_ms") and max(value, before) < NOISE_FLOOR_MS:
+                continue
+            if metric.endswith("_mb") and max(value, before) < NOISE_FLOOR_MB:
+                continue
+            if lower_is_better(metric):
+                change = (value - before) / before
+            elif higher_is_better(metric):
+                change = (before - value) / before
+            else:
+                continue
+            if change > tolerance:
+                regressions.append((name, metric, before, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offscreen benchmarks of loading, reslicing, navigation, "
+                                                 "picking and 3D rendering")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES, help="edge lengths of synthetic volumes")
+    parser.add_argument("--dtypes", nargs="*", default=DTYPES, choices=sorted(DTYPE_RANGES))
+    parser.add_argument("--quick", action="store_true", help="128^3 and 256^3 int16 synthetic volumes only")
+    parser.add_argument("--no-real", action="store_true", help="skip the studies under data_example")
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--max-memory-gb", type=float,
+                        help="skip synthetic volumes that would not fit (default: physical memory)")
+    parser.add_argument("--view-size", type=int, default=512)
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--sweep", type=int, default=256, help="slider positions per orientation")
+    parser.add_argument("--scrub-stride", type=int, default=SCRUB_STRIDE, help="slices per step when scrubbing")
+    parser.add_argument("--scrub-target", type=float, default=SCRUB_TARGET,
+                        help="slices per second, wall clock, that scrubbing has to reach on every axis")
+    parser.add_argument("--clicks", type=int, default=20)
+    parser.add_argument("--slab", type=int, default=64, help="slab thickness in slices for MIP/average")
+    parser.add_argument("--frame-time", type=float, default=0.05, help="LOD frame time target in seconds")
+    parser.add_argument("--gpu", action="store_true", help="GPU ray casting instead of the CPU LOD renderer")
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds allowed per case")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.run_case:
+        # Child process: one case, results as a JSON line on stdout
+        print(json.dumps(run_case(json.loads(options.run_case), options)))
+        return 0
+
+    sizes, dtypes = ((128, 256), ("int16",)) if options.quick else (options.sizes, options.dtypes)
+    if options.max_memory_gb:
+        max_bytes = options.max_memory_gb * 1024 ** 3
+    else:
+        max_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    cases, skipped = synthetic_cases(sizes, dtypes, max_bytes, scrub=not options.quick)
+    if not options.no_real:
+        cases += real_cases()
+    if options.filter:
+        cases = [case for case in cases if options.filter in case["name"]]
+    for name in skipped:
+        print(f"skipped {name}: needs more memory than {max_bytes / 1024 ** 3:.1f} GB")
+
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(),
+               "options": {"view_size": options.view_size, "frames": options.frames, "sweep": options.sweep,
+                           "gpu": options.gpu},
+               "cases": {}}
+    for case in cases:
+        metrics = run_in_subprocess(case, options)
+        results["cases"][case["name"]] = metrics
+        if "error" in metrics:
+            print(f"{case['name']}: failed: {metrics['error']}")
+        else:
+            print(f"{case['name']}: load {metrics['load.seconds']:.2f} s ({metrics['load.peak_mb']:.0f} MB), "
+                  f"axial {metrics['update_slice.axial.slices_per_second']:.0f} slices/s, "
+                  f"click {metrics['update_views_based_on_click.axial.p50_ms']:.1f} ms, "
+                  f"3D first frame {metrics['setup_3d_view.seconds']:.2f} s, "
+                  f"3D {metrics['render_3d.full.p50_ms']:.0f} ms/frame")
+
+    # Scrubbing the thin-slice study has to keep up with the display on every axis
+    missed = []
+    for dtype in dtypes:
+        metrics = results["cases"].get(scrub_case_name(dtype), {})
+        for axis in AXES:
+            value = metrics.get(f"scrub.{axis}.slices_per_second")
+            if value is None:
+                continue
+            status = "ok" if value >= options.scrub_target else "BELOW TARGET"
+            print(f"{scrub_case_name(dtype)} scrub {axis}: {value:.0f} slices/s "
+                  f"(hit rate {metrics[f'scrub.{axis}.hit_rate']:.2f}), target {options.scrub_target:.0f}: {status}")
+            if value < options.scrub_target:
+                missed.append((dtype, axis))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for name, metric, before, value in regressions:
+            print(f"regression {name} {metric}: {before:.4g} -> {value:.4g}")
+        if regressions:
+            return 1
+        print("no regressions against the baseline")
+    return 1 if missed else 0
+
+
+if __name__ == "__main__":
+    # python benchmarks/run_benchmarks.py [--quick] [--output results.json] [--baseline baseline.json]
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from vtkmodules.vtkRenderingCore import vtkRenderWindow
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from viewer_session import ViewerSession  # noqa: E402
+from volume import Volume  # noqa: E402
+from volume_loader import read_dicom_series, read_mha  # noqa: E402
+
+
+def resident_bytes():
+    # Current resident set size; /proc is Linux only, elsewhere fall back to the peak from getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def synthetic_volume(load, shape):
+    # A different volume per load, alternating between two sizes so buffers are also resized
+    depth, height, width = shape if load % 2 == 0 else (shape[0] // 2, shape[1], shape[2] // 2 + 8)
+    rng = np.random.default_rng(load)
+    array = rng.integers(-1000, 1500, size=(depth, height, width), dtype=np.int16)
+    return Volume(array, (0.8, 0.8, 1.5), (0.0, 0.0, 0.0))
+
+
+def offscreen_window(size):
+    render_window = vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(*size)
+    return render_window
+
+
+def soak(loads, shape, study=None, warmup=10, size=(256, 256)):
+    slice_windows = {axis: offscreen_window(size) for axis in ("axial", "coronal", "sagittal")}
+    volume_window = offscreen_window(size)
+    session = ViewerSession(slice_windows, volume_window)
+
+    samples = []
+    start = time.perf_counter()
+    for load in range(loads):
+        if study is None:
+            volume = synthetic_volume(load, shape)
+        elif study.endswith(".mha"):
+            volume = read_mha(study)
+        else:
+            volume = read_dicom_series(study)
+
+        # What the viewer does per study: all three views, a scroll through each, and a CPU 3D frame
+        session.load(volume, volume.default_window_level())
+        for axis, pipeline in session.slice_pipelines.items():
+            count = session.engine.slice_count(axis)
+            for index in range(0, count, max(1, count // 8)):
+                pipeline.show_slice(index)
+            pipeline.render_window.Render()
+        session.show_3d(use_gpu=False, frame_time=0.05)
+        volume_window.Render()
+        del volume
+
+        samples.append(resident_bytes())
+    elapsed = time.perf_counter() - start
+    session.release()
+    session.prefetch_pool.shutdown(wait=True)
+
+    # Growth is measured after the warm-up loads, once allocator pools and VTK's lazy state are in place
+    baseline = samples[min(warmup, len(samples) - 1)]
+    return {
+        "loads": loads,
+        "seconds": elapsed,
+        "rss_baseline_mb": baseline / 2 ** 20,
+        "rss_final_mb": samples[-1] / 2 ** 20,
+        "rss_peak_mb": max(samples) / 2 ** 20,
+        "rss_growth_mb": (samples[-1] - baseline) / 2 ** 20,
+        "rss_mb": [round(sample / 2 ** 20, 1) for sample in samples],
+        "stages": session.perf.summary(),
+    }
+
+
+if __name__ == "__main__":
+    # python benchmarks/soak_study_loads.py [--study file.mha|file.dcm] [--loads 200]
+    parser = argparse.ArgumentParser(description="Load studies repeatedly into one viewer session and track RSS")
+    parser.add_argument("--loads", type=int, default=200)
+    parser.add_argument("--shape", type=int, nargs=3, default=(64, 256, 256), metavar=("Z", "Y", "X"))
+    parser.add_argument("--study", help="MHA file or DICOM slice to reload instead of synthetic volumes")
+    parser.add_argument("--max-growth-mb", type=float, default=32.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = soak(args.loads, tuple(args.shape), args.study)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    print(f"{results['loads']} loads in {results['seconds']:.1f} s, RSS {results['rss_baseline_mb']:.1f} -> "
+          f"{results['rss_final_mb']:.1f} MB (peak {results['rss_peak_mb']:.1f} MB)")
+    if results["rss_growth_mb"] > args.max_growth_mb:
+        print(f"RSS grew by {results['rss_growth_mb']:.1f} MB, more than {args.max_growth_mb} MB")
+        sys.exit(1)
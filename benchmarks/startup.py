@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_STUDY = os.path.join(REPO_ROOT, "data_example", "MHA", "BRATS_HG0015_T1.mha")
+
+# Targets on the median of the runs, from launching the interpreter
+DEFAULT_FIRST_WINDOW_MS = 1000.0
+DEFAULT_FIRST_SLICE_MS = 3000.0
+
+# A run that has not drawn its first slice by then is reported as failed
+CHILD_TIMEOUT_S = 120.0
+
+
+def child(study, launched, mode):
+    # One cold start of the viewer: time to the window, then to the first axial slice drawn
+    def elapsed():
+        return time.time() - launched
+
+    marks = {}
+    sys.path.insert(0, REPO_ROOT)
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    import MPR
+    marks["imports"] = elapsed()
+
+    app = QApplication(sys.argv[:1])
+    window = MPR.MPRWindow()
+    window.volume_render_mode_box.setCurrentIndex(window.volume_render_mode_box.findData(mode))
+    window.resize(1200, 800)
+    window.show()
+
+    def on_first_window():
+        # The first turn of the event loop after show(), once the window has been laid out and painted
+        marks["first_window"] = elapsed()
+        if study.endswith(".mha"):
+            window.load_mha_data(study)
+        else:
+            window.load_dicom_data(study)
+
+    def poll_first_slice():
+        render = window.perf.get("render", "axial")
+        if render is not None and render.count:
+            marks["first_slice"] = elapsed()
+            create_views = window.perf.get("create_views")
+            marks["create_views"] = create_views.total if create_views else None
+            app.quit()
+        elif elapsed() > CHILD_TIMEOUT_S:
+            app.quit()
+
+    QTimer.singleShot(0, on_first_window)
+    poll = QTimer()
+    poll.timeout.connect(poll_first_slice)
+    poll.start(1)
+    app.exec_()
+    print(json.dumps(marks))
+    sys.stdout.flush()
+    # Skip tearing down the panels; only the startup is measured
+    os._exit(0 if "first_slice" in marks else 1)
+
+
+def run(study, runs, mode, cold):
+    # Every run is a fresh interpreter, so imports are paid again; the volume cache is warmed by an untimed
+    # run first unless cold starts (decoding included) are asked for
+    cache_root = tempfile.mkdtemp(prefix="mpr-startup-")
+    samples = []
+    try:
+        for run_index in range(runs + (0 if cold else 1)):
+            env = dict(os.environ, MPR_LOG_LEVEL="WARNING",
+                       MPR_CACHE_DIR=os.path.join(cache_root, str(run_index)) if cold else cache_root)
+            launched = time.time()
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", study,
+                                     "--launched", repr(launched), "--3d", mode],
+                                    env=env, capture_output=True, text=True, timeout=CHILD_TIMEOUT_S + 30)
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode != 0 or not lines:
+                raise RuntimeError(f"Startup run failed ({result.returncode}): {result.stderr[-2000:]}")
+            if cold or run_index > 0:
+                samples.append(json.loads(lines[-1]))
+    finally:
+        shutil.rmtree(cache_root, ignore_errors=True)
+
+    results = {"study": study, "runs": runs, "cold_cache": cold, "3d": mode, "samples": samples}
+    for mark in ("imports", "first_window", "first_slice", "create_views"):
+        values = np.array([sample[mark] for sample in samples if sample.get(mark) is not None]) * 1000
+        if len(values):
+            results[f"{mark}_ms"] = {"median": float(np.median(values)), "min": float(values.min()),
+                                     "max": float(values.max())}
+    return results
+
+
+def main():
+    # python benchmarks/startup.py [study.mha|slice.dcm] [--runs 5] [--cold] [--first-window-ms 1000]
+    parser = argparse.ArgumentParser(description="Time from launch to the first window and the first slice")
+    parser.add_argument("study", nargs="?", default=DEFAULT_STUDY)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="a fresh volume cache per run, so the study is decoded")
+    parser.add_argument("--3d", dest="mode", default="auto", choices=("auto", "gpu", "cpu", "surface"),
+                        help="3D panel mode the viewer starts in")
+    parser.add_argument("--first-window-ms", type=float, default=DEFAULT_FIRST_WINDOW_MS)
+    parser.add_argument("--first-slice-ms", type=float, default=DEFAULT_FIRST_SLICE_MS)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--launched", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.study, args.launched, args.mode)
+        return
+
+    results = run(os.path.abspath(args.study), args.runs, args.mode, args.cold)
+    results["targets_ms"] = {"first_window": args.first_window_ms, "first_slice": args.first_slice_ms}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    for mark, target in (("first_window", args.first_window_ms), ("first_slice", args.first_slice_ms)):
+        stats = results[f"{mark}_ms"]
+        status = "ok" if stats["median"] <= target else "OVER TARGET"
+        failed |= stats["median"] > target
+        print(f"{mark}: median {stats['median']:.0f} ms (min {stats['min']:.0f}, max {stats['max']:.0f}), "
+              f"target {target:.0f} ms: {status}")
+    print(f"imports: median {results['imports_ms']['median']:.0f} ms")
+    if "create_views_ms" in results:
+        print(f"render windows created in {results['create_views_ms']['median']:.0f} ms")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
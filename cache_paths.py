@@ -0,0 +1,9 @@
+import os
+
+
+def cache_dir(*parts):
+    # On-disk caches live under MPR_CACHE_DIR, or ~/.cache/mpr by default
+    root = os.environ.get("MPR_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "mpr")
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cache_paths import cache_dir
+
+# Header tags needed to group and order slices, read without touching the pixel data
+WANTED_TAGS = {
+    (0x0008, 0x0060): ("modality", "str"),
+    (0x0020, 0x000E): ("series_uid", "str"),
+    (0x0020, 0x0011): ("series_number", "str"),
+    (0x0020, 0x0013): ("instance_number", "int"),
+    (0x0020, 0x0032): ("position", "floats"),
+    (0x0020, 0x0037): ("orientation", "floats"),
+    (0x0020, 0x0052): ("frame_of_reference", "str"),
+    (0x0028, 0x0010): ("rows", "us"),
+    (0x0028, 0x0011): ("columns", "us"),
+}
+LAST_TAG = max(WANTED_TAGS)
+
+# Explicit VRs whose length is stored in 4 bytes after two reserved bytes
+LONG_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN", b"UR", b"UT", b"UV"}
+ITEM, ITEM_END, SEQUENCE_END = (0xFFFE, 0xE000), (0xFFFE, 0xE00D), (0xFFFE, 0xE0DD)
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Below this many unindexed files a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+
+def _read_element_header(f, explicit, endian):
+    header = f.read(8)
+    if len(header) < 8:
+        return None
+    tag = struct.unpack(endian + "HH", header[:4])
+    if tag[0] == 0xFFFE:
+        # Item and delimiter tags always use a 4-byte length
+        return tag, struct.unpack(endian + "I", header[4:])[0]
+    if not explicit:
+        return tag, struct.unpack(endian + "I", header[4:])[0]
+    if header[4:6] in LONG_VRS:
+        return tag, struct.unpack(endian + "I", f.read(4))[0]
+    return tag, struct.unpack(endian + "H", header[6:])[0]
+
+
+def _skip_undefined_length(f, explicit, endian):
+    # Skip a sequence (or item) of undefined length, recursing into nested ones
+    while True:
+        element = _read_element_header(f, explicit, endian)
+        if element is None or element[0] in (ITEM_END, SEQUENCE_END):
+            return
+        tag, length = element
+        if length == UNDEFINED_LENGTH:
+            _skip_undefined_length(f, explicit, endian)
+        else:
+            f.seek(length, 1)
+
+
+def _decode(raw, kind, endian):
+    if kind == "us":
+        return struct.unpack(endian + "H", raw[:2])[0]
+    text = raw.decode("ascii", errors="ignore").strip("\x00 ")
+    if kind == "int":
+        return int(text) if text.lstrip("-").isdigit() else None
+    if kind == "floats":
+        try:
+            return [float(value) for value in text.split("\\")]
+        except ValueError:
+            return None
+    return text
+
+
+def read_dicom_header(file_path):
+    # Parse the file meta and dataset elements up to LAST_TAG and stop before the pixel data
+    header = {}
+    with open(file_path, "rb") as f:
+        f.seek(128)
+        if f.read(4) != b"DICM":
+            f.seek(0)  # No preamble: assume a bare implicit VR little endian dataset
+            explicit, endian, in_meta = False, "<", False
+        else:
+            explicit, endian, in_meta = True, "<", True
+
+        while True:
+            start = f.tell()
+            element = _read_element_header(f, explicit, endian)
+            if element is None:
+                break
+            tag, length = element
+
+            if in_meta and tag[0] != 0x0002:
+                # The file meta group is always explicit little endian; the rest follows the transfer syntax
+                in_meta = False
+                syntax = header.pop("transfer_syntax", "")
+                if syntax == "1.2.840.10008.1.2.1.99":
+                    break  # Deflated datasets cannot be read header-first
+                explicit, endian = syntax != "1.2.840.10008.1.2", ">" if syntax == "1.2.840.10008.1.2.2" else "<"
+                f.seek(start)
+                continue
+
+            if tag > LAST_TAG:
+                break
+            if length == UNDEFINED_LENGTH:
+                _skip_undefined_length(f, explicit, endian)
+            elif tag == (0x0002, 0x0010):
+                header["transfer_syntax"] = _decode(f.read(length), "str", endian)
+            elif tag in WANTED_TAGS:
+                name, kind = WANTED_TAGS[tag]
+                header[name] = _decode(f.read(length), kind, endian)
+            else:
+                f.seek(length, 1)
+
+    header.pop("transfer_syntax", None)
+    return header
+
+
+def _read_header_or_none(file_path):
+    try:
+        return read_dicom_header(file_path)
+    except (OSError, struct.error):
+        return None
+
+
+def _slice_position(header):
+    # Distance along the image plane normal, falling back to the instance number
+    orientation, position = header.get("orientation"), header.get("position")
+    if orientation and len(orientation) == 6 and position and len(position) == 3:
+        normal = np.cross(orientation[:3], orientation[3:])
+        return float(np.dot(normal, position))
+    return float(header.get("instance_number") or 0)
+
+
+def _series_order(entry):
+    # Series numbers are IS strings; "10" belongs after "2", and series without a number go last
+    try:
+        number = (0, float(entry["series_number"]))
+    except (TypeError, ValueError):
+        number = (1, 0.0)
+    return number + (entry["files"][0],)
+
+
+def group_series(headers):
+    # Group {path: header} into series ordered along the slice normal
+    groups = {}
+    for file_path, header in headers.items():
+        key = (header.get("series_uid", ""), header.get("rows"), header.get("columns"))
+        groups.setdefault(key, []).append(file_path)
+
+    # Anonymizers sometimes give every file its own SeriesInstanceUID; regroup those
+    # single-file series by series number, frame of reference and geometry instead
+    singles = [key for key, files in groups.items() if len(files) == 1]
+    if len(singles) > 1:
+        for key in singles:
+            file_path = groups.pop(key)[0]
+            header = headers[file_path]
+            orientation = tuple(round(value, 3) for value in header.get("orientation") or ())
+            fallback = ("series:%s" % header.get("series_number", ""), header.get("frame_of_reference", ""),
+                        orientation, header.get("rows"), header.get("columns"))
+            groups.setdefault(fallback, []).append(file_path)
+
+    series = []
+    for key, files in groups.items():
+        positions = {file_path: _slice_position(headers[file_path]) for file_path in files}
+        files.sort(key=lambda file_path: (positions[file_path], file_path))
+        first = headers[files[0]]
+        series.append({
+            "series_uid": first.get("series_uid", ""),
+            "series_number": first.get("series_number", ""),
+            "modality": first.get("modality", ""),
+            "rows": first.get("rows"),
+            "columns": first.get("columns"),
+            "orientation": first.get("orientation"),
+            "files": files,
+            "positions": [positions[file_path] for file_path in files],
+        })
+    series.sort(key=_series_order)
+    return series
+
+
+class DicomIndex:
+    # Header index of DICOM directories, cached on disk per directory and keyed by path, mtime and size
+    def __init__(self, index_dir=None, max_workers=None):
+        self.index_dir = index_dir or cache_dir("dicom_index")
+        self.max_workers = max_workers
+
+    def _index_file(self, directory):
+        digest = hashlib.sha1(os.path.abspath(directory).encode("utf-8")).hexdigest()
+        return os.path.join(self.index_dir, digest + ".json")
+
+    def _load(self, directory):
+        try:
+            with open(self._index_file(directory)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, directory, entries):
+        index_file = self._index_file(directory)
+        temp_file = index_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(entries, f)
+        os.replace(temp_file, index_file)
+
+    def _parse(self, file_paths):
+        if len(file_paths) < PARALLEL_THRESHOLD:
+            return [_read_header_or_none(file_path) for file_path in file_paths]
+
+        # Spawned workers stay safe when the caller runs on a Qt thread
+        context = multiprocessing.get_context("spawn")
+        workers = self.max_workers or os.cpu_count() or 1
+        chunk_size = max(1, len(file_paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            return list(pool.map(_read_header_or_none, file_paths, chunksize=chunk_size))
+
+    def scan(self, directory):
+        # Returns the series in a directory; only new or changed files are parsed. Paths are absolute so that
+        # the cached entries match however the directory was named
+        directory = os.path.abspath(directory)
+        cached = self._load(directory)
+        entries, stale = {}, []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.lower().endswith(".dcm"):
+                    continue
+                stat = entry.stat()
+                previous = cached.get(entry.path)
+                if previous and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+                    entries[entry.path] = previous
+                else:
+                    entries[entry.path] = {"mtime": stat.st_mtime, "size": stat.st_size, "header": None}
+                    stale.append(entry.path)
+
+        for file_path, header in zip(stale, self._parse(stale)):
+            entries[file_path]["header"] = header
+        if stale or len(entries) != len(cached):
+            self._save(directory, entries)
+
+        headers = {file_path: entry["header"] for file_path, entry in entries.items() if entry["header"]}
+        return group_series(headers)
+
+    def series_for_file(self, file_path):
+        # The series that a file picked in the file dialog belongs to
+        file_path = os.path.abspath(file_path)
+        all_series = self.scan(os.path.dirname(file_path))
+        for series in all_series:
+            if file_path in series["files"]:
+                return series
+        if not all_series:
+            raise IOError(f"No readable DICOM files next to {file_path}")
+        return all_series[0]
@@ -0,0 +1,258 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOImage import vtkPNGWriter
+from vtkmodules.vtkRenderingCore import vtkRenderWindow, vtkWindowToImageFilter
+
+from slab import PROJECTION_MODES
+from slice_engine import SliceEngine
+from studies import display_shape, find_studies, slice_spacing
+from surface import DEFAULT_TRIANGLE_BUDGET, SurfaceCache, export_surface
+from viewer_session import VolumeViewPipeline
+from volume import AXES
+from volume_cache import source_key
+from volume_loader import read_dicom_series, read_mha
+from window_level import CT_PRESETS
+
+logger = logging.getLogger(__name__)
+
+VIEWS = tuple(AXES) + ("3d",)
+
+# Projections --slab accepts; "slice" is the default without --slab
+SLAB_MODES = tuple(mode for mode in PROJECTION_MODES if mode != "slice")
+
+# Longest edge of each thumbnail in a montage
+DEFAULT_THUMBNAIL = 128
+
+# Every preset a volume can have; which ones it does have depends on whether it looks like CT
+PRESET_NAMES = ("Default",) + tuple(name for name, _ in CT_PRESETS) + ("Full range",)
+
+
+def find_preset(presets, name):
+    # Preset names are matched case-insensitively; a preset the study lacks is an error, never the default
+    for preset, window_level in presets.items():
+        if preset.lower() == name.lower():
+            return window_level
+    raise ValueError(f"No window/level preset {name!r} for this study; it has: {', '.join(presets)}")
+
+
+def resize_linear(image, rows, cols):
+    # Bilinear resize of a 2D image; used for square pixels and for thumbnails
+    height, width = image.shape
+    if (rows, cols) == (height, width):
+        return image
+    y = np.linspace(0, height - 1, rows, dtype=np.float32)
+    x = np.linspace(0, width - 1, cols, dtype=np.float32)
+    y0 = np.minimum(y.astype(np.intp), max(height - 2, 0))
+    x0 = np.minimum(x.astype(np.intp), max(width - 2, 0))
+    y1, x1 = np.minimum(y0 + 1, height - 1), np.minimum(x0 + 1, width - 1)
+    fy, fx = (y - y0)[:, None], (x - x0)[None, :]
+    image = image.astype(np.float32)
+    top = image[y0][:, x0] + (image[y0][:, x1] - image[y0][:, x0]) * fx
+    bottom = image[y1][:, x0] + (image[y1][:, x1] - image[y1][:, x0]) * fx
+    return np.rint(top + (bottom - top) * fy).astype(np.uint8)
+
+
+def write_png(image, file_path):
+    # Row 0 is written at the bottom, as the 2D views draw it
+    image = np.ascontiguousarray(image)
+    image_data = vtkImageData()
+    image_data.SetDimensions(image.shape[1], image.shape[0], 1)
+    components = image.shape[2] if image.ndim == 3 else 1
+    image_data.GetPointData().SetScalars(numpy_support.numpy_to_vtk(image.reshape(-1, components), deep=False))
+    writer = vtkPNGWriter()
+    writer.SetFileName(file_path)
+    writer.SetInputData(image_data)
+    writer.Write()
+
+
+def montage(engine, axis, tiles, columns, thumbnail):
+    # Evenly spaced slices of one axis as a grid of thumbnails, first slice top left in the written PNG
+    count = engine.slice_count(axis)
+    indices = np.unique(np.linspace(0, count - 1, min(tiles, count)).round().astype(np.intp))
+    rows, cols = display_shape(engine.slice_shape(axis), slice_spacing(engine.volume, axis), thumbnail)
+    grid_rows = -(-len(indices) // columns)
+    canvas = np.zeros((grid_rows * rows, columns * cols), dtype=np.uint8)
+    for tile, index in enumerate(indices):
+        # PNG rows are written bottom up, so the first grid row goes last in the array
+        row, column = grid_rows - 1 - tile // columns, tile % columns
+        canvas[row * rows:(row + 1) * rows, column * cols:(column + 1) * cols] = resize_linear(
+            engine.get_slice(axis, int(index), mapped=True), rows, cols)
+    return canvas
+
+
+def snapshot_3d(volume, window_level, size, use_gpu):
+    # One frame of the 3D panel, rendered offscreen with the viewer's own volume pipeline
+    render_window = vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(size, size)
+    pipeline = VolumeViewPipeline(render_window)
+    pipeline.attach(volume, window_level, use_gpu, frame_time=1.0)
+    render_window.Render()
+
+    grabber = vtkWindowToImageFilter()
+    grabber.SetInput(render_window)
+    grabber.SetInputBufferTypeToRGB()
+    grabber.ReadFrontBufferOff()
+    grabber.Update()
+    output = grabber.GetOutput()
+    width, height, _ = output.GetDimensions()
+    image = numpy_support.vtk_to_numpy(output.GetPointData().GetScalars()).reshape(height, width, 3).copy()
+    pipeline.release()
+    render_window.Finalize()
+    return image
+
+
+def export_study(name, kind, path, series, options):
+    # Runs in a worker process; returns what was written, or the error that stopped this study
+    start = time.perf_counter()
+    written = []
+    try:
+        volume = read_mha(path) if kind == "mha" else read_dicom_series(path, series=series)
+        if options.window:
+            window_level = tuple(options.window)
+        elif options.preset:
+            volume.default_window_level()  # Fills in the presets
+            window_level = find_preset(volume.window_presets, options.preset)
+        else:
+            # The same percentile window the viewer opens a study with
+            window_level = volume.default_window_level()
+        engine = SliceEngine(volume, window_level)
+        if options.slab:
+            engine.set_projection(*options.slab)
+
+        study_dir = os.path.join(options.output, name)
+        os.makedirs(study_dir, exist_ok=True)
+        for view in options.views:
+            if view == "3d":
+                written.append(os.path.join(study_dir, "3d.png"))
+                write_png(snapshot_3d(volume, window_level, options.size, options.gpu), written[-1])
+                continue
+
+            shape = display_shape(engine.slice_shape(view), slice_spacing(volume, view))
+            if options.stack:
+                stack_dir = os.path.join(study_dir, view)
+                os.makedirs(stack_dir, exist_ok=True)
+                for index in range(engine.slice_count(view)):
+                    written.append(os.path.join(stack_dir, f"{index:04d}.png"))
+                    write_png(resize_linear(engine.get_slice(view, index, mapped=True), *shape), written[-1])
+            else:
+                index = engine.slice_count(view) // 2
+                written.append(os.path.join(study_dir, f"{view}.png"))
+                write_png(resize_linear(engine.get_slice(view, index, mapped=True), *shape), written[-1])
+            if options.montage:
+                written.append(os.path.join(study_dir, f"{view}_montage.png"))
+                write_png(montage(engine, view, options.montage, options.columns, options.thumbnail), written[-1])
+
+        if options.surface is not None:
+            # Meshes go through the viewer's surface cache, so nightly reruns and the GUI reuse them
+            key = source_key(series["files"] if series else [path])
+            mesh = SurfaceCache().get(volume, options.surface, options.triangles, key)
+            written.append(os.path.join(study_dir, f"surface.{options.surface_format}"))
+            export_surface(mesh, written[-1])
+    except Exception as e:
+        return {"study": name, "source": path, "error": f"{type(e).__name__}: {e}",
+                "seconds": time.perf_counter() - start, "files": written}
+    return {"study": name, "source": path, "files": written, "seconds": time.perf_counter() - start}
+
+
+def export(studies, options):
+    # One study per task; spawned workers, as for the DICOM index, and no pool at all for a single worker
+    workers = min(options.workers or os.cpu_count() or 1, len(studies)) or 1
+    if workers == 1:
+        for study in studies:
+            yield export_study(*study, options)
+        return
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(export_study, *study, options) for study in studies]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def positive_int(value):
+    # argparse type for counts: a usage error, not a failed export, when it is not a whole number above zero
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"not a positive whole number: {value!r}")
+    return number
+
+
+def slab_value(value):
+    # --slab MODE SLICES: the projection name is kept as given, the slice count has to be positive
+    if value in SLAB_MODES:
+        return value
+    try:
+        return positive_int(value)
+    except argparse.ArgumentTypeError:
+        raise argparse.ArgumentTypeError(f"{value!r} is neither a projection ({', '.join(SLAB_MODES)}) "
+                                         "nor a positive number of slices") from None
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Export PNG snapshots, slice stacks and montages without the GUI")
+    parser.add_argument("inputs", nargs="+", help=".mha files, .dcm files or directories of DICOM series")
+    parser.add_argument("-o", "--output", default="mpr-export", help="directory to write one folder per study to")
+    parser.add_argument("--views", nargs="+", choices=VIEWS, default=list(VIEWS))
+    parser.add_argument("--stack", action="store_true", help="every slice of each 2D view instead of the middle one")
+    parser.add_argument("--montage", type=int, default=0, metavar="TILES",
+                        help="also write a montage of this many evenly spaced slices per 2D view")
+    parser.add_argument("--columns", type=int, default=8, help="montage columns")
+    parser.add_argument("--thumbnail", type=int, default=DEFAULT_THUMBNAIL, help="longest montage tile edge in pixels")
+    parser.add_argument("--window", type=float, nargs=2, metavar=("WINDOW", "LEVEL"))
+    parser.add_argument("--preset", help=f"window/level preset of the volume: {', '.join(PRESET_NAMES)} "
+                                          "(any case; the CT ones only for CT studies)")
+    parser.add_argument("--slab", nargs=2, type=slab_value, metavar=("MODE", "SLICES"),
+                        help="thick-slab projection (mip, minip or average) over this many slices")
+    parser.add_argument("--surface", type=float, metavar="THRESHOLD",
+                        help="also write the isosurface at this stored voxel value")
+    parser.add_argument("--surface-format", choices=("stl", "ply", "obj", "vtp"), default="stl")
+    parser.add_argument("--triangles", type=int, default=DEFAULT_TRIANGLE_BUDGET, help="isosurface triangle budget")
+    parser.add_argument("--size", type=int, default=512, help="3D snapshot edge in pixels")
+    parser.add_argument("--gpu", action="store_true", help="GPU ray casting for the 3D snapshot")
+    parser.add_argument("--workers", type=int, help="studies exported in parallel (default: one per core)")
+    options = parser.parse_args(argv)
+    if options.slab and options.slab[0] not in SLAB_MODES:
+        parser.error(f"unknown slab projection: {options.slab[0]} (choose from {', '.join(SLAB_MODES)})")
+    if options.slab and not isinstance(options.slab[1], int):
+        parser.error(f"--slab takes the projection first, then the number of slices, not {options.slab[1]}")
+    if options.preset and options.preset.lower() not in (name.lower() for name in PRESET_NAMES):
+        parser.error(f"unknown preset: {options.preset} (choose from {', '.join(PRESET_NAMES)})")
+    return options
+
+
+def main(argv=None, prog=None):
+    options = parse_args(argv, prog)
+    studies = find_studies(options.inputs)
+    if not studies:
+        logger.error("No studies found in %s", " ".join(options.inputs))
+        return 1
+
+    start = time.perf_counter()
+    failed = 0
+    for result in export(studies, options):
+        if "error" in result:
+            failed += 1
+            logger.error("%s (%s): %s", result["study"], result["source"], result["error"])
+        else:
+            logger.info("%s: %d files in %.2f s", result["study"], len(result["files"]), result["seconds"])
+    logger.info("Exported %d of %d studies in %.1f s", len(studies) - failed, len(studies),
+                time.perf_counter() - start)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("MPR_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from volume import AXES, SLICE_PLANE_AXES
+
+# Output pixels per task; planes are split into row bands of about this size and sampled in parallel
+BAND_PIXELS = 1 << 16
+
+# Voxels by which a sample may lie outside the volume and still be interpolated from the border
+EDGE_TOLERANCE = 1e-3
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def resample_executor():
+    # One pool for all resampling; numpy releases the GIL in the gathers and arithmetic, so bands run on all cores
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="resample")
+        return _executor
+
+
+def rotation(about_u, about_v):
+    # Tilt in degrees about the view's horizontal (u) and vertical (v) axes, in the view's (u, v, n) frame
+    a, b = np.radians(about_u), np.radians(about_v)
+    rotate_u = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    rotate_v = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    return rotate_u @ rotate_v
+
+
+def background(volume):
+    # Value of samples outside the volume: its minimum, so the area around a study looks like its darkest
+    # voxels (air in CT) rather than a value that may sit mid-window
+    if volume.histogram is None:
+        volume.default_window_level()  # Builds the histogram once; it stays on the volume
+    return volume.histogram.minimum
+
+
+def sample_trilinear(array, z, y, x, out, fill=0):
+    # Trilinear interpolation of array[z, y, x] at fractional voxel coordinates; fill outside the volume
+    depth, height, width = array.shape
+    # Points a rounding error outside the border still count as inside
+    low, high = -EDGE_TOLERANCE, np.array([depth, height, width]) - 1 + EDGE_TOLERANCE
+    inside = (z >= low) & (z <= high[0]) & (y >= low) & (y <= high[1]) & (x >= low) & (x <= high[2])
+    z0 = np.clip(np.floor(z), 0, max(depth - 2, 0)).astype(np.intp)
+    y0 = np.clip(np.floor(y), 0, max(height - 2, 0)).astype(np.intp)
+    x0 = np.clip(np.floor(x), 0, max(width - 2, 0)).astype(np.intp)
+    fz, fy, fx = z - z0.astype(np.float32), y - y0.astype(np.float32), x - x0.astype(np.float32)
+    z1, y1, x1 = np.minimum(z0 + 1, depth - 1), np.minimum(y0 + 1, height - 1), np.minimum(x0 + 1, width - 1)
+
+    # Interpolate along x, then y, then z, gathering two corners at a time
+    def along_x(zi, yi):
+        low = array[zi, yi, x0].astype(np.float32)
+        return low + (array[zi, yi, x1] - low) * fx
+
+    def along_y(zi):
+        low = along_x(zi, y0)
+        return low + (along_x(zi, y1) - low) * fy
+
+    low = along_y(z0)
+    values = low + (along_y(z1) - low) * fz
+    values[~inside] = fill
+    if np.issubdtype(out.dtype, np.integer):
+        np.rint(values, out=values)
+    out[...] = values
+    return out
+
+
+def _resample_bands(array, coordinates, shape, dtype, fill):
+    # coordinates(row_start, row_stop) -> (z, y, x) for those output rows; bands are sampled in parallel
+    out = np.empty(shape, dtype=dtype)
+    rows_per_band = max(1, BAND_PIXELS // max(shape[1], 1))
+
+    def band(start):
+        stop = min(start + rows_per_band, shape[0])
+        sample_trilinear(array, *coordinates(start, stop), out[start:stop], fill)
+
+    futures = [resample_executor().submit(band, start) for start in range(0, shape[0], rows_per_band)]
+    for future in futures:
+        future.result()
+    return out
+
+
+class ObliquePlane:
+    # A view's slice plane tilted about its in-plane axes around the centre of the slice.
+    # Pixel (row, column) keeps the view's untilted in-plane spacing, so the display pipeline is unchanged.
+    def __init__(self, volume, axis, index, tilt=(0.0, 0.0), fill=None):
+        self.volume = volume
+        self.axis = axis
+        self.fill = background(volume) if fill is None else fill
+        u, v = SLICE_PLANE_AXES[axis]
+        n = 2 - AXES[axis]
+        self.frame = (u, v, n)  # Volume (x, y, z) axis of the view's u, v and normal directions
+        self.rotation = rotation(*tilt)
+
+        rows, cols = (volume.array.shape[2 - v], volume.array.shape[2 - u])
+        self.shape = (rows, cols)
+        spacing, origin = volume.spacing, volume.origin
+        self.center = (origin[u] + (cols - 1) / 2 * spacing[u], origin[v] + (rows - 1) / 2 * spacing[v],
+                       origin[n] + index * spacing[n])
+
+    @property
+    def normal(self):
+        # Plane normal in world (x, y, z) coordinates
+        normal = np.zeros(3)
+        normal[list(self.frame)] = self.rotation[:, 2]
+        return normal
+
+    def plane_to_voxel(self, u, v):
+        # In-plane world position of the view (as on the untilted slice) to fractional (x, y, z) voxel indices
+        spacing, origin = self.volume.spacing, self.volume.origin
+        offset = self.rotation @ np.array([u - self.center[0], v - self.center[1], 0.0])
+        voxel = [0.0, 0.0, 0.0]
+        for k, volume_axis in enumerate(self.frame):
+            voxel[volume_axis] = (self.center[k] + offset[k] - origin[volume_axis]) / spacing[volume_axis]
+        return voxel
+
+    def coordinates(self, row_start, row_stop):
+        # (z, y, x) voxel coordinates of output rows [row_start, row_stop), as float32 arrays
+        spacing, origin = self.volume.spacing, self.volume.origin
+        u, v, _ = self.frame
+        du = (origin[u] + np.arange(self.shape[1]) * spacing[u] - self.center[0]).astype(np.float32)
+        dv = (origin[v] + np.arange(row_start, row_stop) * spacing[v] - self.center[1]).astype(np.float32)
+        voxel = [None, None, None]
+        for k, volume_axis in enumerate(self.frame):
+            world = (self.center[k] + self.rotation[k, 0] * du[None, :] + self.rotation[k, 1] * dv[:, None])
+            voxel[volume_axis] = (world - origin[volume_axis]) / spacing[volume_axis]
+        return voxel[2], voxel[1], voxel[0]
+
+    def sample(self):
+        return _resample_bands(self.volume.array, self.coordinates, self.shape, self.volume.array.dtype, self.fill)
+
+
+def sample_planes(planes):
+    # Several planes at once: every band of every plane is queued before any result is awaited
+    executor = resample_executor()
+    outputs, futures = [], []
+    for plane in planes:
+        out = np.empty(plane.shape, dtype=plane.volume.array.dtype)
+        rows_per_band = max(1, BAND_PIXELS // max(plane.shape[1], 1))
+        for start in range(0, plane.shape[0], rows_per_band):
+            stop = min(start + rows_per_band, plane.shape[0])
+            futures.append(executor.submit(
+                lambda plane=plane, out=out, start=start, stop=stop:
+                sample_trilinear(plane.volume.array, *plane.coordinates(start, stop), out[start:stop], plane.fill)))
+        outputs.append(out)
+    for future in futures:
+        future.result()
+    return outputs
+
+
+def resample_polyline(points, step):
+    # Points at equal arc-length steps along a polyline given in world coordinates
+    points = np.asarray(points, dtype=np.float64)
+    lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+    positions = np.arange(0.0, lengths[-1] + step / 2, step)
+    return np.stack([np.interp(positions, lengths, points[:, k]) for k in range(3)], axis=1)
+
+
+def curved_reformation(volume, points, view_normal, width=None, step=None, fill=None):
+    # Straightened CPR: one output row per step along the curve, sampled across it perpendicular to both the
+    # curve and the normal of the view it was drawn in. points and view_normal are in world (x, y, z).
+    # Samples outside the volume are fill, by default the volume's minimum.
+    # Returns the image and its (row, column) pixel spacing.
+    step = step or min(volume.spacing)
+    if width is None:
+        extent = np.array(volume.array.shape[::-1]) * np.array(volume.spacing)
+        width = float(extent.max()) / 2
+    centre = resample_polyline(points, step)
+    if len(centre) < 2:
+        raise ValueError("The curve needs at least two distinct points")
+
+    tangents = np.gradient(centre, axis=0)
+    tangents /= np.linalg.norm(tangents, axis=1, keepdims=True)
+    lateral = np.cross(tangents, np.asarray(view_normal, dtype=np.float64))
+    norms = np.linalg.norm(lateral, axis=1, keepdims=True)
+    if np.any(norms < 1e-6):
+        raise ValueError("The curve must not run along the view normal")
+    lateral /= norms
+
+    offsets = (np.arange(int(round(width / step)) + 1) - width / step / 2) * step
+    origin, spacing = np.asarray(volume.origin), np.asarray(volume.spacing)
+
+    def coordinates(row_start, row_stop):
+        world = (centre[row_start:row_stop, None, :] + offsets[None, :, None] * lateral[row_start:row_stop, None, :])
+        voxel = ((world - origin) / spacing).astype(np.float32)
+        return voxel[..., 2], voxel[..., 1], voxel[..., 0]
+
+    image = _resample_bands(volume.array, coordinates, (len(centre), len(offsets)), volume.array.dtype,
+                            background(volume) if fill is None else fill)
+    return image, (step, step)
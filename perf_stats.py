@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Most recent samples kept per stage for the percentiles
+SAMPLE_WINDOW = 2048
+
+# Frames averaged for the FPS shown in the overlay
+FPS_FRAMES = 30
+
+
+class StageStats:
+    # Count, total and maximum over every sample; percentiles over the most recent SAMPLE_WINDOW samples
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.last = seconds
+        self.samples.append(seconds)
+
+    def summary(self):
+        p50, p90, p99 = np.percentile(np.fromiter(self.samples, dtype=np.float64), (50, 90, 99)) * 1000
+        return {"count": self.count, "total_ms": self.total * 1000, "mean_ms": self.total / self.count * 1000,
+                "last_ms": self.last * 1000, "max_ms": self.maximum * 1000,
+                "p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+
+
+class PerfStats:
+    # Timings per stage and view; loaders and prefetch workers record from other threads, hence the lock
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, view=None):
+        with self._lock:
+            stats = self._stages.get((stage, view))
+            if stats is None:
+                stats = self._stages[(stage, view)] = StageStats()
+            stats.add(seconds)
+
+    @contextmanager
+    def timed(self, stage, view=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, view)
+
+    def get(self, stage, view=None):
+        return self._stages.get((stage, view))
+
+    def summary(self):
+        # {stage: {view: {...}}}; stages recorded without a view are listed under "all"
+        with self._lock:
+            items = sorted(self._stages.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            summary = {}
+            for (stage, view), stats in items:
+                summary.setdefault(stage, {})[view or "all"] = stats.summary()
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+    def dump(self, file_path, **extra):
+        # Stage timings plus whatever else the caller wants in the report (cache and scheduler counters, ...)
+        report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": self.summary()}
+        report.update(extra)
+        with open(file_path, "w") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+class RenderTimer:
+    # Times every Render() of a window as the "render" stage, and can show FPS and last frame cost in a corner
+    def __init__(self, perf, view, render_window, renderer):
+        self.perf = perf
+        self.view = view
+        self.frame_ends = deque(maxlen=FPS_FRAMES)
+        self._start = None
+
+        from vtkmodules.vtkRenderingCore import vtkTextActor
+
+        self.text = vtkTextActor()
+        self.text.GetTextProperty().SetFontSize(12)
+        self.text.GetTextProperty().SetColor(1.0, 1.0, 0.0)
+        self.text.SetPosition(5, 5)
+        self.text.VisibilityOff()
+        renderer.AddViewProp(self.text)
+
+        self.render_window = render_window
+        self._observers = [render_window.AddObserver("StartEvent", self.on_start),
+                           render_window.AddObserver("EndEvent", self.on_end)]
+
+    def on_start(self, caller, event):
+        self._start = time.perf_counter()
+
+    def on_end(self, caller, event):
+        if self._start is None:
+            return
+        now = time.perf_counter()
+        seconds = now - self._start
+        self._start = None
+        self.perf.record("render", seconds, self.view)
+        self.frame_ends.append(now)
+        if self.text.GetVisibility():
+            # Shown from the next frame on, so the overlay itself never forces an extra render
+            self.text.SetInput(f"{self.fps():.1f} FPS | frame {seconds * 1000:.1f} ms")
+
+    def fps(self):
+        if len(self.frame_ends) < 2:
+            return 0.0
+        return (len(self.frame_ends) - 1) / max(self.frame_ends[-1] - self.frame_ends[0], 1e-9)
+
+    def set_visible(self, visible):
+        self.text.SetVisibility(bool(visible))
+        if visible:
+            # Text rendering is only loaded once an overlay is shown
+            import vtkmodules.vtkRenderingFreeType  # noqa: F401
+            self.text.SetInput("-- FPS")
+
+    def detach(self):
+        for tag in self._observers:
+            self.render_window.RemoveObserver(tag)
+        self._observers = []
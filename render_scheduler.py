@@ -0,0 +1,62 @@
+from PyQt5.QtCore import QObject, QTimer
+
+# One display frame at 60 Hz
+FRAME_INTERVAL_MS = 16
+
+
+class RenderScheduler(QObject):
+    # Collects dirty views during a frame and renders each of them at most once when the frame timer fires
+    def __init__(self, parent=None, interval_ms=FRAME_INTERVAL_MS):
+        super().__init__(parent)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+
+        self._dirty = {}
+        self._slices = {}
+        self._after_frame = []
+
+        self.frames = 0
+        self.renders = 0
+        self.superseded = 0
+
+    def request_render(self, key, render_window):
+        self._dirty[key] = render_window
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def request_slice(self, key, slice_index, apply_slice, render_window):
+        # Only the latest slice position per view is applied; earlier ones in the same frame are dropped
+        if key in self._slices:
+            self.superseded += 1
+        self._slices[key] = (apply_slice, slice_index)
+        self.request_render(key, render_window)
+
+    def after_frame(self, callback):
+        # Runs callback once the next frame has been rendered, for work that should not delay that frame
+        self._after_frame.append(callback)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def cancel(self, key):
+        self._slices.pop(key, None)
+        self._dirty.pop(key, None)
+
+    def flush(self):
+        slices, self._slices = self._slices, {}
+        for apply_slice, slice_index in slices.values():
+            apply_slice(slice_index)
+
+        dirty, self._dirty = self._dirty, {}
+        for render_window in dirty.values():
+            render_window.Render()
+        self.frames += 1
+        self.renders += len(dirty)
+
+        callbacks, self._after_frame = self._after_frame, []
+        for callback in callbacks:
+            callback()
+
+    def stats(self):
+        return {"frames": self.frames, "renders": self.renders, "superseded_slices": self.superseded}
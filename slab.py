@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from volume import AXES
+
+# Projections the 2D views can show; "slice" is the plain single-slice reslice
+PROJECTION_MODES = ("slice", "mip", "minip", "average")
+
+# Blocks of prefix/suffix extrema kept per axis; a slab spans at most two of them
+MAX_BLOCKS = 3
+
+
+def slab_range(index, thickness, count):
+    # [start, stop) of a slab of `thickness` slices centred on index, clipped to the volume
+    start = index - (thickness - 1) // 2
+    return max(start, 0), min(start + thickness, count)
+
+
+class SlabProjector:
+    # Thick-slab projection along one axis, updated incrementally as the slab moves.
+    # Average keeps a running sum of the slab; MIP/MinIP split the axis into blocks of `thickness` slices
+    # and keep prefix and suffix extrema per block (van Herk/Gil-Werman), so any slab is the
+    # combination of one suffix and one prefix image.
+    def __init__(self, array, axis, mode, thickness):
+        if mode not in PROJECTION_MODES[1:]:
+            raise ValueError(f"Unknown projection: {mode}")
+        self.stack = np.moveaxis(array, AXES[axis], 0)  # View with the slices along the first axis
+        self.mode = mode
+        self.thickness = thickness
+        self._lock = threading.Lock()
+
+        self._sum = None
+        self._sum_range = None
+        self._sum_type = np.float64 if np.issubdtype(array.dtype, np.floating) else np.int64
+        self._blocks = OrderedDict()
+
+    def project(self, index):
+        start, stop = slab_range(index, self.thickness, len(self.stack))
+        # Calls from the prefetch worker and the GUI thread share the running state
+        with self._lock:
+            if self.mode == "average":
+                return self._average(start, stop)
+            return self._extremum(start, stop)
+
+    def _average(self, start, stop):
+        if self._sum_range is None:
+            self._sum = self.stack[start:stop].sum(axis=0, dtype=self._sum_type)
+        else:
+            old_start, old_stop = self._sum_range
+            entering = [(start, min(old_start, stop)), (max(old_stop, start), stop)]
+            leaving = [(old_start, min(start, old_stop)), (max(stop, old_start), old_stop)]
+            changed = sum(max(b - a, 0) for a, b in entering + leaving)
+            if changed >= stop - start:
+                # A jump: summing the new slab directly is cheaper
+                self._sum = self.stack[start:stop].sum(axis=0, dtype=self._sum_type)
+            else:
+                for a, b in entering:
+                    if b > a:
+                        self._sum += self.stack[a:b].sum(axis=0, dtype=self._sum_type)
+                for a, b in leaving:
+                    if b > a:
+                        self._sum -= self.stack[a:b].sum(axis=0, dtype=self._sum_type)
+        self._sum_range = (start, stop)
+
+        mean = self._sum / (stop - start)
+        if self._sum_type is np.int64:
+            # Integer volumes stay in their own type, so the 8-bit mapping can keep using its lookup table
+            return np.rint(mean).astype(self.stack.dtype)
+        return mean.astype(self.stack.dtype)
+
+    def _extremum(self, start, stop):
+        last = stop - 1
+        first_block, last_block = start // self.thickness, last // self.thickness
+        if first_block != last_block:
+            # Suffix of the first block from start, prefix of the next one up to the last slice
+            suffix = self._block(first_block)[1][start - first_block * self.thickness]
+            prefix = self._block(last_block)[0][last - last_block * self.thickness]
+            return self._reduce(suffix, prefix)
+
+        block_start = first_block * self.thickness
+        block_stop = min(block_start + self.thickness, len(self.stack))
+        if start == block_start:
+            return self._block(first_block)[0][last - block_start].copy()
+        if stop == block_stop:
+            return self._block(first_block)[1][start - block_start].copy()
+        # Only slabs clipped short inside a single block get here
+        reduce = np.max if self.mode == "mip" else np.min
+        return reduce(self.stack[start:stop], axis=0)
+
+    def _reduce(self, a, b):
+        return np.maximum(a, b) if self.mode == "mip" else np.minimum(a, b)
+
+    def _block(self, block):
+        entry = self._blocks.get(block)
+        if entry is None:
+            # One whole-slice ufunc call per step; ufunc.accumulate along the first axis does not vectorize
+            ufunc = np.maximum if self.mode == "mip" else np.minimum
+            chunk = self.stack[block * self.thickness:(block + 1) * self.thickness]
+            prefix = np.empty(chunk.shape, dtype=chunk.dtype)
+            suffix = np.empty(chunk.shape, dtype=chunk.dtype)
+            prefix[0], suffix[-1] = chunk[0], chunk[-1]
+            for k in range(1, len(chunk)):
+                ufunc(prefix[k - 1], chunk[k], out=prefix[k])
+                ufunc(suffix[-k], chunk[-k - 1], out=suffix[-k - 1])
+            entry = self._blocks[block] = (prefix, suffix)
+            while len(self._blocks) > MAX_BLOCKS:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(block)
+        return entry
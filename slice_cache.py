@@ -0,0 +1,165 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Per-view budget for window/levelled slices kept in memory
+DEFAULT_MAX_BYTES = 128 * 1024 ** 2
+
+# How many slices ahead of the scroll direction are prepared in the background
+DEFAULT_PREFETCH_DEPTH = 8
+
+# Upper bound on the prefetch depth when scrolling fast
+MAX_PREFETCH_DEPTH = 32
+
+# Seconds of scrolling at the observed speed that the prefetch tries to stay ahead of
+PREFETCH_HORIZON = 0.25
+
+# Steps larger than this are jumps (a click in another view, a typed index), not scrolling
+MAX_SCROLL_STRIDE = 64
+
+# Weight of the newest step in the smoothed stride and speed
+VELOCITY_SMOOTHING = 0.5
+
+
+class SliceCache:
+    # Display-ready slices of one axis, LRU within a byte budget, with prefetch along the scroll direction
+    def __init__(self, engine, axis, max_bytes=DEFAULT_MAX_BYTES, prefetch_depth=DEFAULT_PREFETCH_DEPTH,
+                 executor=None):
+        self.engine = engine
+        self.axis = axis
+        self.max_bytes = max_bytes
+        self.prefetch_depth = prefetch_depth
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.limit = engine.slice_count(axis)  # Slices at or past this index are never cached
+
+        self._slices = OrderedDict()
+        self._bytes = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._last_index = None
+        self._direction = 1
+        self._last_time = None
+        self._stride = None  # Smoothed slices per step, once the scroll has moved
+        self._speed = None  # Smoothed slices per second
+        self._reach = prefetch_depth  # How far ahead of the last index the queued prefetches go
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+
+    def get(self, index):
+        with self._lock:
+            image = self._slices.get(index)
+            if image is not None:
+                self._slices.move_to_end(index)
+                self.hits += 1
+            else:
+                self.misses += 1
+            generation = self._generation
+
+        if image is None:
+            image = self.engine.get_slice(self.axis, index, mapped=True)
+            self._store(index, image, generation)
+        self._prefetch_around(index)
+        return image
+
+    def invalidate(self):
+        # Called whenever the mapping changes (window/level, projection mode, new volume data)
+        with self._lock:
+            self._generation += 1
+            self._slices.clear()
+            self._pending.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "axis": self.axis,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "prefetched": self.prefetched,
+                "evictions": self.evictions,
+                "stride": float(self._stride or 1),
+                "speed": float(self._speed or 0.0),
+                "entries": len(self._slices),
+                "bytes": self._bytes,
+            }
+
+    def _store(self, index, image, generation):
+        with self._lock:
+            # Results computed before an invalidation are stale
+            if generation != self._generation or index in self._slices:
+                return
+            self._slices[index] = image
+            self._bytes += image.nbytes
+            while self._bytes > self.max_bytes and len(self._slices) > 1:
+                _, evicted = self._slices.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def _observe(self, index):
+        # Direction, stride and speed of the scroll from consecutive requests
+        now = time.perf_counter()
+        if self._last_index is not None and index != self._last_index:
+            step = int(abs(index - self._last_index))
+            if step <= MAX_SCROLL_STRIDE:
+                self._direction = 1 if index > self._last_index else -1
+                # The first step is taken as it is; later ones are smoothed so one uneven step does not throw it
+                self._stride = step if self._stride is None else \
+                    self._stride + VELOCITY_SMOOTHING * (step - self._stride)
+                elapsed = now - self._last_time
+                if elapsed > 0:
+                    speed = step / elapsed
+                    self._speed = speed if self._speed is None else \
+                        self._speed + VELOCITY_SMOOTHING * (speed - self._speed)
+        self._last_index = index
+        self._last_time = now
+
+    def _prefetch_plan(self):
+        # Stride between prefetched slices and how many of them to queue; faster scrolling looks further ahead
+        stride = max(1, round(self._stride or 1))
+        depth = math.ceil((self._speed or 0.0) * PREFETCH_HORIZON / stride)
+        return stride, min(max(depth, self.prefetch_depth), MAX_PREFETCH_DEPTH)
+
+    def _prefetch_around(self, index):
+        self._observe(index)
+        stride, depth = self._prefetch_plan()
+        self._reach = stride * depth
+
+        with self._lock:
+            generation = self._generation
+            targets = []
+            for step in range(1, depth + 1):
+                target = index + self._direction * stride * step
+                if not 0 <= target < self.limit:
+                    break
+                if target not in self._slices and target not in self._pending:
+                    self._pending.add(target)
+                    targets.append(target)
+
+        for target in targets:
+            self.executor.submit(self._prefetch, target, generation)
+
+    def _prefetch(self, index, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+        # The scroll may have moved on; skip slices it has already passed or that are now out of reach
+        ahead = (index - self._last_index) * self._direction if self._last_index is not None else 1
+        if not 0 < ahead <= self._reach:
+            with self._lock:
+                self._pending.discard(index)
+            return
+
+        image = self.engine.get_slice(self.axis, index, mapped=True)
+        with self._lock:
+            self._pending.discard(index)
+            if generation == self._generation:
+                self.prefetched += 1
+        self._store(index, image, generation)
@@ -0,0 +1,160 @@
+import threading
+
+import numpy as np
+
+from oblique import ObliquePlane, sample_planes
+from slab import PROJECTION_MODES, SlabProjector
+from volume import AXES
+
+# Integer types small enough to window/level through a lookup table over every possible value
+_LUT_TYPES = (np.uint8, np.int8, np.uint16, np.int16)
+
+
+def map_window_level(values, window, level, out=None):
+    # Same mapping as vtkImageMapToWindowLevelColors: [level - window/2, level + window/2] -> [0, 255]
+    window = max(float(window), 1e-6)
+    lower = float(level) - window / 2
+    mapped = np.subtract(values, lower, dtype=np.float32)
+    mapped *= 255.0 / window
+    np.clip(mapped, 0, 255, out=mapped)
+    if out is None:
+        return mapped.astype(np.uint8)
+    out[...] = mapped
+    return out
+
+
+class SliceEngine:
+    # Headless slice extraction over a loaded Volume; no Qt or render window involved
+    def __init__(self, volume, window_level=None):
+        self.volume = volume
+        self.window, self.level = window_level or volume.default_window_level()
+        self._lut = None
+        self._lut_lock = threading.Lock()
+
+        # Thick-slab projection shown instead of single slices, with one incremental projector per axis
+        self.projection = "slice"
+        self.thickness = 1
+        self._projectors = {}
+        self._projector_lock = threading.Lock()
+
+        # (about u, about v) tilt in degrees of each view's plane; untilted views are plain array slices
+        self.tilts = {}
+
+    def set_window_level(self, window, level):
+        with self._lut_lock:
+            self.window, self.level = float(window), float(level)
+            self._lut = None
+
+    def set_projection(self, mode, thickness):
+        if mode not in PROJECTION_MODES:
+            raise ValueError(f"Unknown projection: {mode}")
+        self.projection, self.thickness = mode, max(int(thickness), 1)
+        self._projectors = {}
+
+    def set_tilt(self, axis, tilt):
+        if axis not in AXES:
+            raise ValueError(f"Unknown axis: {axis}")
+        about_u, about_v = (float(angle) for angle in tilt)
+        if about_u or about_v:
+            self.tilts[axis] = (about_u, about_v)
+        else:
+            self.tilts.pop(axis, None)
+
+    def plane(self, axis, index):
+        # Oblique plane shown for this slice, or None while the view is axis-aligned
+        tilt = self.tilts.get(axis)
+        return ObliquePlane(self.volume, axis, index, tilt) if tilt is not None else None
+
+    def slice_count(self, axis):
+        return self.volume.array.shape[AXES[axis]]
+
+    def slice_shape(self, axis):
+        # (rows, columns) of the 2D images returned for this axis
+        shape = list(self.volume.array.shape)
+        del shape[AXES[axis]]
+        return tuple(shape)
+
+    def get_slice(self, axis, index, mapped=False, out=None):
+        # A tilted view is resampled from the volume; its plane takes the place of the slab
+        plane = self.plane(axis, index)
+        if plane is not None:
+            raw = plane.sample()
+            return self.map(raw, out) if mapped else raw
+
+        if self.projection != "slice" and self.thickness > 1:
+            raw = self._projector(axis).project(index)
+            return self.map(raw, out) if mapped else raw
+
+        # Basic indexing, so the raw slice is always a view on the volume
+        array = self.volume.array
+        if axis == "axial":
+            raw = array[index]
+        elif axis == "coronal":
+            raw = array[:, index, :]
+        elif axis == "sagittal":
+            raw = array[:, :, index]
+        else:
+            raise ValueError(f"Unknown axis: {axis}")
+        return self.map(raw, out) if mapped else raw
+
+    def get_slices(self, axis, indices, mapped=False, out=None):
+        # Returns a (count, rows, columns) stack; a slice or range of indices stays a view
+        if axis in self.tilts:
+            # All planes are resampled in one batch across the resampling pool
+            if isinstance(indices, slice):
+                indices = range(*indices.indices(self.slice_count(axis)))
+            planes = [self.plane(axis, index) for index in indices]
+            raw = np.stack(sample_planes(planes)) if planes else np.empty((0,) + self.slice_shape(axis),
+                                                                          self.volume.array.dtype)
+            return self.map(raw, out) if mapped else raw
+
+        if isinstance(indices, range):
+            indices = slice(indices.start, indices.stop, indices.step)
+        array_axis = AXES[axis]
+        if isinstance(indices, slice):
+            selector = [slice(None)] * 3
+            selector[array_axis] = indices
+            raw = self.volume.array[tuple(selector)]
+        else:
+            raw = np.take(self.volume.array, np.asarray(indices, dtype=np.intp), axis=array_axis)
+        raw = np.moveaxis(raw, array_axis, 0)
+        return self.map(raw, out) if mapped else raw
+
+    def _projector(self, axis):
+        with self._projector_lock:
+            projector = self._projectors.get(axis)
+            if projector is None:
+                projector = SlabProjector(self.volume.array, axis, self.projection, self.thickness)
+                self._projectors[axis] = projector
+            return projector
+
+    def map(self, raw, out=None):
+        # Window/level the raw values into an 8-bit display image
+        if raw.dtype.type in _LUT_TYPES:
+            lut, offset = self._window_level_lut(raw.dtype)
+            codes = raw.view(np.uint16 if raw.dtype.itemsize == 2 else np.uint8) if offset else raw
+            return np.take(lut, codes, out=out)
+        with self._lut_lock:
+            window, level = self.window, self.level
+        return map_window_level(raw, window, level, out)
+
+    def _window_level_lut(self, dtype):
+        # One table entry per representable value, rebuilt only when window/level or dtype change. The table is
+        # keyed by what it was built for: a prefetch worker still building one for the previous window/level
+        # must not leave it behind for later slices
+        with self._lut_lock:
+            key = (dtype, self.window, self.level)
+            if self._lut is not None and self._lut[0] == key:
+                return self._lut[1], self._lut[2]
+
+        info = np.iinfo(dtype)
+        values = np.arange(info.min, info.max + 1, dtype=np.int32)
+        signed = info.min < 0
+        if signed:
+            # Reorder so the table is indexed by the unsigned bit pattern of each value
+            values = np.roll(values, info.min)
+        lut = map_window_level(values, key[1], key[2])
+        with self._lut_lock:
+            if (dtype, self.window, self.level) == key:
+                self._lut = (key, lut, signed)
+        return lut, signed
@@ -0,0 +1,517 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+from slice_engine import SliceEngine, map_window_level
+from studies import find_studies, slice_spacing
+from study_manager import DEFAULT_MEMORY_BUDGET, StudyManager, memory_budget, slice_position
+from volume import AXES
+from volume_cache import VolumeCache, source_key
+from volume_loader import read_dicom_series, read_mha, study_source
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+# Encoded tiles kept in memory for all clients together
+DEFAULT_TILE_CACHE_BYTES = 256 * 1024 ** 2
+
+# Tiles of one study extracted and encoded at the same time; the rest wait, so one busy study cannot take every worker
+DEFAULT_STUDY_CONCURRENCY = 4
+
+# zlib level of the PNG tiles; 1 is several times faster than the default and barely larger on 8-bit slices
+PNG_COMPRESSION = 1
+
+# Largest WebSocket message accepted from a client; crosshair updates are a few dozen bytes
+MAX_MESSAGE_BYTES = 64 * 1024
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(image, level=PNG_COMPRESSION):
+    # 8-bit grayscale PNG. Rows are flipped so the image reads top down, as the 2D views draw it, and every row
+    # uses the Up filter, which compresses slices far better than none at no cost beyond one subtraction.
+    rows, cols = image.shape
+    image = image[::-1]
+    filtered = np.empty((rows, cols + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = image[0]
+    np.subtract(image[1:], image[:-1], out=filtered[1:, 1:])
+    header = struct.pack(">IIBBBBB", cols, rows, 8, 0, 0, 0, 0)
+    return b"".join((PNG_SIGNATURE, _png_chunk(b"IHDR", header),
+                     _png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), level)), _png_chunk(b"IEND", b"")))
+
+
+def read_study(path, volume_cache):
+    # Same path as the viewer's StudyLoader: mapped from the volume cache when possible, decoded and cached otherwise
+    file_names, source, series = study_source(path)
+    key = source_key(file_names)
+    volume = volume_cache.get(key)
+    if volume is not None:
+        return key, volume
+    volume = read_mha(path) if path.endswith(".mha") else read_dicom_series(path, series=series)
+    volume.default_window_level()
+    try:
+        volume_cache.put(key, volume, source)
+    except OSError as e:
+        logger.warning("Error caching %s: %s", path, e)
+    return key, volume
+
+
+def render_tile(volume, axis, index, window, level):
+    # Runs on the worker pool; slicing, mapping and zlib release the GIL for most of it
+    raw = SliceEngine(volume, (window, level)).get_slice(axis, index)
+    return encode_png(map_window_level(raw, window, level))
+
+
+class TileCache:
+    # Encoded tiles shared by every client, LRU within a byte budget. Only touched from the event loop.
+    def __init__(self, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        data = self._tiles.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if key in self._tiles:
+            return
+        self._tiles[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "entries": len(self._tiles), "bytes": self._bytes}
+
+
+def websocket_frame(opcode, payload):
+    # Server frames are never masked
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_websocket_frame(reader):
+    # (opcode, payload) of the next frame; fragmented messages are not supported
+    first, second = await reader.readexactly(2)
+    if not first & 0x80:
+        raise ValueError("Fragmented WebSocket messages are not supported")
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", await reader.readexactly(8))[0]
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"WebSocket message of {length} bytes is too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = (np.frombuffer(payload, np.uint8) ^ np.resize(np.frombuffer(mask, np.uint8), length)).tobytes()
+    return first & 0x0F, payload
+
+
+class WebSocket:
+    def __init__(self, writer):
+        self.writer = writer
+        self.studies = set()
+
+    async def send(self, message):
+        self.writer.write(websocket_frame(OP_TEXT, json.dumps(message).encode("utf-8")))
+        await self.writer.drain()
+
+
+class SliceServer:
+    # Slices of the studies found in paths as PNG tiles over HTTP, and crosshair updates pushed over WebSocket:
+    #   GET /studies                                       studies that can be served
+    #   GET /studies/<name>                                shape, spacing and window/level (loads the study)
+    #   GET /studies/<name>/<axis>/<index>.png?window=&level=   one window/levelled slice
+    #   GET /stats                                         tile cache, study memory and request counters
+    #   WebSocket /ws   {"subscribe": name}, {"study": name, "crosshair": [x, y, z]} -> {"type": "crosshair", ...}
+    def __init__(self, paths, max_bytes=DEFAULT_MEMORY_BUDGET, tile_cache_bytes=DEFAULT_TILE_CACHE_BYTES,
+                 study_concurrency=DEFAULT_STUDY_CONCURRENCY, workers=None):
+        self.entries = OrderedDict((name, path) for name, _, path, _ in find_studies(paths))
+        # Loaded studies share one memory budget, evicted to the volume cache exactly as in the viewer
+        self.studies = StudyManager(VolumeCache(), max_bytes)
+        self.tiles = TileCache(tile_cache_bytes)
+        self.study_concurrency = study_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                           thread_name_prefix="slice-server")
+        self.server = None
+
+        self._semaphores = {}
+        self._loading = {}  # Study name -> task reading it, awaited by every request that arrives meanwhile
+        self._evicting = None  # Task bringing the studies back within the memory budget, if one is running
+        self._rendering = {}  # Tile key -> task encoding it, so concurrent requests for one tile encode it once
+        self._subscribers = {}
+        self._crosshairs = {}  # Last crosshair of each study, sent to clients as they subscribe
+
+        self.requests = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def volume(self, name):
+        if name not in self.entries:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown study: {name}")
+        study = self.studies.open(self.entries[name])
+        volume = study.volume
+        if volume is not None:
+            self.studies.touch(study)
+            return volume
+        task = self._loading.get(name)
+        if task is None:
+            task = self._loading[name] = asyncio.ensure_future(self._load(name, study))
+        return await task
+
+    async def _load(self, name, study):
+        # Mapped back from the volume cache after an eviction, otherwise read like the viewer does. The study
+        # list itself is only changed on the event loop; the workers read and write voxels
+        loop = asyncio.get_running_loop()
+        try:
+            volume = await loop.run_in_executor(self.executor, self.studies.restore, study)
+            if volume is not None:
+                key = study.key
+            else:
+                key, volume = await loop.run_in_executor(
+                    self.executor, read_study, study.file_path, self.studies.volume_cache)
+        except Exception as e:
+            logger.debug("Error loading %s", study.file_path, exc_info=True)
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, f"Error loading {name}: {e}")
+        finally:
+            del self._loading[name]
+        self.studies.loaded(study, key, volume, evict=False)
+        logger.info("Loaded %s %s", name, volume.array.shape)
+        self._evicting = self._evicting or asyncio.ensure_future(self.enforce_budget())
+        return volume
+
+    async def enforce_budget(self):
+        # Writing a study out to the volume cache can take seconds, so it happens on the executor while
+        # the loop keeps serving; the study stays resident (and servable) until it has been written
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # The most recently used study is never the one to go
+                studies = list(self.studies)
+                evict = self.studies.over_budget(keep=studies[-1] if studies else None)
+                if not evict:
+                    return
+                for study in evict:
+                    if not await loop.run_in_executor(self.executor, self.studies.save, study):
+                        return
+                    if study.resident:
+                        self.studies.release(study)
+        finally:
+            self._evicting = None
+
+    def study_info(self, name, volume):
+        window, level = volume.default_window_level()
+        return {
+            "name": name,
+            "slices": {axis: volume.array.shape[AXES[axis]] for axis in AXES},
+            "shape": {axis: [size for k, size in enumerate(volume.array.shape) if k != AXES[axis]] for axis in AXES},
+            "pixel_spacing": {axis: list(slice_spacing(volume, axis)) for axis in AXES},
+            "spacing": list(volume.spacing),
+            "origin": list(volume.origin),
+            "window_level": [window, level],
+            "presets": {preset: list(value) for preset, value in volume.window_presets.items()},
+            "modality": volume.modality,
+        }
+
+    async def tile(self, name, axis, index, query):
+        volume = await self.volume(name)
+        if axis not in AXES or not 0 <= index < volume.array.shape[AXES[axis]]:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No {axis} slice {index} in {name}")
+        window, level = volume.default_window_level()
+        if "preset" in query:
+            if query["preset"] not in volume.window_presets:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unknown preset: {query['preset']}")
+            window, level = volume.window_presets[query["preset"]]
+        try:
+            window, level = float(query.get("window", window)), float(query.get("level", level))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "window and level must be numbers")
+        if not window > 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "window must be positive")
+
+        key = (self.studies.find(self.entries[name]).key, axis, index, window, level)
+        data = self.tiles.get(key)
+        if data is not None:
+            return data, True
+        task = self._rendering.get(key)
+        if task is None:
+            task = self._rendering[key] = asyncio.ensure_future(self._render(name, key, volume))
+        return await task, False
+
+    async def _render(self, name, key, volume):
+        _, axis, index, window, level = key
+        semaphore = self._semaphores.setdefault(name, asyncio.Semaphore(self.study_concurrency))
+        try:
+            async with semaphore:
+                data = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, render_tile, volume, axis, index, window, level)
+        finally:
+            del self._rendering[key]
+        self.tiles.put(key, data)
+        return data
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return {"requests": self.requests, "errors": self.errors, "uptime_s": elapsed,
+                "tiles": self.tiles.stats(), "studies": self.studies.stats(),
+                "subscribers": sum(len(clients) for clients in self._subscribers.values())}
+
+    async def respond(self, method, target):
+        # (status, content type, body, extra headers) for one GET request
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported")
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if parts in ([], ["studies"]):
+            return self.json(list(self.entries))
+        if parts == ["stats"]:
+            return self.json(self.stats())
+        if len(parts) == 2 and parts[0] == "studies":
+            return self.json(self.study_info(parts[1], await self.volume(parts[1])))
+        if len(parts) == 4 and parts[0] == "studies" and parts[3].endswith(".png"):
+            try:
+                index = int(parts[3][:-4])
+            except ValueError:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Not a slice index: {parts[3]}")
+            data, hit = await self.tile(parts[1], parts[2], index, query)
+            # A tile never changes for the same URL while its source files stay the same
+            return (HTTPStatus.OK, "image/png", data,
+                    {"Cache-Control": "max-age=3600", "X-Tile-Cache": "hit" if hit else "miss"})
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No such resource: {url.path}")
+
+    @staticmethod
+    def json(value, status=HTTPStatus.OK):
+        return status, "application/json", json.dumps(value).encode("utf-8"), {}
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive; a request with an Upgrade: websocket header turns the connection into a WebSocket
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    header, _, value = line.decode("latin-1").partition(":")
+                    headers[header.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    self.write_response(writer, *self.json({"error": "Malformed request"}, HTTPStatus.BAD_REQUEST),
+                                        keep_alive=False)
+                    break
+
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self.handle_websocket(reader, writer, headers)
+                    break
+
+                self.requests += 1
+                try:
+                    status, content_type, body, extra = await self.respond(method, target)
+                except HTTPError as e:
+                    self.errors += 1
+                    status, content_type, body, extra = self.json({"error": str(e)}, e.status)
+                except Exception as e:
+                    self.errors += 1
+                    logger.exception("Error serving %s", target)
+                    status, content_type, body, extra = self.json({"error": str(e)},
+                                                                  HTTPStatus.INTERNAL_SERVER_ERROR)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close" and \
+                    method in ("GET", "HEAD")
+                self.write_response(writer, status, content_type, b"" if method == "HEAD" else body, extra,
+                                    keep_alive, len(body))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # ValueError: a request line or header longer than the stream limit
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def write_response(writer, status, content_type, body, extra=None, keep_alive=True, length=None):
+        status = HTTPStatus(status)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body) if length is None else length}",
+                 "Access-Control-Allow-Origin: *", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{header}: {value}" for header, value in (extra or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def handle_websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            self.write_response(writer, *self.json({"error": "Missing Sec-WebSocket-Key"}, HTTPStatus.BAD_REQUEST),
+                                keep_alive=False)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        client = WebSocket(writer)
+        try:
+            while True:
+                opcode, payload = await read_websocket_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(websocket_frame(OP_CLOSE, payload[:2]))
+                    break
+                if opcode == OP_PING:
+                    writer.write(websocket_frame(OP_PONG, payload))
+                elif opcode == OP_TEXT:
+                    try:
+                        await self.on_message(client, json.loads(payload))
+                    except (HTTPError, ValueError, TypeError, KeyError) as e:
+                        await client.send({"type": "error", "error": str(e)})
+        except ValueError as e:
+            logger.debug("Closing WebSocket: %s", e)
+            writer.write(websocket_frame(OP_CLOSE, struct.pack(">H", 1009)))
+        finally:
+            for name in client.studies:
+                self._subscribers.get(name, set()).discard(client)
+
+    async def on_message(self, client, message):
+        if "subscribe" in message:
+            name = message["subscribe"]
+            if name not in self.entries:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown study: {name}")
+            client.studies.add(name)
+            self._subscribers.setdefault(name, set()).add(client)
+            if name in self._crosshairs:
+                await client.send(self._crosshairs[name])
+        elif "crosshair" in message:
+            await self.move_crosshair(message["study"], message["crosshair"])
+        else:
+            raise ValueError("Expected a subscribe or crosshair message")
+
+    async def move_crosshair(self, name, voxel):
+        # Voxel (x, y, z) indices, clamped to the volume; every subscriber of the study gets the slice of each view
+        if not isinstance(voxel, list) or len(voxel) != 3 or not all(
+                isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+                for value in voxel):
+            raise ValueError(f"A crosshair is a list of three voxel indices (x, y, z), not {voxel!r}")
+        volume = await self.volume(name)
+        depth, height, width = volume.array.shape
+        voxel = [min(max(int(round(float(value))), 0), size - 1)
+                 for value, size in zip(voxel, (width, height, depth))]
+        slices = {axis: voxel[2 - AXES[axis]] for axis in AXES}
+        update = {"type": "crosshair", "study": name, "voxel": voxel, "slices": slices,
+                  "position": {axis: slice_position(volume, axis, index) for axis, index in slices.items()}}
+        self._crosshairs[name] = update
+        clients = list(self._subscribers.get(name, ()))
+        results = await asyncio.gather(*(client.send(update) for client in clients), return_exceptions=True)
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception):
+                self._subscribers[name].discard(client)
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Serve MPR slices and crosshair updates to thin clients")
+    parser.add_argument("inputs", nargs="+", help=".mha files, .dcm files or directories of DICOM series")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--memory-mb", type=float,
+                        help="decoded voxels kept in memory across studies (default: MPR_STUDY_BUDGET_MB, or "
+                             f"{DEFAULT_MEMORY_BUDGET // 1024 ** 2})")
+    parser.add_argument("--tile-cache-mb", type=float, default=DEFAULT_TILE_CACHE_BYTES / 1024 ** 2)
+    parser.add_argument("--study-concurrency", type=int, default=DEFAULT_STUDY_CONCURRENCY,
+                        help="tiles of one study encoded at the same time")
+    parser.add_argument("--workers", type=int, help="slice encoding threads (default: one per core)")
+    return parser.parse_args(argv)
+
+
+async def serve(options):
+    max_bytes = int(options.memory_mb * 1024 ** 2) if options.memory_mb else memory_budget()
+    server = SliceServer(options.inputs, max_bytes, int(options.tile_cache_mb * 1024 ** 2),
+                         options.study_concurrency, options.workers)
+    if not server.entries:
+        logger.error("No studies found in %s", " ".join(options.inputs))
+        return 1
+    await server.start(options.host, options.port)
+    logger.info("Serving %d studies on http://%s:%d", len(server.entries), options.host, options.port)
+    try:
+        await server.server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.close()
+    return 0
+
+
+def main(argv=None, prog=None):
+    try:
+        return asyncio.run(serve(parse_args(argv, prog)))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("MPR_LOG_LEVEL", "INFO"),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import logging
+import os
+
+from dicom_index import DicomIndex
+from volume import SLICE_PLANE_AXES
+
+logger = logging.getLogger(__name__)
+
+
+def find_studies(paths, dicom_index=None):
+    # (name, kind, path, series) per study: every .mha file, and every DICOM series in the directories
+    # given (searched recursively) or containing the .dcm files given
+    dicom_index = dicom_index or DicomIndex()
+    studies = []
+    for path in paths:
+        if os.path.isfile(path):
+            if path.lower().endswith(".mha"):
+                studies.append((os.path.splitext(os.path.basename(path))[0], "mha", path, None))
+            elif path.lower().endswith(".dcm"):
+                series = dicom_index.series_for_file(path)
+                studies.append((_series_name(path, series), "dicom", path, series))
+            else:
+                logger.warning("Skipping %s: not a .mha or .dcm file", path)
+            continue
+        if not os.path.isdir(path):
+            logger.warning("Skipping %s: no such file or directory", path)
+            continue
+        for directory, _, file_names in sorted(os.walk(path)):
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(".mha"):
+                    file_path = os.path.join(directory, file_name)
+                    studies.append((os.path.splitext(file_name)[0], "mha", file_path, None))
+            if any(file_name.lower().endswith(".dcm") for file_name in file_names):
+                for series in dicom_index.scan(directory):
+                    studies.append((_series_name(series["files"][0], series), "dicom", series["files"][0], series))
+
+    # Output directories are named after the studies; repeated names get a counter
+    seen = {}
+    unique = []
+    for name, kind, path, series in studies:
+        count = seen[name] = seen.get(name, 0) + 1
+        unique.append((name if count == 1 else f"{name}_{count}", kind, path, series))
+    return unique
+
+
+def _series_name(file_path, series):
+    directory = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    return f"{directory}_series{series['series_number']}" if series.get("series_number") else directory
+
+
+def display_shape(shape, spacing, max_edge=None):
+    # (rows, columns) that show a slice of this shape and (row, column) spacing with square pixels
+    rows, cols = shape
+    pixel = min(spacing)
+    rows, cols = rows * spacing[0] / pixel, cols * spacing[1] / pixel
+    if max_edge:
+        scale = max_edge / max(rows, cols)
+        rows, cols = rows * scale, cols * scale
+    return max(int(round(rows)), 1), max(int(round(cols)), 1)
+
+
+def slice_spacing(volume, axis):
+    # (row, column) spacing of this axis' slices
+    u, v = SLICE_PLANE_AXES[axis]
+    return volume.spacing[v], volume.spacing[u]
@@ -0,0 +1,185 @@
+import logging
+import os
+from collections import OrderedDict
+
+from volume import AXES
+from volume_cache import VolumeCache
+
+logger = logging.getLogger(__name__)
+
+# Decoded voxels kept in memory across all open studies; the active study is never evicted
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+
+
+def memory_budget():
+    # MPR_STUDY_BUDGET_MB in bytes, fractions allowed; anything but a positive number is reported and ignored
+    value = os.environ.get("MPR_STUDY_BUDGET_MB", "").strip()
+    if not value:
+        return DEFAULT_MEMORY_BUDGET
+    try:
+        budget_mb = float(value)
+    except ValueError:
+        budget_mb = None
+    if budget_mb is None or not 0 < budget_mb < float("inf"):
+        logger.warning("Ignoring MPR_STUDY_BUDGET_MB=%r, not a positive number of MB; using %d MB", value,
+                       DEFAULT_MEMORY_BUDGET // 1024 ** 2)
+        return DEFAULT_MEMORY_BUDGET
+    return int(budget_mb * 1024 ** 2)
+
+
+def slice_position(volume, axis, index):
+    # World position (mm) of a slice along the axis it is stacked on
+    n = 2 - AXES[axis]
+    return volume.origin[n] + index * volume.spacing[n]
+
+
+def slice_at(volume, axis, position):
+    # Slice nearest to a world position along axis, clamped to the volume
+    n = 2 - AXES[axis]
+    index = int(round((position - volume.origin[n]) / volume.spacing[n]))
+    return min(max(index, 0), volume.array.shape[AXES[axis]] - 1)
+
+
+class Study:
+    # One open study: its voxels while resident, and the view state restored when it is shown again
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(file_path)
+        self.name = os.path.basename(file_path)
+        self.key = None  # Volume cache key, known once the study has been read
+        self.volume = None
+
+        self.slices = {}
+        self.positions = {}  # World position of each view's slice, for linking other studies to this one
+        self.window_level = None
+        self.tilts = {}
+
+    @property
+    def resident(self):
+        return self.volume is not None
+
+    def save_state(self, slices, engine):
+        # Only the study on display has view state worth keeping
+        if engine is None or engine.volume is not self.volume:
+            return
+        self.slices = dict(slices)
+        self.positions = {axis: slice_position(self.volume, axis, index) for axis, index in slices.items()}
+        self.window_level = (engine.window, engine.level)
+        self.tilts = dict(engine.tilts)
+
+
+class StudyManager:
+    # Open studies in least recently used order, sharing one in-memory budget. Studies over the budget are
+    # evicted to the volume cache and mapped back from it when they are shown again, instead of decoded.
+    def __init__(self, volume_cache=None, max_bytes=DEFAULT_MEMORY_BUDGET):
+        self.volume_cache = volume_cache or VolumeCache()
+        self.max_bytes = max_bytes
+        self._studies = OrderedDict()
+
+        self.evictions = 0
+        self.restores = 0
+
+    def __iter__(self):
+        return iter(self._studies.values())
+
+    def __len__(self):
+        return len(self._studies)
+
+    def find(self, file_path):
+        return self._studies.get(os.path.abspath(file_path))
+
+    def open(self, file_path):
+        study = self.find(file_path)
+        if study is None:
+            study = self._studies[os.path.abspath(file_path)] = Study(file_path)
+        return study
+
+    def close(self, study):
+        # The decoded voxels stay in the volume cache for the next time the study is opened
+        self._studies.pop(study.file_path, None)
+        study.volume = None
+
+    def loaded(self, study, key, volume, evict=True):
+        # A study has been decoded (or read from the volume cache) and becomes the most recently used;
+        # evict=False leaves enforcing the budget to the caller
+        study.key, study.volume = key, volume
+        self.touch(study)
+        if evict:
+            self.enforce_budget(keep=study)
+
+    def activate(self, study):
+        # Voxels of the study about to be shown, or None if it has to be read from its source again
+        self.touch(study)
+        self.restore(study)
+        self.enforce_budget(keep=study)
+        return study.volume
+
+    def touch(self, study):
+        # Most recently used from now on
+        self._studies.move_to_end(study.file_path)
+
+    def restore(self, study):
+        # Maps the voxels of an evicted study back from the volume cache; only touches the study, not the
+        # list of studies, so it can run on a worker thread
+        if study.volume is None and study.key is not None:
+            volume = self.volume_cache.get(study.key)
+            if volume is not None:
+                study.volume = volume
+                self.restores += 1
+        return study.volume
+
+    def resident_bytes(self):
+        return sum(study.volume.nbytes for study in self._studies.values() if study.resident)
+
+    def over_budget(self, keep=None):
+        # Resident studies that have to go, least recently used first, to bring memory back within the budget
+        total = self.resident_bytes()
+        studies = []
+        for study in list(self._studies.values()):
+            if total <= self.max_bytes:
+                break
+            if study is keep or not study.resident or study.key is None:
+                continue
+            studies.append(study)
+            total -= study.volume.nbytes
+        return studies
+
+    def enforce_budget(self, keep=None):
+        # Least recently used first
+        total = self.resident_bytes()
+        for study in list(self._studies.values()):
+            if total <= self.max_bytes:
+                break
+            if study is keep or not study.resident:
+                continue
+            nbytes = study.volume.nbytes
+            if self.evict(study):
+                total -= nbytes
+
+    def evict(self, study):
+        # Make sure the voxels can be mapped back from disk before letting go of them
+        if not self.save(study):
+            return False
+        self.release(study)
+        return True
+
+    def save(self, study):
+        # Writes the voxels to the volume cache unless they are there already; the slow half of evict, safe
+        # to run on a worker thread
+        if study.key is None or not study.resident:
+            return False
+        if not self.volume_cache.contains(study.key):
+            try:
+                self.volume_cache.put(study.key, study.volume)
+            except OSError as e:
+                logger.warning("Keeping %s in memory, it could not be cached: %s", study.name, e)
+                return False
+        return True
+
+    def release(self, study):
+        study.volume = None
+        self.evictions += 1
+
+    def stats(self):
+        return {"studies": len(self._studies), "resident": sum(study.resident for study in self._studies.values()),
+                "resident_mb": self.resident_bytes() / 1024 ** 2, "budget_mb": self.max_bytes / 1024 ** 2,
+                "evictions": self.evictions, "restores": self.restores}
@@ -0,0 +1,186 @@
+import glob
+import importlib
+import math
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+from cache_paths import cache_dir
+
+# Triangles kept after decimation; a mesh this size rotates smoothly on software OpenGL
+DEFAULT_TRIANGLE_BUDGET = 500000
+
+# Meshes kept in memory per volume, and on disk across sessions before the least recently used go
+MAX_MESHES_PER_VOLUME = 8
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Clustering passes allowed to bring a mesh under its budget
+MAX_DECIMATION_PASSES = 4
+
+# Writer of each mesh format, as (vtkmodules module, class); imported when a mesh is first written
+EXPORT_WRITERS = {".stl": ("vtkIOGeometry", "vtkSTLWriter"), ".ply": ("vtkIOPLY", "vtkPLYWriter"),
+                  ".obj": ("vtkIOGeometry", "vtkOBJWriter"), ".vtp": ("vtkIOXML", "vtkXMLPolyDataWriter")}
+
+
+def use_threaded_smp():
+    # VTK builds default to the sequential SMP backend; the contouring filter only runs in parallel on threads
+    from vtkmodules.vtkCommonCore import vtkSMPTools
+
+    smp = vtkSMPTools()
+    if smp.GetBackend() == "Sequential":
+        smp.SetBackend("STDThread")
+
+
+def extract_isosurface(volume, threshold, budget=DEFAULT_TRIANGLE_BUDGET):
+    # Flying edges contour at threshold (stored voxel values), in world coordinates, then clustered down
+    # to at most budget triangles and given smooth normals
+    from vtkmodules.vtkCommonDataModel import vtkPolyData
+    from vtkmodules.vtkFiltersCore import vtkFlyingEdges3D, vtkPolyDataNormals, vtkQuadricClustering
+
+    use_threaded_smp()
+    contour = vtkFlyingEdges3D()
+    contour.SetInputData(volume.to_vtk_image())
+    contour.SetValue(0, threshold)
+    contour.ComputeNormalsOff()
+    contour.ComputeScalarsOff()
+    contour.Update()
+    mesh = contour.GetOutput()
+
+    # Quadric clustering is linear in the mesh size; its cells grow until the mesh fits the budget
+    triangles = mesh.GetNumberOfCells()
+    bounds = mesh.GetBounds()
+    cell = max(volume.spacing) * (triangles / budget) ** 0.5
+    for _ in range(MAX_DECIMATION_PASSES):
+        if triangles <= budget:
+            break
+        clustering = vtkQuadricClustering()
+        clustering.SetInputData(contour.GetOutput())
+        clustering.AutoAdjustNumberOfDivisionsOff()
+        clustering.SetNumberOfDivisions(*(max(int(math.ceil((high - low) / cell)), 1)
+                                          for low, high in zip(bounds[0::2], bounds[1::2])))
+        clustering.Update()
+        mesh = clustering.GetOutput()
+        triangles = mesh.GetNumberOfCells()
+        cell *= max(1.05 * (triangles / budget) ** 0.5, 1.05)
+
+    normals = vtkPolyDataNormals()
+    normals.SetInputData(mesh)
+    normals.SplittingOff()
+    normals.Update()
+    surface = vtkPolyData()
+    surface.ShallowCopy(normals.GetOutput())
+    return surface
+
+
+def export_surface(mesh, file_path):
+    # The writer is picked by extension: .stl, .ply, .obj or .vtp
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in EXPORT_WRITERS:
+        raise ValueError(f"Unsupported mesh format: {extension or file_path}")
+    module, name = EXPORT_WRITERS[extension]
+    writer = getattr(importlib.import_module(f"vtkmodules.{module}"), name)()
+    if extension == ".stl":
+        writer.SetFileTypeToBinary()
+    writer.SetFileName(file_path)
+    writer.SetInputData(mesh)
+    if not writer.Write():
+        raise IOError(f"Failed to write {file_path}")
+
+
+class SurfaceCache:
+    # Isosurfaces per (volume, threshold, budget). In memory they live as long as their volume; studies with a
+    # volume cache key are also kept on disk as .vtp files, so a threshold seen in an earlier session is read back
+    def __init__(self, cache_root=None, max_bytes=DEFAULT_MAX_BYTES, per_volume=MAX_MESHES_PER_VOLUME):
+        self.root = cache_root or cache_dir("surfaces")
+        self.max_bytes = max_bytes
+        self.per_volume = per_volume
+        self._meshes = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key, threshold, budget):
+        # repr keeps every digit of the threshold, so nearby thresholds never share a file
+        return os.path.join(self.root, f"{key}-{float(threshold)!r}-{budget}.vtp")
+
+    def get(self, volume, threshold, budget=DEFAULT_TRIANGLE_BUDGET, key=None):
+        entry = (float(threshold), budget)
+        with self._lock:
+            meshes = self._meshes.setdefault(volume, OrderedDict())
+            mesh = meshes.get(entry)
+            if mesh is not None:
+                meshes.move_to_end(entry)
+                self.hits += 1
+                return mesh
+
+        mesh = self._read(key, threshold, budget) if key is not None else None
+        if mesh is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            mesh = extract_isosurface(volume, threshold, budget)
+            if key is not None:
+                self._write(key, threshold, budget, mesh)
+
+        with self._lock:
+            meshes[entry] = mesh
+            while len(meshes) > self.per_volume:
+                meshes.popitem(last=False)
+        return mesh
+
+    def _read(self, key, threshold, budget):
+        path = self._path(key, threshold, budget)
+        if not os.path.exists(path):
+            return None
+        from vtkmodules.vtkCommonDataModel import vtkPolyData
+        from vtkmodules.vtkIOXML import vtkXMLPolyDataReader
+
+        reader = vtkXMLPolyDataReader()
+        reader.SetFileName(path)
+        reader.Update()
+        if reader.GetErrorCode() or reader.GetOutput().GetNumberOfCells() == 0:
+            return None
+        # The file's mtime is the LRU clock
+        os.utime(path)
+        mesh = vtkPolyData()
+        mesh.ShallowCopy(reader.GetOutput())
+        return mesh
+
+    def _write(self, key, threshold, budget, mesh):
+        path = self._path(key, threshold, budget)
+        from vtkmodules.vtkIOXML import vtkXMLPolyDataWriter
+
+        writer = vtkXMLPolyDataWriter()
+        writer.SetFileName(path + ".tmp")
+        writer.SetInputData(mesh)
+        writer.SetDataModeToAppended()
+        # LZ4 keeps reading a cached mesh back much cheaper than extracting it again
+        writer.SetCompressorTypeToLZ4()
+        if writer.Write():
+            os.replace(path + ".tmp", path)
+            self.evict(keep=path)
+
+    def evict(self, keep=None):
+        # Remove least recently used meshes until the directory fits in max_bytes
+        entries = []
+        for path in glob.glob(os.path.join(self.root, "*.vtp")):
+            try:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
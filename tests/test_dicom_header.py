@@ -0,0 +1,70 @@
+import glob
+import os
+
+import pytest
+
+from dicom_index import WANTED_TAGS, DicomIndex, read_dicom_header
+
+pydicom = pytest.importorskip("pydicom")
+
+DATA_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_example", "Dicom")
+DICOM_FILES = sorted(glob.glob(os.path.join(DATA_ROOT, "**", "*.dcm"), recursive=True))
+
+# The anonymized example files carry UIDs that pydicom warns about
+pytestmark = pytest.mark.filterwarnings("ignore:Invalid value for VR UI")
+
+
+def reference_header(dataset):
+    # The same fields as read_dicom_header, as pydicom reads them
+    header = {}
+    for (group, element), (name, kind) in WANTED_TAGS.items():
+        if (group, element) not in dataset:
+            continue
+        value = dataset[group, element].value
+        if kind == "floats":
+            header[name] = [float(v) for v in (value if isinstance(value, (list, pydicom.multival.MultiValue))
+                                               else [value])]
+        elif kind in ("int", "us"):
+            header[name] = int(value)
+        else:
+            header[name] = str(value).strip()
+    return header
+
+
+@pytest.mark.parametrize("file_path", DICOM_FILES, ids=lambda path: os.path.relpath(path, DATA_ROOT))
+def test_header_matches_pydicom(file_path):
+    expected = reference_header(pydicom.dcmread(file_path, stop_before_pixels=True))
+    header = read_dicom_header(file_path)
+    assert header.keys() == expected.keys()
+    for name, value in expected.items():
+        if isinstance(value, list):
+            assert header[name] == pytest.approx(value), name
+        else:
+            assert header[name] == value, name
+
+
+@pytest.mark.parametrize("implicit_vr", [True, False])
+def test_transfer_syntaxes(tmp_path, implicit_vr):
+    # The example files are implicit VR little endian; the explicit VR path is exercised by re-encoding one
+    dataset = pydicom.dcmread(DICOM_FILES[0])
+    syntax = pydicom.uid.ImplicitVRLittleEndian if implicit_vr else pydicom.uid.ExplicitVRLittleEndian
+    dataset.file_meta.TransferSyntaxUID = syntax
+    file_path = str(tmp_path / "reencoded.dcm")
+    dataset.save_as(file_path, enforce_file_format=True, implicit_vr=implicit_vr, little_endian=True)
+    assert read_dicom_header(file_path) == read_dicom_header(DICOM_FILES[0])
+
+
+def test_series_grouping(tmp_path):
+    # Every file of the example directories ends up in exactly one series of one size, sorted along the normal
+    index = DicomIndex(str(tmp_path))
+    for directory in sorted({os.path.dirname(file_path) for file_path in DICOM_FILES}):
+        names = {os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(".dcm")}
+        series = index.scan(directory)
+        files = [file_path for entry in series for file_path in entry["files"]]
+        assert sorted(files) == sorted(names)
+        for entry in series:
+            assert entry["positions"] == sorted(entry["positions"])
+            # Anonymized files with a UID per slice are grouped by series number and geometry instead
+            datasets = [pydicom.dcmread(file_path, stop_before_pixels=True) for file_path in entry["files"]]
+            assert {(dataset.Rows, dataset.Columns) for dataset in datasets} == {(entry["rows"], entry["columns"])}
+            assert {str(dataset.SeriesNumber) for dataset in datasets} == {entry["series_number"]}
@@ -0,0 +1,112 @@
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip("vtkmodules")
+
+from vtkmodules.vtkRenderingCore import vtkRenderWindow  # noqa: E402
+
+from slice_engine import SliceEngine  # noqa: E402
+from viewer_session import SliceViewPipeline  # noqa: E402
+from volume import AXES, SLICE_PLANE_AXES, Volume  # noqa: E402
+
+# Anisotropic spacing and an off-centre origin, so the axes cannot be mixed up without a test failing
+SHAPE = (12, 17, 23)  # (z, y, x)
+SPACING = (0.7, 0.9, 2.5)
+ORIGIN = (-31.0, 12.5, 100.0)
+
+
+@pytest.fixture
+def engine():
+    array = np.arange(np.prod(SHAPE), dtype=np.int16).reshape(SHAPE)
+    return SliceEngine(Volume(array, SPACING, ORIGIN))
+
+
+def pipeline_for(engine, axis, size=(301, 203), zoom=1.0, pan=(0.0, 0.0)):
+    render_window = vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(*size)
+    pipeline = SliceViewPipeline(axis, render_window, None)
+    pipeline.attach(engine)
+    camera = pipeline.renderer.GetActiveCamera()
+    camera.Zoom(zoom)
+    x, y, z = camera.GetFocalPoint()
+    camera.SetFocalPoint(x + pan[0], y + pan[1], z)
+    x, y, z = camera.GetPosition()
+    camera.SetPosition(x + pan[0], y + pan[1], z)
+    pipeline.renderer.ResetCameraClippingRange()
+    return pipeline
+
+
+def voxel_to_display(pipeline, voxel):
+    # Centre of a voxel on the untilted slice, through the renderer's world-to-display transform
+    u, v = SLICE_PLANE_AXES[pipeline.axis]
+    world = [ORIGIN[u] + voxel[u] * SPACING[u], ORIGIN[v] + voxel[v] * SPACING[v], 0.0]
+    pipeline.renderer.SetWorldPoint(*world, 1.0)
+    pipeline.renderer.WorldToDisplay()
+    return pipeline.renderer.GetDisplayPoint()[:2]
+
+
+def sample_voxels(axis, slice_index):
+    # Corners, edges and the interior of one slice
+    dimensions = SHAPE[::-1]
+    u, v = SLICE_PLANE_AXES[axis]
+    for i, j in itertools.product(sorted({0, 1, dimensions[u] // 2, dimensions[u] - 1}),
+                                  sorted({0, dimensions[v] // 3, dimensions[v] - 1})):
+        voxel = [slice_index] * 3
+        voxel[u], voxel[v] = i, j
+        yield voxel
+
+
+@pytest.mark.parametrize("axis", list(AXES))
+@pytest.mark.parametrize("zoom, pan", [(1.0, (0.0, 0.0)), (3.7, (4.2, -2.9)), (0.6, (-10.0, 7.5))])
+def test_round_trip(engine, axis, zoom, pan):
+    pipeline = pipeline_for(engine, axis, zoom=zoom, pan=pan)
+    slice_index = engine.slice_count(axis) // 2
+    for voxel in sample_voxels(axis, slice_index):
+        display = voxel_to_display(pipeline, voxel)
+        assert pipeline.display_to_voxel(display, slice_index) == voxel
+
+
+@pytest.mark.parametrize("axis", list(AXES))
+def test_outside_the_slice(engine, axis):
+    pipeline = pipeline_for(engine, axis)
+    slice_index = 0
+    u, v = SLICE_PLANE_AXES[axis]
+    beyond = [slice_index] * 3
+    beyond[u] = SHAPE[::-1][u] + 3
+    beyond[v] = -2
+    display = voxel_to_display(pipeline, beyond)
+    assert pipeline.display_to_voxel(display, slice_index) is None
+
+    clamped = [slice_index] * 3
+    clamped[u] = SHAPE[::-1][u] - 1
+    clamped[v] = 0
+    assert pipeline.display_to_voxel(display, slice_index, clamp=True) == clamped
+
+
+@pytest.mark.parametrize("axis", list(AXES))
+@pytest.mark.parametrize("tilt", [(15.0, 0.0), (-8.0, 22.0)])
+def test_tilted_plane(engine, axis, tilt):
+    # On an oblique view the picked voxel lies on the tilted plane, within rounding to the voxel grid
+    engine.set_tilt(axis, tilt)
+    pipeline = pipeline_for(engine, axis, zoom=2.0)
+    slice_index = engine.slice_count(axis) // 2
+    plane = engine.plane(axis, slice_index)
+    half_diagonal = 0.5 * np.linalg.norm(SPACING)
+    picked = 0
+    for display in itertools.product(range(40, 261, 20), range(30, 181, 15)):
+        voxel = pipeline.display_to_voxel(display, slice_index)
+        if voxel is None:
+            continue
+        picked += 1
+        world = np.array(ORIGIN) + np.array(voxel) * np.array(SPACING)
+        assert abs(np.dot(world - plane_centre(plane), plane.normal)) <= half_diagonal + 1e-9
+    assert picked
+
+
+def plane_centre(plane):
+    centre = np.zeros(3)
+    centre[list(plane.frame)] = plane.center
+    return centre
@@ -0,0 +1,32 @@
+import pytest
+
+from mpr_cli import parse_args
+
+
+def usage_error(capsys, *argv):
+    with pytest.raises(SystemExit) as exit_info:
+        parse_args(["study.mha", *argv])
+    assert exit_info.value.code == 2
+    return capsys.readouterr().err
+
+
+def test_slab():
+    assert parse_args(["study.mha"]).slab is None
+    assert parse_args(["study.mha", "--slab", "mip", "12"]).slab == ["mip", 12]
+    assert parse_args(["study.mha", "--slab", "average", "1"]).slab == ["average", 1]
+
+
+@pytest.mark.parametrize("slices", ["0", "-4", "2.5", "many"])
+def test_slab_slices_must_be_positive(capsys, slices):
+    assert f"'{slices}' is neither a projection" in usage_error(capsys, "--slab", "mip", slices)
+
+
+def test_slab_projection_comes_first(capsys):
+    assert "unknown slab projection: 8" in usage_error(capsys, "--slab", "8", "mip")
+    assert "the projection first" in usage_error(capsys, "--slab", "mip", "minip")
+    assert "'slice' is neither a projection" in usage_error(capsys, "--slab", "slice", "4")
+
+
+def test_preset_is_case_insensitive(capsys):
+    assert parse_args(["study.mha", "--preset", "soft TISSUE"]).preset == "soft TISSUE"
+    assert "unknown preset: Liver" in usage_error(capsys, "--preset", "Liver")
@@ -0,0 +1,34 @@
+import numpy as np
+
+from oblique import ObliquePlane, curved_reformation, sample_planes
+from volume import Volume
+
+
+def ct_like_volume():
+    # Air at -1000 HU around a body, so a zero fill would stand out as mid-grey
+    rng = np.random.default_rng(0)
+    array = rng.integers(-1000, 1500, (16, 20, 24), dtype=np.int16)
+    array[array < -900] = -1000
+    return Volume(array, (1.0, 1.0, 2.0), (0.0, 0.0, 0.0))
+
+
+def test_outside_samples_take_the_volume_minimum():
+    volume = ct_like_volume()
+    plane = ObliquePlane(volume, "axial", 8, (40.0, 30.0))
+    image = plane.sample()
+    # The corners of a steeply tilted plane leave the volume
+    assert image[0, 0] == volume.array.min()
+    assert (image >= volume.array.min()).all()
+    np.testing.assert_array_equal(sample_planes([plane])[0], image)
+
+
+def test_fill_from_the_caller():
+    volume = ct_like_volume()
+    image = ObliquePlane(volume, "coronal", 10, (50.0, 0.0), fill=-2048).sample()
+    assert image.min() == -2048
+
+    # A curve running past the edge of the volume
+    image, _ = curved_reformation(volume, [(-10.0, 5.0, 16.0), (40.0, 5.0, 16.0)], (0.0, 0.0, 1.0), fill=-3000)
+    assert (image[0] == -3000).all() and (image[-1] == -3000).all()
+    image, _ = curved_reformation(volume, [(-10.0, 5.0, 16.0), (40.0, 5.0, 16.0)], (0.0, 0.0, 1.0))
+    assert image.min() == volume.array.min()
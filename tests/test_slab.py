@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from slab import SlabProjector, slab_range
+from volume import AXES
+
+REDUCTIONS = {"mip": np.max, "minip": np.min}
+
+
+def random_volume(dtype, shape=(23, 11, 13), seed=0):
+    rng = np.random.default_rng(seed)
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        return rng.normal(0.0, 100.0, shape).astype(dtype)
+    info = np.iinfo(dtype)
+    return rng.integers(info.min, info.max, shape, dtype=dtype, endpoint=True)
+
+
+def expected(array, axis, mode, thickness, index):
+    stack = np.moveaxis(array, AXES[axis], 0)
+    start, stop = slab_range(index, thickness, len(stack))
+    slab = stack[start:stop]
+    if mode in REDUCTIONS:
+        return REDUCTIONS[mode](slab, axis=0)
+    mean = np.mean(slab, axis=0, dtype=np.float64)
+    if np.issubdtype(array.dtype, np.integer):
+        return np.rint(mean).astype(array.dtype)
+    return mean.astype(array.dtype)
+
+
+def scroll_orders(count, seed):
+    # Sequential both ways, single steps with reversals, and random jumps, as the sliders and clicks produce
+    rng = np.random.default_rng(seed)
+    walk = np.clip(np.cumsum(rng.choice([-1, 1], 3 * count)) + count // 2, 0, count - 1)
+    return {"forward": list(range(count)), "backward": list(range(count - 1, -1, -1)),
+            "walk": [int(index) for index in walk],
+            "random": [int(index) for index in rng.integers(0, count, 2 * count)]}
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "int16", "uint16", "float32"])
+@pytest.mark.parametrize("mode", ["mip", "minip", "average"])
+@pytest.mark.parametrize("axis", list(AXES))
+@pytest.mark.parametrize("thickness", [1, 2, 5, 8])
+def test_projection_matches_numpy(dtype, mode, axis, thickness):
+    array = random_volume(dtype)
+    count = array.shape[AXES[axis]]
+    for order, indices in scroll_orders(count, seed=thickness).items():
+        projector = SlabProjector(array, axis, mode, thickness)
+        for index in indices:
+            result = projector.project(index)
+            reference = expected(array, axis, mode, thickness, index)
+            assert result.dtype == array.dtype
+            if mode == "average" and array.dtype.kind == "f":
+                # The running sum is updated by adding and subtracting slices
+                np.testing.assert_allclose(result, reference, rtol=1e-5, atol=1e-3,
+                                           err_msg=f"{order} scroll, slice {index}")
+            else:
+                np.testing.assert_array_equal(result, reference, err_msg=f"{order} scroll, slice {index}")
+
+
+def test_slab_thicker_than_volume():
+    array = random_volume("int16", shape=(4, 6, 5))
+    for mode in ("mip", "minip", "average"):
+        projector = SlabProjector(array, "axial", mode, 9)
+        for index in (0, 3, 1, 2):
+            np.testing.assert_array_equal(projector.project(index), expected(array, "axial", mode, 9, index))
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        SlabProjector(random_volume("uint8"), "axial", "slice", 4)
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+import slice_cache
+from slice_cache import SliceCache
+from slice_engine import SliceEngine
+from volume import Volume
+
+FRAME = 1 / 60
+
+
+class InlineExecutor:
+    # Runs each prefetch as it is submitted, so the test decides exactly when work happens
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class DeferredExecutor:
+    # Holds prefetches back until run() is called, like a worker that has fallen behind the scroll
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def run(self):
+        tasks, self.tasks = self.tasks, []
+        for fn, args in tasks:
+            fn(*args)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(slice_cache.time, "perf_counter", clock)
+    return clock
+
+
+def make_cache(executor, slices=200, **options):
+    array = np.arange(slices * 16, dtype=np.uint8).reshape(slices, 4, 4)
+    return SliceCache(SliceEngine(Volume(array), (255, 127.5)), "axial", executor=executor, **options)
+
+
+def scroll(cache, clock, indices, interval=FRAME):
+    for index in indices:
+        cache.get(index)
+        clock.now += interval
+
+
+def cached(cache):
+    return set(cache._slices)
+
+
+def test_single_steps_prefetch_the_next_slices(clock):
+    cache = make_cache(InlineExecutor())
+    cache.get(0)
+    assert cached(cache) == set(range(0, 9))
+    scroll(cache, clock, range(1, 6))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (5, 1)
+    assert stats["stride"] == 1
+
+
+def test_prefetch_follows_the_scroll_stride(clock):
+    cache = make_cache(InlineExecutor())
+    scroll(cache, clock, [0, 10])
+    # 10 slices a frame at 60 Hz is 600 slices/s; a quarter second of that is 15 steps ahead
+    assert cache.stats()["stride"] == 10
+    assert cached(cache) >= {10 + 10 * step for step in range(1, 16)}
+    assert not cached(cache) & {21, 25, 29}
+
+    scroll(cache, clock, range(20, 200, 10))
+    stats = cache.stats()
+    assert stats["misses"] == 2 and stats["hits"] == 18
+
+
+def test_faster_scrolling_looks_further_ahead(clock):
+    slow = make_cache(InlineExecutor())
+    scroll(slow, clock, [0, 4], interval=0.5)
+    fast = make_cache(InlineExecutor())
+    scroll(fast, clock, [0, 4], interval=0.005)
+    assert max(cached(slow)) == 4 + 4 * slice_cache.DEFAULT_PREFETCH_DEPTH
+    assert max(cached(fast)) == 4 + 4 * slice_cache.MAX_PREFETCH_DEPTH
+
+
+def test_jumps_leave_the_stride_alone(clock):
+    cache = make_cache(InlineExecutor())
+    scroll(cache, clock, [0, 3, 6, 150])
+    assert cache.stats()["stride"] == 3
+    assert 153 in cached(cache)
+
+
+def test_reversing_prefetches_the_other_way(clock):
+    cache = make_cache(InlineExecutor())
+    scroll(cache, clock, [100, 98, 96])
+    assert {94, 92, 90} <= cached(cache)
+    assert not cached(cache) & {95, 97, 99}
+
+
+def test_prefetches_the_scroll_has_passed_are_skipped(clock):
+    executor = DeferredExecutor()
+    cache = make_cache(executor)
+    scroll(cache, clock, [50, 51])
+    queued = {args[0] for _, args in executor.tasks}
+    assert set(range(51, 60)) <= queued
+
+    # The user turns around before the worker gets to them; the stride is now (1 + 6) / 2, rounded to 4
+    scroll(cache, clock, [45])
+    executor.run()
+    assert not cached(cache) & set(range(52, 60))
+    assert {41, 37, 33} <= cached(cache)
+
+
+def test_invalidate_drops_prefetches_in_flight(clock):
+    executor = DeferredExecutor()
+    cache = make_cache(executor)
+    cache.get(0)
+    cache.invalidate()
+    executor.run()
+    assert cached(cache) == set()
+    assert cache.stats()["prefetched"] == 0
+
+
+def test_least_recently_used_slices_are_evicted(clock):
+    # Room for three 4x4 slices and no prefetching while the scroll stands still
+    cache = make_cache(InlineExecutor(), max_bytes=3 * 16, prefetch_depth=0)
+    for index in (0, 1, 2, 0, 3):
+        cache.get(index)
+    assert list(cache._slices) == [2, 0, 3]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["bytes"]) == (1, 4, 1, 48)
+    np.testing.assert_array_equal(cache.get(0), cache.engine.get_slice("axial", 0, mapped=True))
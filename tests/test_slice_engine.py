@@ -0,0 +1,32 @@
+import threading
+
+import numpy as np
+
+import slice_engine
+from slice_engine import SliceEngine
+from volume import Volume
+
+
+def test_lut_built_for_an_old_window_level_is_not_kept(monkeypatch):
+    # A prefetch worker builds the lookup table for the old window/level while the GUI thread changes it
+    rng = np.random.default_rng(0)
+    engine = SliceEngine(Volume(rng.integers(-1000, 2000, (4, 32, 32), dtype=np.int16)), (400, 40))
+    map_window_level = slice_engine.map_window_level
+    building, changed = threading.Event(), threading.Event()
+
+    def slow_map_window_level(values, window, level, out=None):
+        if threading.current_thread().name == "prefetch" and out is None:
+            building.set()
+            changed.wait(5)
+        return map_window_level(values, window, level, out)
+
+    monkeypatch.setattr(slice_engine, "map_window_level", slow_map_window_level)
+    worker = threading.Thread(target=engine.get_slice, args=("axial", 0, True), name="prefetch")
+    worker.start()
+    assert building.wait(5)
+    engine.set_window_level(1500, 300)
+    changed.set()
+    worker.join()
+
+    raw = engine.get_slice("axial", 2)
+    np.testing.assert_array_equal(engine.get_slice("axial", 2, mapped=True), map_window_level(raw, 1500.0, 300.0))
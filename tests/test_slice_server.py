@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from slice_server import OP_TEXT, PNG_SIGNATURE, SliceServer, read_websocket_frame
+
+SHAPE = (6, 10, 12)  # (z, y, x)
+
+
+def write_mha(file_path, array, spacing=(1.0, 1.0, 2.0)):
+    # Uncompressed MetaImage with the voxels in the same file, as read_mha expects
+    header = ("ObjectType = Image\nNDims = 3\nBinaryData = True\nBinaryDataByteOrderMSB = False\n"
+              f"DimSize = {array.shape[2]} {array.shape[1]} {array.shape[0]}\n"
+              f"ElementSpacing = {spacing[0]} {spacing[1]} {spacing[2]}\n"
+              "ElementType = MET_SHORT\nElementDataFile = LOCAL\n")
+    with open(file_path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(array.astype("<i2").tobytes())
+
+
+@pytest.fixture
+def study_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("MPR_CACHE_DIR", str(tmp_path / "cache"))
+    studies = tmp_path / "studies"
+    studies.mkdir()
+    rng = np.random.default_rng(0)
+    write_mha(str(studies / "phantom.mha"), rng.integers(-1000, 1000, SHAPE, dtype=np.int16))
+    return str(studies)
+
+
+def serve(study_dir, client):
+    # Runs client(host, port) against a server on an ephemeral localhost port
+    async def run():
+        server = SliceServer([study_dir], workers=2)
+        await server.start("127.0.0.1", 0)
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.wait_for(client(server, "127.0.0.1", port), 30)
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+async def get(reader, writer, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers, await reader.readexactly(int(headers["content-length"]))
+
+
+async def open_websocket(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    writer.write((f"GET /ws HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+    assert b" 101 " in await reader.readline()
+    while await reader.readline() not in (b"\r\n", b""):
+        pass
+    return reader, writer
+
+
+async def send_json(writer, message):
+    # Client frames are masked
+    payload = json.dumps(message).encode("utf-8")
+    mask = os.urandom(4)
+    masked = (np.frombuffer(payload, np.uint8) ^ np.resize(np.frombuffer(mask, np.uint8), len(payload))).tobytes()
+    writer.write(struct.pack(">BB", 0x80 | OP_TEXT, 0x80 | len(payload)) + mask + masked)
+    await writer.drain()
+
+
+async def receive_json(reader):
+    opcode, payload = await read_websocket_frame(reader)
+    assert opcode == OP_TEXT
+    return json.loads(payload)
+
+
+def test_tiles_and_errors(study_dir):
+    async def client(server, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        status, _, body = await get(reader, writer, "/studies")
+        assert status == 200 and json.loads(body) == ["phantom"]
+
+        status, _, body = await get(reader, writer, "/studies/phantom")
+        info = json.loads(body)
+        assert status == 200 and info["slices"] == {"axial": 6, "coronal": 10, "sagittal": 12}
+
+        status, headers, first = await get(reader, writer, "/studies/phantom/coronal/4.png?window=400&level=40")
+        assert status == 200 and headers["content-type"] == "image/png" and headers["x-tile-cache"] == "miss"
+        assert first.startswith(PNG_SIGNATURE)
+        # The same tile again comes from the tile cache, byte for byte
+        status, headers, again = await get(reader, writer, "/studies/phantom/coronal/4.png?window=400&level=40")
+        assert status == 200 and headers["x-tile-cache"] == "hit" and again == first
+        assert server.tiles.stats()["hits"] == 1
+
+        for path in ("/studies/missing", "/studies/phantom/axial/6.png", "/studies/phantom/oblique/0.png",
+                     "/studies/phantom/axial/x.png", "/nothing"):
+            status, _, body = await get(reader, writer, path)
+            assert status == 404, path
+            assert "error" in json.loads(body)
+        for query in ("window=wide", "window=0", "preset=Nonexistent"):
+            status, _, body = await get(reader, writer, f"/studies/phantom/axial/0.png?{query}")
+            assert status == 400, query
+            assert "error" in json.loads(body)
+        writer.close()
+
+    serve(study_dir, client)
+
+
+def test_crosshair_round_trip(study_dir):
+    async def client(server, host, port):
+        receiver, receiver_writer = await open_websocket(host, port)
+        sender, sender_writer = await open_websocket(host, port)
+        await send_json(receiver_writer, {"subscribe": "phantom"})
+        await asyncio.sleep(0.05)
+
+        # Out-of-range indices are clamped to the volume
+        await send_json(sender_writer, {"study": "phantom", "crosshair": [3, 50, -2]})
+        update = await receive_json(receiver)
+        assert update["type"] == "crosshair" and update["voxel"] == [3, 9, 0]
+        assert update["slices"] == {"axial": 0, "coronal": 9, "sagittal": 3}
+
+        # A client subscribing later gets the last crosshair straight away
+        late, late_writer = await open_websocket(host, port)
+        await send_json(late_writer, {"subscribe": "phantom"})
+        assert (await receive_json(late))["voxel"] == [3, 9, 0]
+
+        for crosshair in ([1, 2], [1, 2, 3, 4], "1,2,3", [1, "2", 3], [1, None, 3], [1, float("inf"), 3]):
+            await send_json(sender_writer, {"study": "phantom", "crosshair": crosshair})
+            reply = await receive_json(sender)
+            assert reply["type"] == "error", crosshair
+        await send_json(sender_writer, {"subscribe": "missing"})
+        assert (await receive_json(sender))["type"] == "error"
+
+        # The connection survives the malformed messages
+        await send_json(sender_writer, {"study": "phantom", "crosshair": [1, 2, 3]})
+        assert (await receive_json(receiver))["voxel"] == [1, 2, 3]
+        for writer in (receiver_writer, sender_writer, late_writer):
+            writer.close()
+
+    serve(study_dir, client)
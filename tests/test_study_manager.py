@@ -0,0 +1,172 @@
+import logging
+
+import numpy as np
+import pytest
+
+import study_manager
+from slice_engine import SliceEngine
+from study_manager import StudyManager, memory_budget, slice_at, slice_position
+from volume import AXES, Volume
+from volume_cache import VolumeCache
+
+SHAPE = (6, 8, 10)
+VOLUME_BYTES = int(np.prod(SHAPE)) * 2
+
+
+def make_volume(seed):
+    array = np.random.default_rng(seed).integers(0, 3000, size=SHAPE).astype(np.int16)
+    return Volume(array, (0.8, 0.8, 2.5), (-4.0, 3.0, 10.0 * seed))
+
+
+@pytest.fixture
+def manager(tmp_path):
+    # Room for two of the small volumes in memory
+    return StudyManager(VolumeCache(str(tmp_path)), max_bytes=2 * VOLUME_BYTES)
+
+
+def open_studies(manager, names, evict=True):
+    studies = {}
+    for seed, name in enumerate(names):
+        study = studies[name] = manager.open(f"/data/{name}.mha")
+        manager.loaded(study, f"key-{name}", make_volume(seed), evict=evict)
+    return studies
+
+
+def resident(manager):
+    return [study.name for study in manager if study.resident]
+
+
+def test_open_returns_the_same_study(manager):
+    study = manager.open("/data/a.mha")
+    assert manager.open("/data/../data/a.mha") is study
+    assert manager.find("/data/a.mha") is study
+    assert len(manager) == 1
+
+
+def test_over_budget_lists_least_recently_used(manager):
+    studies = open_studies(manager, "abcd", evict=False)
+    assert resident(manager) == ["a.mha", "b.mha", "c.mha", "d.mha"]
+    assert manager.over_budget(keep=studies["d"]) == [studies["a"], studies["b"]]
+
+    manager.touch(studies["a"])
+    assert manager.over_budget(keep=studies["d"]) == [studies["b"], studies["c"]]
+    # The study being kept is passed over even when it is the least recently used
+    assert manager.over_budget(keep=studies["b"]) == [studies["c"], studies["d"]]
+    assert manager.evictions == 0
+
+
+def test_enforce_budget_evicts_to_the_volume_cache(manager):
+    studies = open_studies(manager, "abc")
+    assert resident(manager) == ["b.mha", "c.mha"]
+    assert manager.volume_cache.contains("key-a")
+    assert not manager.volume_cache.contains("key-b")
+    assert manager.stats()["evictions"] == 1
+    assert manager.resident_bytes() <= manager.max_bytes
+    assert studies["a"].volume is None and studies["a"].key == "key-a"
+
+
+def test_activate_restores_from_the_cache(manager):
+    studies = open_studies(manager, "abc")
+    original = make_volume(0)
+
+    volume = manager.activate(studies["a"])
+    assert volume is studies["a"].volume
+    np.testing.assert_array_equal(volume.array, original.array)
+    assert (volume.spacing, volume.origin) == (original.spacing, original.origin)
+    # a is now the most recently used, so b goes to make room
+    assert resident(manager) == ["c.mha", "a.mha"]
+    assert (manager.restores, manager.evictions) == (1, 2)
+
+
+def test_active_study_is_never_evicted(manager):
+    studies = open_studies(manager, "ab")
+    manager.max_bytes = VOLUME_BYTES // 2
+    manager.enforce_budget(keep=studies["a"])
+    assert resident(manager) == ["a.mha"]
+
+    assert manager.activate(studies["b"]) is not None
+    assert resident(manager) == ["b.mha"]
+    manager.loaded(manager.open("/data/c.mha"), "key-c", make_volume(2))
+    assert resident(manager) == ["c.mha"]
+
+
+def test_study_without_a_key_is_kept(manager):
+    studies = open_studies(manager, "ab")
+    studies["a"].key = None
+    manager.loaded(manager.open("/data/c.mha"), "key-c", make_volume(2))
+    assert resident(manager) == ["a.mha", "c.mha"]
+
+
+def test_study_that_cannot_be_cached_stays_in_memory(manager, monkeypatch, caplog):
+    def put(key, volume, source=None):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(manager.volume_cache, "put", put)
+    with caplog.at_level(logging.WARNING, logger="study_manager"):
+        open_studies(manager, "abc")
+    assert resident(manager) == ["a.mha", "b.mha", "c.mha"]
+    assert manager.evictions == 0
+    assert "disk full" in caplog.text
+
+
+def test_close_forgets_the_study_but_keeps_it_cached(manager):
+    studies = open_studies(manager, "abc")
+    manager.close(studies["b"])
+    assert manager.find("/data/b.mha") is None
+    assert studies["b"].volume is None
+    assert manager.volume_cache.contains("key-a")
+
+
+def test_restored_view_state_matches(manager):
+    studies = open_studies(manager, "ab")
+    study = studies["a"]
+    engine = SliceEngine(study.volume, (800, 1200))
+    engine.set_tilt("coronal", (20, -10))
+    slices = {"axial": 4, "coronal": 3, "sagittal": 7}
+    expected = {axis: engine.get_slice(axis, index, mapped=True) for axis, index in slices.items()}
+    study.save_state(slices, engine)
+
+    # Opening a third study pushes a out of memory
+    manager.loaded(manager.open("/data/c.mha"), "key-c", make_volume(2))
+    assert not study.resident
+
+    volume = manager.activate(study)
+    engine = SliceEngine(volume, study.window_level)
+    for axis, tilt in study.tilts.items():
+        engine.set_tilt(axis, tilt)
+    assert study.slices == slices
+    assert study.tilts == {"coronal": (20.0, -10.0)}
+    for axis, index in study.slices.items():
+        np.testing.assert_array_equal(engine.get_slice(axis, index, mapped=True), expected[axis])
+
+
+def test_save_state_ignores_other_engines(manager):
+    studies = open_studies(manager, "ab")
+    studies["a"].save_state({"axial": 2}, SliceEngine(studies["b"].volume))
+    assert studies["a"].slices == {} and studies["a"].window_level is None
+
+
+def test_linked_positions_map_between_studies():
+    volume = make_volume(1)
+    other = Volume(np.zeros((12, 4, 4), dtype=np.int16), (1.0, 1.0, 1.25), (0.0, 0.0, 5.0))
+    for axis in AXES:
+        for index in range(volume.array.shape[AXES[axis]]):
+            position = slice_position(volume, axis, index)
+            assert slice_at(volume, axis, position) == index
+    # Axial slice 2 of volume sits at z = 10 + 2 * 2.5 = 15 mm, slice 8 of other
+    assert slice_at(other, "axial", slice_position(volume, "axial", 2)) == 8
+    assert slice_at(other, "axial", 1000.0) == 11
+    assert slice_at(other, "axial", -1000.0) == 0
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("", study_manager.DEFAULT_MEMORY_BUDGET),
+    ("512", 512 * 1024 ** 2),
+    ("0.5", 512 * 1024),
+    ("-1", study_manager.DEFAULT_MEMORY_BUDGET),
+    ("lots", study_manager.DEFAULT_MEMORY_BUDGET),
+    ("inf", study_manager.DEFAULT_MEMORY_BUDGET),
+])
+def test_memory_budget(monkeypatch, value, expected):
+    monkeypatch.setenv("MPR_STUDY_BUDGET_MB", value)
+    assert memory_budget() == expected
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from surface import SurfaceCache, export_surface, extract_isosurface
+from volume import Volume
+
+
+def sphere(size=32):
+    # Distance from the centre, falling off outwards: the isosurface at value v is a sphere of radius 100 - v
+    z, y, x = np.indices((size, size, size)) - (size - 1) / 2
+    return Volume((100 - np.sqrt(x ** 2 + y ** 2 + z ** 2)).astype(np.float32), (1.0, 1.0, 1.0))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SurfaceCache(str(tmp_path))
+
+
+def test_isosurface_of_a_sphere():
+    volume = sphere()
+    mesh = extract_isosurface(volume, 90.0)
+    assert mesh.GetNumberOfCells() > 0
+    assert mesh.GetPointData().GetNormals() is not None
+    low, high = mesh.GetBounds()[0:2]
+    # Radius 10 around the volume centre at 15.5
+    assert low == pytest.approx(5.5, abs=0.5) and high == pytest.approx(25.5, abs=0.5)
+
+
+def test_triangle_budget_is_respected():
+    mesh = extract_isosurface(sphere(), 90.0, budget=500)
+    assert 0 < mesh.GetNumberOfCells() <= 500
+
+
+def test_repeat_request_is_cached(cache):
+    volume = sphere()
+    mesh = cache.get(volume, 90.0)
+    assert mesh.GetNumberOfCells() > 0
+    assert cache.get(volume, 90) is mesh
+    assert cache.stats() == {"hits": 1, "disk_hits": 0, "misses": 1}
+
+
+def test_other_iso_value_or_budget_misses(cache):
+    volume = sphere()
+    mesh = cache.get(volume, 90.0)
+    smaller = cache.get(volume, 94.0)
+    assert smaller is not mesh
+    assert smaller.GetBounds()[1] - smaller.GetBounds()[0] < mesh.GetBounds()[1] - mesh.GetBounds()[0]
+    assert cache.get(volume, 90.0, budget=500) is not mesh
+    assert cache.stats()["misses"] == 3
+
+
+def test_meshes_are_kept_per_volume(cache):
+    first, second = sphere(), sphere()
+    mesh = cache.get(first, 90.0)
+    assert cache.get(second, 90.0) is not mesh
+    assert cache.get(first, 90.0) is mesh
+
+
+def test_least_recently_used_mesh_is_dropped(tmp_path):
+    cache = SurfaceCache(str(tmp_path), per_volume=2)
+    volume = sphere()
+    meshes = [cache.get(volume, value) for value in (88.0, 90.0)]
+    cache.get(volume, 88.0)
+    cache.get(volume, 92.0)
+    assert cache.get(volume, 88.0) is meshes[0]
+    assert cache.get(volume, 90.0) is not meshes[1]
+
+
+def test_keyed_meshes_are_read_back_from_disk(tmp_path):
+    volume = sphere()
+    mesh = SurfaceCache(str(tmp_path)).get(volume, 90.0, key="study")
+    assert len(list(tmp_path.glob("study-*.vtp"))) == 1
+
+    # A later session with a fresh cache reads the mesh back instead of extracting it
+    cache = SurfaceCache(str(tmp_path))
+    restored = cache.get(sphere(), 90.0, key="study")
+    assert cache.stats() == {"hits": 0, "disk_hits": 1, "misses": 0}
+    assert restored.GetNumberOfCells() == mesh.GetNumberOfCells()
+    assert restored.GetBounds() == pytest.approx(mesh.GetBounds())
+
+
+def test_export_rejects_unknown_formats(tmp_path):
+    mesh = extract_isosurface(sphere(), 90.0, budget=500)
+    export_surface(mesh, str(tmp_path / "sphere.stl"))
+    assert (tmp_path / "sphere.stl").stat().st_size > 0
+    with pytest.raises(ValueError):
+        export_surface(mesh, str(tmp_path / "sphere.xyz"))
@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+
+from volume import Volume
+from volume_cache import VolumeCache, source_key
+
+SHAPE = (4, 8, 8)
+ENTRY_BYTES = int(np.prod(SHAPE)) * 2
+
+
+def make_volume(seed):
+    array = np.random.default_rng(seed).integers(-1024, 2000, size=SHAPE).astype(np.int16)
+    volume = Volume(array, (0.5, 0.5, 2.0), (10.0, -20.0, 5.0), rescale=(1.0, -1024.0))
+    volume.modality = "CT"
+    return volume
+
+
+def age(cache, key, seconds_ago):
+    # The sidecar's mtime is the cache's LRU clock; set it explicitly rather than sleeping
+    meta_path = cache._paths(key)[1]
+    when = os.path.getmtime(meta_path) - seconds_ago
+    os.utime(meta_path, (when, when))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return VolumeCache(str(tmp_path), max_bytes=3 * ENTRY_BYTES)
+
+
+def test_round_trip(cache):
+    volume = make_volume(0)
+    cache.put("study", volume)
+    assert cache.contains("study")
+
+    cached = cache.get("study")
+    assert isinstance(cached.array, np.memmap)
+    np.testing.assert_array_equal(cached.array, volume.array)
+    assert cached.array.dtype == volume.array.dtype
+    assert (cached.spacing, cached.origin, cached.direction, cached.rescale, cached.modality) == \
+        (volume.spacing, volume.origin, volume.direction, volume.rescale, volume.modality)
+    assert cached.window_level == volume.window_level
+    assert cached.window_presets == volume.window_presets
+    np.testing.assert_array_equal(cached.histogram.counts, volume.histogram.counts)
+
+    # Copy-on-write: drawing into the mapped array leaves the cache file alone
+    cached.array[0, 0, 0] += 1
+    np.testing.assert_array_equal(cache.get("study").array, volume.array)
+
+
+def test_missing_or_truncated_entries_miss(cache):
+    assert cache.get("unknown") is None
+    cache.put("study", make_volume(0))
+    raw_path = cache._paths("study")[0]
+    with open(raw_path, "r+b") as f:
+        f.truncate(ENTRY_BYTES // 2)
+    assert cache.get("study") is None
+
+
+def test_evicts_least_recently_used(cache):
+    for index, key in enumerate(("a", "b", "c")):
+        cache.put(key, make_volume(index))
+        age(cache, key, 300 - 100 * index)
+
+    cache.put("d", make_volume(3))
+    assert [cache.contains(key) for key in "abcd"] == [False, True, True, True]
+
+    cache.max_bytes = 2 * ENTRY_BYTES
+    cache.evict()
+    assert [cache.contains(key) for key in "abcd"] == [False, False, True, True]
+
+
+def test_newest_entry_is_kept_even_when_too_large(cache):
+    cache.put("a", make_volume(0))
+    cache.max_bytes = ENTRY_BYTES // 2
+    cache.put("b", make_volume(1))
+    assert not cache.contains("a")
+    assert cache.contains("b")
+
+
+def test_get_refreshes_recency(cache):
+    for index, key in enumerate(("a", "b", "c")):
+        cache.put(key, make_volume(index))
+        age(cache, key, 300 - 100 * index)
+
+    assert cache.get("a") is not None
+    cache.put("d", make_volume(3))
+    assert [cache.contains(key) for key in "abcd"] == [True, False, True, True]
+
+
+def test_changed_source_misses_and_replaces_the_old_entry(cache, tmp_path):
+    source = tmp_path / "study.mha"
+    source.write_bytes(b"first version")
+    old_key = source_key([str(source)])
+    cache.put(old_key, make_volume(0), str(source))
+    cache.put("other", make_volume(1), str(tmp_path / "other.mha"))
+
+    # Rewritten with a different size and mtime
+    source.write_bytes(b"second, longer version")
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    new_key = source_key([str(source)])
+    assert new_key != old_key
+    assert cache.get(new_key) is None
+
+    cache.put(new_key, make_volume(2), str(source))
+    assert not cache.contains(old_key)
+    assert cache.contains(new_key) and cache.contains("other")
+    np.testing.assert_array_equal(cache.get(new_key).array, make_volume(2).array)
+
+
+def test_source_key_depends_on_size_and_mtime(tmp_path):
+    source = tmp_path / "slice.dcm"
+    source.write_bytes(b"abc")
+    key = source_key([str(source)])
+    assert source_key([str(source)]) == key
+
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    touched = source_key([str(source)])
+    assert touched != key
+
+    source.write_bytes(b"abcd")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert source_key([str(source)]) not in (key, touched)
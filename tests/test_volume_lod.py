@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from volume import Volume
+from volume_lod import LODVolumeRenderer, VolumePyramid, downsample
+
+
+def reference(array):
+    # Edge-padded to even dimensions, then averaged over 2x2x2 blocks
+    padded = np.pad(array.astype(np.float64), [(0, n % 2) for n in array.shape], mode="edge")
+    depth, height, width = (n // 2 for n in padded.shape)
+    return padded.reshape(depth, 2, height, 2, width, 2).mean(axis=(1, 3, 5))
+
+
+@pytest.mark.parametrize("shape", [(4, 6, 8), (5, 7, 9), (1, 6, 7), (3, 1, 1), (1, 1, 1)])
+def test_downsample_rounds_dimensions_up(shape):
+    array = np.random.default_rng(0).random(shape, dtype=np.float32)
+    coarse = downsample(Volume(array, (0.5, 0.7, 2.0), (1.0, 2.0, 3.0)))
+    assert coarse.array.shape == tuple((n + 1) // 2 for n in shape)
+    np.testing.assert_allclose(coarse.array, reference(array), rtol=1e-6)
+    assert coarse.spacing == (1.0, 1.4, 4.0)
+    assert coarse.origin == (1.25, 2.35, 4.0)
+
+
+def test_odd_edges_are_kept():
+    # A bright last slice and last column would vanish if odd dimensions were truncated
+    array = np.zeros((5, 4, 5), dtype=np.int16)
+    array[-1] = 1000
+    array[:, :, -1] = 1000
+    coarse = downsample(Volume(array))
+    assert coarse.array.dtype == np.int16
+    assert (coarse.array[-1] == 1000).all()
+    assert (coarse.array[:, :, -1] == 1000).all()
+    assert (coarse.array[:2, :, :2] == 0).all()
+
+
+def test_pyramid_levels():
+    pyramid = VolumePyramid(Volume(np.ones((9, 17, 33), dtype=np.uint8)), levels=4)
+    assert [pyramid.volume(level).array.shape for level in range(4)] == [(9, 17, 33), (5, 9, 17), (3, 5, 9),
+                                                                           (2, 3, 5)]
+
+
+class FakeRenderer:
+    def AddObserver(self, event, callback):
+        return 1
+
+    def RemoveObserver(self, tag):
+        pass
+
+
+class Ignored:
+    # Stands in for the mapper and volume actor, whose setters are not under test
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+def test_full_resolution_frame_is_requested_after_interaction():
+    requests = []
+    lod = LODVolumeRenderer(Volume(np.zeros((8, 8, 8), dtype=np.int16)), Ignored(), FakeRenderer(), mapper=Ignored(),
+                            request_render=lambda: requests.append(lod.level))
+    lod.render_times = {0: 1.0}
+    lod.on_start_interaction(None, None)
+    assert lod.level == 3
+    assert requests == []
+
+    lod.on_end_interaction(None, None)
+    assert lod.level == 0
+    assert requests == [0]
+
+    # Nothing to refine when the interaction never left full resolution
+    lod.on_end_interaction(None, None)
+    assert requests == [0]
@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+import pytest
+
+from window_level import CT_PRESETS, EMPTY_WINDOW_LEVEL, IntensityHistogram, histogram_of, looks_like_ct, \
+    window_presets
+
+QUANTILES = (0.5, 1.0, 10.0, 25.0, 50.0, 75.0, 90.0, 99.0, 99.5)
+
+
+def add_slices(array):
+    # The way a series is read: one slice at a time, the range widening as new slices arrive
+    histogram = IntensityHistogram()
+    for image in array:
+        histogram.add(image)
+    return histogram
+
+
+def assert_percentiles_match(histogram, array):
+    # Within a bin of the samples on either side of the rank, where np.percentile interpolates
+    ordered = np.sort(array, axis=None).astype(np.float64)
+    for q in QUANTILES:
+        rank = q / 100 * ordered.size
+        below, above = ordered[max(int(rank) - 1, 0)], ordered[min(int(np.ceil(rank)), ordered.size - 1)]
+        assert below <= np.percentile(array, q) <= above
+        assert below - histogram.width <= histogram.percentile(q) <= above + histogram.width, q
+
+
+def test_constant_first_slice():
+    rng = np.random.default_rng(1)
+    array = rng.normal(40, 300, size=(12, 32, 32)).clip(-1024, 3000).astype(np.int16)
+    array[0] = -1024
+    histogram = add_slices(array)
+    assert (histogram.minimum, histogram.maximum) == (array.min(), array.max())
+    assert histogram.total == array.size
+    assert_percentiles_match(histogram, array)
+
+
+def test_float_data():
+    rng = np.random.default_rng(2)
+    array = rng.gamma(2.0, 0.05, size=(10, 24, 24)).astype(np.float32)
+    array[0] = 0.125
+    histogram = add_slices(array)
+    assert histogram.minimum == pytest.approx(array.min())
+    assert histogram.maximum == pytest.approx(array.max())
+    assert_percentiles_match(histogram, array)
+
+
+def test_range_growing_downward():
+    rng = np.random.default_rng(3)
+    # Each slice reaches further below the last, so the histogram has to grow towards lower values
+    array = np.stack([rng.integers(-200 * z, 500, size=(16, 16)) for z in range(1, 9)]).astype(np.int32)
+    histogram = add_slices(array)
+    assert histogram.low <= array.min()
+    assert_percentiles_match(histogram, array)
+    np.testing.assert_array_equal(histogram.counts, add_slices(array).counts)
+
+
+def test_whole_volume_matches_slices():
+    rng = np.random.default_rng(4)
+    array = rng.integers(0, 4096, size=(6, 20, 20)).astype(np.uint16)
+    assert_percentiles_match(histogram_of(array), array)
+
+
+def test_dict_round_trip():
+    rng = np.random.default_rng(5)
+    histogram = add_slices(rng.normal(0, 50, size=(4, 16, 16)).astype(np.float32))
+    restored = IntensityHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    np.testing.assert_array_equal(restored.counts, histogram.counts)
+    assert (restored.low, restored.width, restored.minimum, restored.maximum) == \
+        (histogram.low, histogram.width, histogram.minimum, histogram.maximum)
+    assert [restored.percentile(q) for q in QUANTILES] == [histogram.percentile(q) for q in QUANTILES]
+
+    # Values added after a restore land in the same bins as in the original
+    more = np.linspace(-400, 400, 64, dtype=np.float32)
+    histogram.add(more)
+    restored.add(more)
+    np.testing.assert_array_equal(restored.counts, histogram.counts)
+
+
+def test_empty_histogram():
+    histogram = IntensityHistogram()
+    histogram.add(np.zeros((0, 4), dtype=np.int16))
+    assert histogram.total == 0 and histogram.percentile(50) == 0.0
+    assert not looks_like_ct(histogram)
+    assert window_presets(histogram) == {"Default": EMPTY_WINDOW_LEVEL}
+    assert window_presets(histogram, "CT") == {"Default": EMPTY_WINDOW_LEVEL}
+
+
+def test_ct_presets_follow_the_rescale():
+    rng = np.random.default_rng(6)
+    # Stored values with slope 1 and intercept -1024: mostly air, some soft tissue
+    array = np.concatenate([np.zeros(600), rng.integers(1000, 1100, size=400)]).astype(np.uint16)
+    histogram = histogram_of(array.reshape(10, 10, 10))
+    assert looks_like_ct(histogram, (1.0, -1024.0))
+    assert not looks_like_ct(histogram)
+    presets = window_presets(histogram, rescale=(1.0, -1024.0))
+    assert list(presets)[0] == "Default" and list(presets)[-1] == "Full range"
+    for name, (window, level) in CT_PRESETS:
+        assert presets[name] == (window, level + 1024.0)
@@ -0,0 +1,346 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+# The OpenGL implementations of the renderers, actors and mappers below; volume rendering is loaded on first use
+import vtkmodules.vtkRenderingOpenGL2  # noqa: F401
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkImageData, vtkPiecewiseFunction, vtkPolyData
+from vtkmodules.vtkRenderingCore import (vtkActor, vtkColorTransferFunction, vtkImageActor, vtkPolyDataMapper,
+                                         vtkRenderer, vtkVolume, vtkVolumeProperty)
+
+from perf_stats import PerfStats
+from slice_cache import SliceCache
+from slice_engine import SliceEngine
+from surface import SurfaceCache
+from volume import AXES, SLICE_PLANE_AXES
+from volume_lod import LODVolumeRenderer, volume_rendering
+
+
+class SliceViewPipeline:
+    # One 2D panel: 8-bit buffer -> vtkImageData -> vtkImageActor -> vtkRenderer, built once per panel
+    def __init__(self, axis, render_window, prefetch_pool):
+        self.axis = axis
+        self.render_window = render_window
+        self.prefetch_pool = prefetch_pool
+
+        self.image = vtkImageData()
+        self.actor = vtkImageActor()
+        self.actor.GetMapper().SetInputData(self.image)
+        self.actor.VisibilityOff()
+        self.renderer = vtkRenderer()
+        self.renderer.AddActor(self.actor)
+        render_window.AddRenderer(self.renderer)
+
+        self.buffer = None
+        self.scalars = None
+        self.engine = None
+        self.cache = None
+        self.path_actor = None
+
+    @property
+    def active(self):
+        return self.cache is not None
+
+    def attach(self, engine):
+        # The display buffer is only reallocated when the slice size changes between studies
+        rows, cols = engine.slice_shape(self.axis)
+        if self.buffer is None or self.buffer.shape != (rows, cols):
+            self.buffer = np.zeros((rows, cols), dtype=np.uint8)
+            self.scalars = numpy_support.numpy_to_vtk(self.buffer.reshape(-1), deep=False)
+            self.image.SetDimensions(cols, rows, 1)
+            self.image.GetPointData().SetScalars(self.scalars)
+
+        # In-plane spacing and origin of the slice: (x, y) axial, (x, z) coronal, (y, z) sagittal
+        volume = engine.volume
+        u, v = SLICE_PLANE_AXES[self.axis]
+        self.image.SetSpacing(volume.spacing[u], volume.spacing[v], 1.0)
+        self.image.SetOrigin(volume.origin[u], volume.origin[v], 0.0)
+
+        self.engine = engine
+        self.cache = SliceCache(engine, self.axis, executor=self.prefetch_pool)
+        self.actor.VisibilityOn()
+        self.renderer.ResetCamera()
+
+    def show_slice(self, slice_index):
+        # Copy the window/levelled slice into the buffer VTK reads from and flag the image as changed
+        self.buffer[...] = self.cache.get(slice_index)
+        self.scalars.Modified()
+        self.image.Modified()
+
+    def release(self):
+        # Cached slices and the engine (with its volume) go with the cache
+        if self.cache is not None:
+            self.cache.invalidate()
+            self.cache = None
+        self.engine = None
+        self.actor.VisibilityOff()
+        if self.path_actor is not None:
+            self.path_actor.VisibilityOff()
+
+    def display_to_voxel(self, display_position, slice_index, clamp=False):
+        # (x, y, z) voxel indices under a display position of this view, from the camera transform alone;
+        # None outside the slice unless clamp is set, which keeps drags past the edge on the border voxels
+        plane_position = self.display_to_plane(display_position)
+        if plane_position is None:
+            return None
+        position = self.plane_to_volume(plane_position, slice_index)
+
+        volume = self.engine.volume
+        voxel = [0, 0, 0]
+        for volume_axis in range(3):
+            index = int(round(position[volume_axis]))
+            if not 0 <= index < volume.dimensions[volume_axis]:
+                if not clamp:
+                    return None
+                index = min(max(index, 0), volume.dimensions[volume_axis] - 1)
+            voxel[volume_axis] = index
+        return voxel
+
+    def display_to_plane(self, display_position):
+        # World (u, v) position on the slice under a display position, or None if the view is edge-on
+        near = self._display_to_world(display_position, 0.0)
+        far = self._display_to_world(display_position, 1.0)
+        if far[2] == near[2]:
+            return None
+        # The slice lies in the z = 0 plane of the view's world coordinates
+        t = -near[2] / (far[2] - near[2])
+        return near[0] + t * (far[0] - near[0]), near[1] + t * (far[1] - near[1])
+
+    def plane_to_volume(self, plane_position, slice_index):
+        # Fractional (x, y, z) voxel position of a point on the slice
+        plane = self.engine.plane(self.axis, slice_index)
+        if plane is not None:
+            # A tilted view is drawn on the untilted slice's pixel grid; the plane maps that back into the volume
+            return plane.plane_to_voxel(*plane_position)
+        volume = self.engine.volume
+        position = [float(slice_index)] * 3
+        for world, volume_axis in zip(plane_position, SLICE_PLANE_AXES[self.axis]):
+            position[volume_axis] = (world - volume.origin[volume_axis]) / volume.spacing[volume_axis]
+        return position
+
+    def set_path(self, plane_positions):
+        # Polyline drawn over the slice, e.g. the centreline of a curved reformation; empty hides it
+        if self.path_actor is None:
+            self.path_points = vtkPoints()
+            self.path_lines = vtkCellArray()
+            self.path_vertices = vtkCellArray()
+            path = vtkPolyData()
+            path.SetPoints(self.path_points)
+            path.SetLines(self.path_lines)
+            path.SetVerts(self.path_vertices)
+            mapper = vtkPolyDataMapper()
+            mapper.SetInputData(path)
+            self.path_actor = vtkActor()
+            self.path_actor.SetMapper(mapper)
+            self.path_actor.GetProperty().SetColor(1.0, 0.8, 0.0)
+            self.path_actor.GetProperty().SetLineWidth(2.0)
+            self.path_actor.GetProperty().SetPointSize(5.0)
+            self.path_actor.GetProperty().RenderPointsAsSpheresOn()
+            self.renderer.AddActor(self.path_actor)
+
+        # Lifted one voxel towards the camera so the line is not hidden by the image at z = 0
+        lift = min(self.engine.volume.spacing) if self.engine is not None else 1.0
+        self.path_points.Reset()
+        self.path_lines.Reset()
+        self.path_vertices.Reset()
+        for u, v in plane_positions:
+            # Each clicked point shows as a dot, joined by the line once there are two
+            self.path_vertices.InsertNextCell(1)
+            self.path_vertices.InsertCellPoint(self.path_points.InsertNextPoint(u, v, lift))
+        if len(plane_positions) > 1:
+            self.path_lines.InsertNextCell(len(plane_positions))
+            for point_id in range(len(plane_positions)):
+                self.path_lines.InsertCellPoint(point_id)
+        self.path_points.Modified()
+        self.path_lines.Modified()
+        self.path_vertices.Modified()
+        self.path_actor.SetVisibility(bool(plane_positions))
+
+    def _display_to_world(self, display_position, depth):
+        self.renderer.SetDisplayPoint(display_position[0], display_position[1], depth)
+        self.renderer.DisplayToWorld()
+        x, y, z, w = self.renderer.GetWorldPoint()
+        return x / w, y / w, z / w
+
+
+class ReformationViewPipeline:
+    # A standalone 2D image of varying size, such as a curved reformation: copied into a vtkImageData per update
+    def __init__(self, render_window):
+        self.render_window = render_window
+        self.image = vtkImageData()
+        self.actor = vtkImageActor()
+        self.actor.GetMapper().SetInputData(self.image)
+        self.renderer = vtkRenderer()
+        self.renderer.AddActor(self.actor)
+        render_window.AddRenderer(self.renderer)
+
+    def show(self, display_image, spacing):
+        # display_image is an 8-bit (rows, columns) array; spacing is (row, column) in world units
+        rows, cols = display_image.shape
+        self.image.SetDimensions(cols, rows, 1)
+        self.image.SetSpacing(spacing[1], spacing[0], 1.0)
+        self.image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(display_image.reshape(-1), deep=True))
+        self.image.Modified()
+        self.renderer.ResetCamera()
+
+
+class VolumeViewPipeline:
+    # The 3D panel: transfer functions, volume actor, renderer and mappers, built once and fed each new study
+    def __init__(self, render_window):
+        self.render_window = render_window
+
+        self.opacity = vtkPiecewiseFunction()
+        self.color = vtkColorTransferFunction()
+        self.volume_property = vtkVolumeProperty()
+        self.volume_property.ShadeOn()
+        self.volume_property.SetInterpolationTypeToLinear()
+        self.volume_property.SetScalarOpacity(self.opacity)
+        self.volume_property.SetColor(self.color)
+
+        self.vtk_volume = vtkVolume()
+        self.vtk_volume.SetProperty(self.volume_property)
+        self.vtk_volume.VisibilityOff()
+        self.renderer = vtkRenderer()
+        self.renderer.AddVolume(self.vtk_volume)
+        render_window.AddRenderer(self.renderer)
+
+        # Surface mode: an isosurface mesh shown instead of the ray-cast volume
+        self.empty_mesh = vtkPolyData()
+        self.surface_mapper = vtkPolyDataMapper()
+        self.surface_mapper.ScalarVisibilityOff()
+        self.surface_mapper.SetInputData(self.empty_mesh)
+        self.surface_actor = vtkActor()
+        self.surface_actor.SetMapper(self.surface_mapper)
+        self.surface_actor.GetProperty().SetColor(0.95, 0.92, 0.84)
+        self.surface_actor.VisibilityOff()
+        self.renderer.AddActor(self.surface_actor)
+
+        self.empty_image = vtkImageData()
+        self.gpu_mapper = None
+        self.cpu_mapper = None
+        self.lod_renderer = None
+
+    def attach(self, volume, window_level, use_gpu, frame_time, interactor=None, request_render=None):
+        # Opacity and grey ramps across the window
+        window, level = window_level
+        self.opacity.RemoveAllPoints()
+        self.opacity.AddPoint(level - window / 2, 0.0)
+        self.opacity.AddPoint(level + window / 2, 1.0)
+        self.color.RemoveAllPoints()
+        self.color.AddRGBPoint(level - window / 2, 0.0, 0.0, 0.0)
+        self.color.AddRGBPoint(level + window / 2, 1.0, 1.0, 1.0)
+
+        self.release()
+        if use_gpu:
+            if self.gpu_mapper is None:
+                self.gpu_mapper = volume_rendering().vtkGPUVolumeRayCastMapper()
+            self.gpu_mapper.SetInputData(volume.to_vtk_image())
+            self.vtk_volume.SetMapper(self.gpu_mapper)
+        else:
+            # Coarse pyramid levels while the camera moves, full resolution once it stops
+            if self.cpu_mapper is None:
+                self.cpu_mapper = volume_rendering().vtkFixedPointVolumeRayCastMapper()
+            self.lod_renderer = LODVolumeRenderer(volume, self.vtk_volume, self.renderer, frame_time,
+                                                  mapper=self.cpu_mapper, request_render=request_render)
+            if interactor is not None:
+                self.lod_renderer.attach(interactor)
+        self.vtk_volume.VisibilityOn()
+        self.renderer.ResetCamera()
+
+    def show_surface(self, mesh):
+        # The camera is only reset when the panel switches over, so changing the threshold keeps the view
+        switching = not self.surface_actor.GetVisibility()
+        self.release()
+        self.surface_mapper.SetInputData(mesh)
+        self.surface_actor.VisibilityOn()
+        if switching:
+            self.renderer.ResetCamera()
+
+    def set_frame_time(self, frame_time):
+        if self.lod_renderer is not None:
+            self.lod_renderer.set_frame_time(frame_time)
+
+    def release(self):
+        # Point the mappers at an empty image and free their GPU copy, so the old volume can be freed
+        if self.lod_renderer is not None:
+            self.lod_renderer.detach()
+            self.lod_renderer = None
+        for mapper in (self.gpu_mapper, self.cpu_mapper):
+            if mapper is not None:
+                mapper.SetInputData(self.empty_image)
+        if self.gpu_mapper is not None:
+            self.gpu_mapper.ReleaseGraphicsResources(self.render_window)
+        self.vtk_volume.VisibilityOff()
+        self.surface_mapper.SetInputData(self.empty_mesh)
+        self.surface_actor.VisibilityOff()
+
+
+class ViewerSession:
+    # Owns the display pipelines of the four panels across study loads; a new study only swaps their input
+    def __init__(self, slice_windows, volume_window, prefetch_pool=None, perf=None):
+        self.prefetch_pool = prefetch_pool or ThreadPoolExecutor(max_workers=2)
+        self.perf = perf or PerfStats()
+        self.slice_pipelines = {axis: SliceViewPipeline(axis, render_window, self.prefetch_pool)
+                                for axis, render_window in slice_windows.items()}
+        self.volume_pipeline = VolumeViewPipeline(volume_window)
+        self.surfaces = SurfaceCache()
+        self.engine = None
+        self.projection = ("slice", 1)
+
+    @property
+    def volume(self):
+        return self.engine.volume if self.engine is not None else None
+
+    def load(self, volume, window_level=None, axes=tuple(AXES)):
+        # The previous study is released before the new one is attached
+        self.release()
+        self.engine = SliceEngine(volume, window_level)
+        # Slabs only once every view is attached; a series still streaming in is shown slice by slice
+        if set(axes) == set(self.slice_pipelines):
+            self.engine.set_projection(*self.projection)
+        for axis in axes:
+            self._attach(self.slice_pipelines[axis])
+
+    def attach_remaining(self):
+        # Views left out of load() (e.g. while a series was still streaming in)
+        for pipeline in self.slice_pipelines.values():
+            if not pipeline.active:
+                self._attach(pipeline)
+        self.set_projection(*self.projection)
+
+    def _attach(self, pipeline):
+        with self.perf.timed("setup_slice_view", pipeline.axis):
+            pipeline.attach(self.engine)
+
+    def show_3d(self, use_gpu, frame_time, interactor=None, request_render=None):
+        self.volume_pipeline.attach(self.volume, self.volume.default_window_level(), use_gpu, frame_time,
+                                    interactor, request_render)
+
+    def set_window_level(self, window, level):
+        # Cached slices were mapped with the old window/level
+        self.engine.set_window_level(window, level)
+        for pipeline in self.slice_pipelines.values():
+            if pipeline.active:
+                pipeline.cache.invalidate()
+
+    def set_projection(self, mode, thickness):
+        # Thick-slab MIP/MinIP/average (or "slice") in all three views; cached slices are stale afterwards
+        self.projection = (mode, thickness)
+        if self.engine is not None and all(pipeline.active for pipeline in self.slice_pipelines.values()):
+            self.engine.set_projection(mode, thickness)
+            for pipeline in self.slice_pipelines.values():
+                pipeline.cache.invalidate()
+
+    def set_tilt(self, axis, tilt):
+        # Oblique plane of one view; only that view's cached slices are stale
+        pipeline = self.slice_pipelines[axis]
+        if self.engine is not None and pipeline.active:
+            self.engine.set_tilt(axis, tilt)
+            pipeline.cache.invalidate()
+
+    def release(self):
+        for pipeline in self.slice_pipelines.values():
+            pipeline.release()
+        self.volume_pipeline.release()
+        self.engine = None
@@ -0,0 +1,83 @@
+import numpy as np
+
+from window_level import histogram_of, window_presets
+
+# Viewer axis names mapped to the array axis they slice through; voxels are stored
+# (z, y, x) so VTK's x-fastest memory layout maps onto a C-contiguous NumPy array
+AXES = {"axial": 0, "coronal": 1, "sagittal": 2}
+
+# Volume axes, in (x, y, z) order, along the columns and rows of each 2D view
+SLICE_PLANE_AXES = {"axial": (0, 1), "coronal": (0, 2), "sagittal": (1, 2)}
+
+
+def window_level_of(array):
+    # Window spans the full intensity range, level sits at its midpoint
+    min_val, max_val = float(array.min()), float(array.max())
+    return max_val - min_val, (max_val + min_val) / 2
+
+
+class Volume:
+    def __init__(self, array, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0), direction=None, rescale=(1.0, 0.0)):
+        self.array = array
+        # Spacing and origin are kept in VTK's (x, y, z) order
+        self.spacing = tuple(float(s) for s in spacing)
+        self.origin = tuple(float(o) for o in origin)
+        self.direction = tuple(direction) if direction is not None else (1, 0, 0, 0, 1, 0, 0, 0, 1)
+        self.rescale = tuple(rescale)  # (slope, intercept) still to be applied to the stored values
+        self.modality = None
+        self.histogram = None
+        self.window_presets = {}
+        self.window_level = None
+        self._vtk_image = None
+
+    @property
+    def dimensions(self):
+        # Same order as vtkImageData.GetDimensions()
+        depth, height, width = self.array.shape
+        return width, height, depth
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def default_window_level(self):
+        # Derived once from the intensity histogram and reused by every view
+        if self.window_level is None:
+            self.set_histogram(self.histogram or histogram_of(self.array))
+        return self.window_level
+
+    def set_histogram(self, histogram):
+        # Presets only read the histogram, so switching between them never touches the voxels
+        self.histogram = histogram
+        self.window_presets = window_presets(histogram, self.modality, self.rescale)
+        self.window_level = self.window_presets["Default"]
+
+    @classmethod
+    def from_vtk_image(cls, image_data):
+        from vtkmodules.util import numpy_support
+
+        scalars = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+        if scalars.ndim > 1:
+            scalars = scalars[:, 0]  # Only the first component is displayed
+        width, height, depth = image_data.GetDimensions()
+        volume = cls(scalars.reshape(depth, height, width), image_data.GetSpacing(), image_data.GetOrigin())
+
+        # The array is a view on VTK's memory, so the image must outlive it
+        volume._vtk_image = image_data
+        return volume
+
+    def to_vtk_image(self):
+        # Wrap the voxel array in a vtkImageData without copying it
+        if self._vtk_image is None:
+            from vtkmodules.util import numpy_support
+            from vtkmodules.vtkCommonDataModel import vtkImageData
+
+            self.array = np.ascontiguousarray(self.array)
+            scalars = numpy_support.numpy_to_vtk(self.array.reshape(-1), deep=False)
+            image_data = vtkImageData()
+            image_data.SetDimensions(*self.dimensions)
+            image_data.SetSpacing(*self.spacing)
+            image_data.SetOrigin(*self.origin)
+            image_data.GetPointData().SetScalars(scalars)
+            self._vtk_image = image_data
+        return self._vtk_image
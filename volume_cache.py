@@ -0,0 +1,127 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cache_paths import cache_dir
+from volume import Volume
+from window_level import IntensityHistogram
+
+# Decoded volumes kept on disk before the least recently used ones are evicted
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+
+
+def source_key(file_paths):
+    # Any change to a source file's path, mtime or size gives a different key
+    digest = hashlib.sha1()
+    for file_path in sorted(os.path.abspath(path) for path in file_paths):
+        stat = os.stat(file_path)
+        digest.update(f"{file_path}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class VolumeCache:
+    # Decoded voxels stored as raw C-ordered arrays next to a JSON sidecar, reopened with np.memmap
+    def __init__(self, cache_root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = cache_root or cache_dir("volumes")
+        self.max_bytes = max_bytes
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key)
+        return base + ".raw", base + ".json"
+
+    def contains(self, key):
+        return all(os.path.exists(path) for path in self._paths(key))
+
+    def get(self, key):
+        raw_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            shape, dtype = tuple(meta["shape"]), np.dtype(meta["dtype"])
+            if os.path.getsize(raw_path) != int(np.prod(shape)) * dtype.itemsize:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Copy-on-write mapping: pages are read on demand and VTK can wrap the buffer directly
+        array = np.memmap(raw_path, dtype=dtype, mode="c", shape=shape)
+        volume = Volume(array, meta["spacing"], meta["origin"], meta["direction"], meta["rescale"])
+        volume.modality = meta.get("modality")
+        if meta.get("histogram"):
+            # Window/level presets come back without another pass over the voxels
+            volume.histogram = IntensityHistogram.from_dict(meta["histogram"])
+            volume.window_presets = {name: tuple(value) for name, value in meta["window_presets"].items()}
+            volume.window_level = tuple(meta["window_level"])
+
+        # The sidecar's mtime is the LRU clock
+        os.utime(meta_path)
+        return volume
+
+    def put(self, key, volume, source=None):
+        raw_path, meta_path = self._paths(key)
+        if source is not None:
+            self.invalidate(source)
+
+        array = np.ascontiguousarray(volume.array)
+        array.tofile(raw_path + ".tmp")
+        os.replace(raw_path + ".tmp", raw_path)
+
+        meta = {
+            "source": source,
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+            "spacing": list(volume.spacing),
+            "origin": list(volume.origin),
+            "direction": list(volume.direction),
+            "rescale": list(volume.rescale),
+            "modality": volume.modality,
+            "window_level": list(volume.default_window_level()),
+            "window_presets": {name: list(value) for name, value in volume.window_presets.items()},
+            "histogram": volume.histogram.to_dict(),
+        }
+        # The sidecar is written last, so a half-written entry is never picked up
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        self.evict(keep=key)
+
+    def invalidate(self, source):
+        # Drop entries decoded from an older version of the same source
+        for meta_path in glob.glob(os.path.join(self.root, "*.json")):
+            try:
+                with open(meta_path) as f:
+                    if json.load(f).get("source") != source:
+                        continue
+            except (OSError, ValueError):
+                continue
+            self._remove(os.path.splitext(os.path.basename(meta_path))[0])
+
+    def evict(self, keep=None):
+        # Remove least recently used entries until the cache fits in max_bytes
+        entries = []
+        for meta_path in glob.glob(os.path.join(self.root, "*.json")):
+            key = os.path.splitext(os.path.basename(meta_path))[0]
+            raw_path = self._paths(key)[0]
+            try:
+                entries.append((os.path.getmtime(meta_path), os.path.getsize(raw_path), key))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                self._remove(key)
+                total -= size
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
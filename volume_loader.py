@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+
+from dicom_index import DicomIndex
+from volume import Volume
+from window_level import IntensityHistogram
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise LoadCancelled()
+
+
+def study_source(file_path, dicom_index=None):
+    # The files a study is decoded from, an id that stays the same when they change, and the DICOM series
+    if file_path.endswith('.mha'):
+        return [file_path], os.path.abspath(file_path), None
+    series = (dicom_index or DicomIndex()).series_for_file(file_path)
+    source = f"{os.path.dirname(os.path.abspath(file_path))}:{series['series_uid']}:{series['series_number']}"
+    return series["files"], source, series
+
+
+def read_dicom_series(dicom_file, on_slice=None, on_progress=None, cancel=None, series=None):
+    # Decode the series containing dicom_file one file at a time with vtkDICOMImageReader, so every
+    # slice can be shown as soon as it is in memory; on_slice(volume, index) is called per slice
+    # The reader modules are only imported once a study is opened, on the loader thread
+    from vtkmodules.util import numpy_support
+    from vtkmodules.vtkIOImage import vtkDICOMImageReader
+
+    if series is None:
+        series = DicomIndex().series_for_file(dicom_file)
+    file_names, positions = series["files"], series["positions"]
+
+    # The histogram behind the default window/level is filled while the slices stream in
+    histogram = IntensityHistogram()
+    volume = None
+    for index, file_name in enumerate(file_names):
+        _check_cancel(cancel)
+        reader = vtkDICOMImageReader()
+        reader.SetFileName(file_name)
+        reader.Update()
+        image_data = reader.GetOutput()
+        width, height, _ = image_data.GetDimensions()
+        pixels = numpy_support.vtk_to_numpy(image_data.GetPointData().GetScalars())
+
+        if volume is None:
+            # The first slice fixes the in-plane geometry and voxel type of the whole series
+            spacing = list(image_data.GetSpacing())
+            if len(positions) > 1 and positions[-1] != positions[0]:
+                spacing[2] = (positions[-1] - positions[0]) / (len(positions) - 1)
+            array = np.empty((len(file_names), height, width), dtype=pixels.dtype)
+            volume = Volume(array, spacing, image_data.GetOrigin())
+            volume.modality = series.get("modality") or None
+
+        volume.array[index] = pixels.reshape(height, width)
+        histogram.add(volume.array[index])
+        if on_slice is not None:
+            on_slice(volume, index)
+        if on_progress is not None:
+            on_progress((index + 1) / len(file_names))
+    volume.set_histogram(histogram)
+    return volume
+
+
+def read_mha(mha_file, on_progress=None, cancel=None):
+    # vtkMetaImageReader decodes the whole file in one pass, so only progress and
+    # cancellation are reported while it runs
+    from vtkmodules.vtkIOImage import vtkMetaImageReader
+
+    reader = vtkMetaImageReader()
+    reader.SetFileName(mha_file)
+
+    def report_progress(caller, event):
+        if cancel is not None and cancel.is_set():
+            caller.SetAbortExecute(1)
+        elif on_progress is not None:
+            on_progress(caller.GetProgress())
+
+    reader.AddObserver("ProgressEvent", report_progress)
+    reader.Update()
+    _check_cancel(cancel)
+
+    image_data = reader.GetOutput()
+    if image_data is None or image_data.GetNumberOfPoints() == 0:
+        raise IOError(f"Failed to load MHA data from {mha_file}")
+    return Volume.from_vtk_image(image_data)
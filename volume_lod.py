@@ -0,0 +1,207 @@
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from volume import Volume
+
+# Default time budget for one 3D frame while the camera is moving
+DEFAULT_FRAME_TIME = 0.05
+
+# OpenGL renderers that rasterize on the CPU, where GPU ray casting is slower than the CPU mappers
+SOFTWARE_RENDERERS = ("llvmpipe", "softpipe", "swrast", "svga3d", "gdi generic", "microsoft basic render")
+
+
+def is_software_rendering(render_window):
+    capabilities = render_window.ReportCapabilities() or ""
+    for line in capabilities.splitlines():
+        if line.lower().startswith("opengl renderer string"):
+            return any(name in line.lower() for name in SOFTWARE_RENDERERS)
+    return False
+
+
+def downsample(volume):
+    # Average 2x2x2 blocks; along an odd axis the last voxel becomes a coarse voxel of its own, so every
+    # dimension is rounded up and nothing at the far edges of the volume is lost
+    array = np.empty(tuple((n + 1) // 2 for n in volume.array.shape), dtype=np.float32)
+    # Per axis: (coarse range, fine range, voxels averaged) for the pairs, then the unpaired last voxel
+    parts = [[(slice(0, n // 2), slice(0, n // 2 * 2), 2)] + [(slice(n // 2, n // 2 + 1), slice(n - 1, n), 1)] * (n % 2)
+             for n in volume.array.shape]
+    for (coarse_z, fine_z, fz), (coarse_y, fine_y, fy), (coarse_x, fine_x, fx) in itertools.product(*parts):
+        block = volume.array[fine_z, fine_y, fine_x]
+        if block.size:
+            depth, height, width = block.shape[0] // fz, block.shape[1] // fy, block.shape[2] // fx
+            array[coarse_z, coarse_y, coarse_x] = block.reshape(depth, fz, height, fy, width, fx).mean(
+                axis=(1, 3, 5), dtype=np.float32)
+    spacing = tuple(s * 2 for s in volume.spacing)
+    origin = tuple(o + s / 2 for o, s in zip(volume.origin, volume.spacing))
+    return Volume(array.astype(volume.array.dtype), spacing, origin, volume.direction, volume.rescale)
+
+
+class VolumePyramid:
+    # Level 0 is the full volume; each further level halves every dimension, built on first use
+    def __init__(self, volume, levels=4):
+        self.levels = [volume] + [None] * (levels - 1)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def image(self, level):
+        if self.levels[level] is None:
+            self.levels[level] = downsample(self.volume(level - 1))
+        return self.levels[level].to_vtk_image()
+
+    def volume(self, level):
+        self.image(level)
+        return self.levels[level]
+
+
+def volume_rendering():
+    # The volume mappers and their OpenGL implementations are only loaded once something is volume rendered
+    import vtkmodules.vtkRenderingVolumeOpenGL2  # noqa: F401
+    from vtkmodules import vtkRenderingVolume
+    return vtkRenderingVolume
+
+
+class LODVolumeRenderer:
+    # CPU ray casting that drops to a coarser pyramid level while the camera moves and refines when it stops
+    def __init__(self, volume, vtk_volume, renderer, frame_time=DEFAULT_FRAME_TIME, levels=4, mapper=None,
+                 request_render=None):
+        self.pyramid = VolumePyramid(volume, levels)
+        self.vtk_volume = vtk_volume
+        self.renderer = renderer
+        self.frame_time = frame_time
+        # How the full-resolution frame is asked for once the camera stops; the viewer passes one that goes
+        # through its render scheduler, standalone use renders straight away
+        self.request_render = request_render or (lambda: self.renderer.GetRenderWindow().Render())
+        self.render_times = {}
+        self.level = 0
+
+        # A mapper can be passed in to be reused across volumes
+        self.mapper = mapper or volume_rendering().vtkFixedPointVolumeRayCastMapper()
+        self.mapper.SetInputData(self.pyramid.image(0))
+        # The pyramid already bounds the frame cost; keep ray sampling fixed per level
+        self.mapper.AutoAdjustSampleDistancesOff()
+        self.mapper.SetImageSampleDistance(1.0)
+        spacing = min(volume.spacing)
+        self.mapper.SetSampleDistance(spacing)
+        self.mapper.SetInteractiveSampleDistance(spacing)
+        self.vtk_volume.SetMapper(self.mapper)
+
+        self.interactor = None
+        self._observers = []
+        self._render_observer = renderer.AddObserver("EndEvent", self.on_render_end)
+
+    def attach(self, interactor):
+        self.interactor = interactor
+        self._observers = [
+            interactor.AddObserver("StartInteractionEvent", self.on_start_interaction),
+            interactor.AddObserver("EndInteractionEvent", self.on_end_interaction),
+        ]
+
+    def detach(self):
+        if self.interactor is not None:
+            for tag in self._observers:
+                self.interactor.RemoveObserver(tag)
+        self.renderer.RemoveObserver(self._render_observer)
+        self.interactor = None
+        self._observers = []
+
+    def set_frame_time(self, seconds):
+        self.frame_time = max(float(seconds), 0.001)
+
+    def estimated_time(self, level):
+        # Measured time if this level has been drawn, otherwise scaled from the nearest measured level
+        if level in self.render_times:
+            return self.render_times[level]
+        if not self.render_times:
+            return None
+        measured = min(self.render_times, key=lambda known: abs(known - level))
+        return self.render_times[measured] / 4 ** (level - measured)
+
+    def interactive_level(self):
+        for level in range(len(self.pyramid)):
+            estimate = self.estimated_time(level)
+            if estimate is None or estimate <= self.frame_time:
+                return level
+        return len(self.pyramid) - 1
+
+    def set_level(self, level):
+        if level != self.level:
+            self.level = level
+            self.mapper.SetInputData(self.pyramid.image(level))
+            # Coarser levels also cast fewer rays, so the cost drops with both volume and image size
+            spacing = min(self.pyramid.volume(level).spacing)
+            self.mapper.SetSampleDistance(spacing)
+            self.mapper.SetInteractiveSampleDistance(spacing)
+            self.mapper.SetImageSampleDistance(2 ** level)
+
+    def on_render_end(self, caller, event):
+        self.render_times[self.level] = self.renderer.GetLastRenderTimeInSeconds()
+
+    def on_start_interaction(self, caller, event):
+        self.set_level(self.interactive_level())
+
+    def on_end_interaction(self, caller, event):
+        if self.level != 0:
+            self.set_level(0)
+            self.request_render()
+
+
+def benchmark_offscreen(volume, property_factory, size=(512, 512), frames=5, levels=4):
+    # Render every pyramid level in an offscreen window and report the mean frame time per level
+    import vtkmodules.vtkRenderingOpenGL2  # noqa: F401
+    from vtkmodules.vtkRenderingCore import vtkRenderer, vtkRenderWindow, vtkVolume
+
+    render_window = vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(*size)
+    renderer = vtkRenderer()
+    render_window.AddRenderer(renderer)
+
+    vtk_volume = vtkVolume()
+    vtk_volume.SetProperty(property_factory(volume))
+    lod = LODVolumeRenderer(volume, vtk_volume, renderer, levels=levels)
+    renderer.AddVolume(vtk_volume)
+    renderer.ResetCamera()
+
+    results = {}
+    for level in range(levels):
+        lod.set_level(level)
+        render_window.Render()  # First frame includes setup costs
+        start = time.perf_counter()
+        for frame in range(frames):
+            renderer.GetActiveCamera().Azimuth(360.0 / frames)
+            render_window.Render()
+        results[level] = (time.perf_counter() - start) / frames
+    lod.detach()
+    return results
+
+
+def ramp_property(volume):
+    # Linear opacity and grey ramp over the volume's default window, as in the viewer's 3D panel
+    from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
+    from vtkmodules.vtkRenderingCore import vtkColorTransferFunction, vtkVolumeProperty
+
+    window, level = volume.default_window_level()
+    volume_property = vtkVolumeProperty()
+    volume_property.ShadeOn()
+    volume_property.SetInterpolationTypeToLinear()
+    opacity = vtkPiecewiseFunction()
+    opacity.AddPoint(level - window / 2, 0.0)
+    opacity.AddPoint(level + window / 2, 1.0)
+    volume_property.SetScalarOpacity(opacity)
+    color = vtkColorTransferFunction()
+    color.AddRGBPoint(level - window / 2, 0.0, 0.0, 0.0)
+    color.AddRGBPoint(level + window / 2, 1.0, 1.0, 1.0)
+    volume_property.SetColor(color)
+    return volume_property
+
+
+if __name__ == "__main__":
+    # python volume_lod.py <file.mha>: offscreen, software-rendered timings per pyramid level
+    from volume_loader import read_mha
+
+    for level, seconds in benchmark_offscreen(read_mha(sys.argv[1]), ramp_property).items():
+        print(f"level {level}: {seconds * 1000:.1f} ms/frame")
@@ -0,0 +1,131 @@
+import numpy as np
+
+# Bins kept by the streaming histogram; the bin width doubles whenever the value range grows
+HISTOGRAM_BINS = 4096
+
+# Percentiles bounding the default window, so air and metal outliers do not stretch it
+DEFAULT_PERCENTILES = (0.5, 99.5)
+
+# CT presets as (window, level) in Hounsfield units
+CT_PRESETS = (
+    ("Soft tissue", (400.0, 40.0)),
+    ("Lung", (1500.0, -600.0)),
+    ("Bone", (1800.0, 400.0)),
+    ("Brain", (80.0, 40.0)),
+)
+
+# (window, level) used when there are no voxel values to derive one from
+EMPTY_WINDOW_LEVEL = (1.0, 0.0)
+
+# Voxels processed per chunk when a histogram is built from an already decoded volume
+CHUNK_VOXELS = 1 << 22
+
+
+class IntensityHistogram:
+    # Fixed number of equal-width bins starting at `low`, widened by merging bin pairs as new values arrive
+    def __init__(self, bins=HISTOGRAM_BINS):
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.low = None
+        self.width = None
+        self.minimum = None
+        self.maximum = None
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def add(self, chunk):
+        if chunk.size == 0:
+            return
+        chunk_min, chunk_max = float(chunk.min()), float(chunk.max())
+        if self.low is None:
+            self._start(chunk_min, chunk_max, np.issubdtype(chunk.dtype, np.integer))
+        self.minimum = chunk_min if self.minimum is None else min(self.minimum, chunk_min)
+        self.maximum = chunk_max if self.maximum is None else max(self.maximum, chunk_max)
+        self._cover(chunk_min, chunk_max)
+
+        indices = np.subtract(chunk, self.low, dtype=np.float64)
+        indices /= self.width
+        indices = np.clip(indices, 0, self.bins - 1).astype(np.intp)
+        self.counts += np.bincount(indices.ravel(), minlength=self.bins)
+
+    def _start(self, low, high, integer):
+        self.low = low
+        span = (high - low) * 1.0001 / self.bins
+        if integer:
+            # Power-of-two widths keep integer values on bin boundaries through every doubling
+            self.width = float(2 ** int(np.ceil(np.log2(max(span, 1.0)))))
+        else:
+            self.width = span if span > 0 else max(abs(low), 1.0) * 1e-6
+
+    def _cover(self, low, high):
+        half = self.bins // 2
+        while low < self.low or high >= self.low + self.width * self.bins:
+            merged = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts = np.zeros(self.bins, dtype=np.int64)
+            if low < self.low:
+                # Grow downwards: the old range becomes the upper half
+                self.counts[half:] = merged
+                self.low -= self.width * self.bins
+            else:
+                self.counts[:half] = merged
+            self.width *= 2
+
+    def percentile(self, q):
+        total = self.total
+        if not total:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        target = total * q / 100.0
+        index = int(np.searchsorted(cumulative, target))
+        index = min(index, self.bins - 1)
+        before = cumulative[index - 1] if index else 0
+        fraction = (target - before) / self.counts[index] if self.counts[index] else 0.0
+        value = self.low + (index + fraction) * self.width
+        return float(min(max(value, self.minimum), self.maximum))
+
+    def to_dict(self):
+        return {"low": self.low, "width": self.width, "minimum": self.minimum, "maximum": self.maximum,
+                "counts": self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(len(data["counts"]))
+        histogram.counts = np.asarray(data["counts"], dtype=np.int64)
+        histogram.low, histogram.width = data["low"], data["width"]
+        histogram.minimum, histogram.maximum = data["minimum"], data["maximum"]
+        return histogram
+
+
+def histogram_of(array):
+    # Single pass over an already decoded volume, a few slices at a time
+    histogram = IntensityHistogram()
+    slices_per_chunk = max(1, CHUNK_VOXELS // max(1, array[0].size))
+    for start in range(0, array.shape[0], slices_per_chunk):
+        histogram.add(array[start:start + slices_per_chunk])
+    return histogram
+
+
+def looks_like_ct(histogram, rescale=(1.0, 0.0)):
+    # Hounsfield data has a large share of air at about -1000 HU and nothing far below it
+    if histogram.minimum is None:
+        return False
+    slope, intercept = rescale
+    low = histogram.percentile(1.0) * slope + intercept
+    minimum = histogram.minimum * slope + intercept
+    return low <= -800 and minimum >= -3100
+
+
+def window_presets(histogram, modality=None, rescale=(1.0, 0.0)):
+    # Named (window, level) pairs in stored voxel units; the first one is the default
+    if histogram.minimum is None:
+        return {"Default": EMPTY_WINDOW_LEVEL}
+    low, high = (histogram.percentile(q) for q in DEFAULT_PERCENTILES)
+    presets = {"Default": (max(high - low, 1e-6), (high + low) / 2)}
+    if modality == "CT" or (modality is None and looks_like_ct(histogram, rescale)):
+        slope, intercept = rescale
+        for name, (window, level) in CT_PRESETS:
+            presets[name] = (window / slope, (level - intercept) / slope)
+    presets["Full range"] = (histogram.maximum - histogram.minimum, (histogram.maximum + histogram.minimum) / 2)
+    return presets